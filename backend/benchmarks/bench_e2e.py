@@ -0,0 +1,372 @@
+"""
+Benchmark: end-to-end latency of the FastAPI app against local service stand-ins.
+
+Starts the app in process (uvicorn on a free port) with GitHub, Captain, Morph,
+Slack, OpenAI and Supabase replaced by the stand-ins in stand_ins.py, each
+answering after a configurable latency, and Metorial replaced by a short tool
+loop. Then it drives realistic workloads:
+
+    slack-burst      concurrent /slack/events mentions (chat, repo questions,
+                     code changes, proposals), timed until each agent run ends
+    propose          POST /northstar/propose
+    approve-execute  POST /proposals/{id}/approve (approval -> PR creation)
+    initialize-repo  POST /northstar/initialize-repo on generated repositories
+
+and reports throughput plus p50/p95/p99 per stage, taken from the app's own
+trace spans. Results are compared with a stored
+baseline; a stage whose p95 grew past the tolerance is a regression and the
+run exits with status 1.
+
+Usage (from backend/):
+    python -m benchmarks.bench_e2e
+    python -m benchmarks.bench_e2e --scenarios slack-burst --burst 50 --latency openai=0.8
+    python -m benchmarks.bench_e2e --repo-sizes 1000,10000,100000 --save-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List
+
+import httpx
+
+from benchmarks.stand_ins import (
+    CaptainStandIn, GitHubStandIn, MorphStandIn, OpenAIStandIn, SlackStandIn, SupabaseStandIn,
+    create_repository, git_redirect_env, stand_in_metorial_run
+)
+
+SCENARIOS = ["slack-burst", "propose", "approve-execute", "initialize-repo"]
+DEFAULT_LATENCY = {"openai": 0.3, "github": 0.05, "captain": 0.3, "morph": 0.2, "slack": 0.05, "supabase": 0.01}
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "e2e.json"
+APP_REPO = "bench/app"
+GITHUB_TOKEN = "bench-token"
+BENCH_USER = "U-bench"
+SLACK_MESSAGES = [
+    "hey northstar",
+    "northstar what does this repo do?",
+    "northstar change the signup button text to Start free trial",
+    "northstar propose an experiment for the landing page",
+]
+MIN_REGRESSION_MS = 5.0  # p95 changes smaller than this are noise
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile (values need not be sorted)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(durations_ms: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(durations_ms),
+        "p50_ms": round(percentile(durations_ms, 50), 1),
+        "p95_ms": round(percentile(durations_ms, 95), 1),
+        "p99_ms": round(percentile(durations_ms, 99), 1),
+    }
+
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    latency = dict(DEFAULT_LATENCY)
+    for item in filter(None, (spec or "").split(",")):
+        service, _, seconds = item.partition("=")
+        if service not in latency:
+            raise SystemExit(f"Unknown service {service!r} in --latency (expected one of {sorted(latency)})")
+        latency[service] = float(seconds)
+    return latency
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Harness:
+    """Stand-ins, environment and the running app."""
+
+    def __init__(self, workdir: Path, latency: Dict[str, float], repo_sizes: List[int], context_files: int):
+        self.workdir = workdir
+        self.span_file = workdir / "spans.jsonl"
+        self.repos = {APP_REPO: create_repository(workdir / "repos" / "app", context_files)}
+        for size in repo_sizes:
+            print(f"Generating bench/init-{size} ({size} files) ...")
+            self.repos[f"bench/init-{size}"] = create_repository(workdir / "repos" / f"init-{size}", size)
+
+        self.openai = OpenAIStandIn(latency["openai"]).start()
+        self.supabase = SupabaseStandIn(latency["supabase"]).start()
+        self.github = GitHubStandIn(self.repos, latency["github"]).start()
+        self.captain = CaptainStandIn(latency["captain"]).start()
+        self.morph = MorphStandIn(latency["morph"]).start()
+        self.slack = SlackStandIn(latency["slack"]).start()
+        self.supabase.insert("repositories", {
+            "repo_fullname": APP_REPO, "owner": "bench", "repo_name": "app", "is_active": True,
+            "default_branch": "main", "base_branch": "main", "user_id": BENCH_USER
+        })
+        self.server = None
+        self.base_url = None
+
+    def environment(self) -> Dict[str, str]:
+        return {
+            "SUPABASE_URL": self.supabase.url, "SUPABASE_ANON_KEY": "bench",
+            "OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": f"{self.openai.url}/v1",
+            "METORIAL_API_KEY": "bench",
+            "GITHUB_TOKEN": GITHUB_TOKEN, "GITHUB_API_URL": self.github.url,
+            "CAPTAIN_API_KEY": "bench", "CAPTAIN_ORGANIZATION_ID": "bench", "CAPTAIN_BASE_URL": self.captain.url,
+            "MORPH_API_KEY": "bench", "MORPH_BASE_URL": f"{self.morph.url}/v1",
+            "SLACK_BOT_TOKEN": "xoxb-bench", "SLACK_API_URL": f"{self.slack.url}/api",
+            "SLACK_DEPLOYMENT_ID": "dep-slack", "SLACK_OAUTH_SESSION_ID": "oauth-bench",
+            "NORTHSTAR_DEPLOYMENT_ID": "dep-northstar", "POSTHOG_DEPLOYMENT_ID": "dep-posthog",
+            "NORTHSTAR_MCP_WARM_ON_STARTUP": "false", "NORTHSTAR_REPLAY_MODE": "",
+            "NORTHSTAR_CACHE_DIR": str(self.workdir / "cache"),
+            **git_redirect_env(self.repos, GITHUB_TOKEN),
+        }
+
+    def start_app(self) -> None:
+        os.environ.update(self.environment())
+        # Metorial speaks MCP, not plain HTTP: swap in the tool loop before the app creates its client
+        from metorial import Metorial
+        Metorial.run = stand_in_metorial_run(self.slack)
+
+        import uvicorn
+        import main
+        import tracing
+        main.llm.sessions = None  # no MCP sessions behind the stand-in
+        # tracing may already be imported (via the stand-ins), so set the span file on the collector
+        tracing.collector.trace_file = str(self.span_file)
+
+        port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=self.server.run, name="bench-app", daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.05)
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.should_exit = True
+        for stand_in in (self.openai, self.supabase, self.github, self.captain, self.morph, self.slack):
+            stand_in.stop()
+
+    def spans_since(self, started_at: float) -> List[Dict[str, Any]]:
+        if not self.span_file.exists():
+            return []
+        spans = []
+        with open(self.span_file) as f:
+            for line in f:
+                span = json.loads(line)
+                if span["start_time"] >= started_at and span.get("duration_ms") is not None:
+                    spans.append(span)
+        return spans
+
+
+async def timed_requests(base_url: str, requests_: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    """Send requests with bounded concurrency; returns status and latency of each."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(client: httpx.AsyncClient, request: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            detail = None
+            try:
+                response = await client.request(request["method"], request["path"], json=request.get("json"),
+                                                headers={"X-User-ID": BENCH_USER})
+                status = response.status_code
+                if status >= 400:
+                    detail = response.text[:300]
+            except httpx.HTTPError as e:
+                status = f"{type(e).__name__}"
+                detail = str(e)[:300]
+            return {"status": status, "ms": (time.perf_counter() - started) * 1000, "detail": detail}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        return await asyncio.gather(*(send(client, request) for request in requests_))
+
+
+def wait_for_spans(harness: Harness, name: str, count: int, started_at: float, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if sum(1 for span in harness.spans_since(started_at) if span["name"] == name) >= count:
+            return
+        time.sleep(0.2)
+    print(f"  warning: only some {name} spans finished within {timeout:.0f}s")
+
+
+def wait_for_quiet(stand_in, timeout: float) -> None:
+    """Wait until a stand-in stops receiving requests (e.g. background indexing has finished)."""
+    quiet = max(1.0, 3 * stand_in.latency)
+    deadline = time.monotonic() + timeout
+    seen, changed_at = stand_in.requests, time.monotonic()
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        if stand_in.requests != seen:
+            seen, changed_at = stand_in.requests, time.monotonic()
+        elif time.monotonic() - changed_at >= quiet:
+            return
+    print(f"  warning: {stand_in.name} was still busy after {timeout:.0f}s")
+
+
+def scenario_requests(name: str, harness: Harness, args) -> List[Dict[str, Any]]:
+    if name == "slack-burst":
+        return [{
+            "method": "POST", "path": "/slack/events",
+            "json": {"type": "event_callback", "event": {
+                "type": "app_mention", "text": SLACK_MESSAGES[i % len(SLACK_MESSAGES)],
+                "channel": f"C-bench-{i}", "user": BENCH_USER
+            }}
+        } for i in range(args.burst)]
+    if name == "propose":
+        return [{"method": "POST", "path": "/northstar/propose", "json": {"oauth_session_id": "oauth-bench"}}
+                for _ in range(args.requests)]
+    if name == "approve-execute":
+        requests_ = []
+        for _ in range(args.requests):
+            proposal_id = f"exp-bench-{uuid.uuid4().hex[:8]}"
+            harness.supabase.insert("proposals", {
+                "proposal_id": proposal_id, "status": "pending", "idea_summary": "Clarify the signup button",
+                "technical_plan": [{"file": "src/App.jsx", "action": "Change button copy"}],
+                "oauth_session_id": "oauth-bench"
+            })
+            requests_.append({
+                "method": "POST", "path": f"/proposals/{proposal_id}/approve",
+                "json": {"proposal_id": proposal_id, "update_block": "// ... existing code ...\n<button>Start free trial</button>"}
+            })
+        return requests_
+    if name == "initialize-repo":
+        return [{"method": "POST", "path": "/northstar/initialize-repo",
+                 "json": {"repo": full_name, "oauth_session_id": "oauth-bench"}}
+                for full_name in harness.repos if full_name.startswith("bench/init-")]
+    raise SystemExit(f"Unknown scenario {name!r} (expected one of {SCENARIOS})")
+
+
+def run_scenario(name: str, harness: Harness, args) -> Dict[str, Any]:
+    requests_ = scenario_requests(name, harness, args)
+    concurrency = len(requests_) if name == "slack-burst" else (1 if name == "initialize-repo" else args.concurrency)
+    print(f"{name}: {len(requests_)} request(s), concurrency {concurrency}")
+
+    started_at = time.time()
+    started = time.perf_counter()
+    results = asyncio.run(timed_requests(harness.base_url, requests_, concurrency))
+    if name == "slack-burst":
+        # The webhook answers immediately; the work is done when every agent run has ended
+        wait_for_spans(harness, "agent.run", len(requests_), started_at, args.timeout)
+    elif name == "initialize-repo":
+        # Files are uploaded to Captain in a background task after the response
+        wait_for_quiet(harness.captain, args.timeout)
+    wall = time.perf_counter() - started
+
+    stages: Dict[str, List[float]] = {"client": [r["ms"] for r in results]}
+    for span in harness.spans_since(started_at):
+        stages.setdefault(span["name"], []).append(span["duration_ms"])
+    failed = [r for r in results if r["detail"] is not None or not isinstance(r["status"], int)]
+    errors = [r["status"] for r in failed]
+    return {
+        "requests": len(requests_),
+        "errors": len(errors),
+        "error_statuses": sorted(set(map(str, errors))),
+        "error_sample": failed[0]["detail"] if failed else None,
+        "wall_seconds": round(wall, 2),
+        "throughput_rps": round(len(requests_) / wall, 2) if wall else 0.0,
+        "stages": {stage: summarize(values) for stage, values in sorted(stages.items())}
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    for name, result in report["scenarios"].items():
+        print(f"\n{name}: {result['requests']} requests, {result['errors']} errors, "
+              f"{result['throughput_rps']} req/s ({result['wall_seconds']}s)")
+        if result["error_statuses"]:
+            print(f"  error statuses: {', '.join(result['error_statuses'])}")
+            print(f"  first error: {result['error_sample']}")
+        print(f"  {'stage':<44} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for stage, stats in result["stages"].items():
+            print(f"  {stage:<44} {stats['count']:>5} {stats['p50_ms']:>10.1f} {stats['p95_ms']:>10.1f} {stats['p99_ms']:>10.1f}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Stages whose p95 regressed against the baseline by more than the tolerance."""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        base_stages = baseline.get("scenarios", {}).get(name, {}).get("stages", {})
+        for stage, stats in result["stages"].items():
+            base = base_stages.get(stage)
+            if not base:
+                continue
+            delta = stats["p95_ms"] - base["p95_ms"]
+            if delta > MIN_REGRESSION_MS and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name} / {stage}: p95 {base['p95_ms']:.1f} -> {stats['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS), help='Comma-separated scenarios to run')
+    parser.add_argument('--latency', default="", help='Per-service latency in seconds, e.g. openai=0.8,github=0.1')
+    parser.add_argument('--burst', type=int, default=20, help='Slack events sent at once in slack-burst')
+    parser.add_argument('--requests', type=int, default=5, help='Requests per propose/approve-execute run')
+    parser.add_argument('--concurrency', type=int, default=2, help='Concurrent propose/approve-execute requests')
+    parser.add_argument('--repo-sizes', default="1000,10000", help='Generated repo sizes for initialize-repo')
+    parser.add_argument('--context-files', type=int, default=200, help='Generated files in the active repository')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for background agent runs')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='Baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p95 growth per stage')
+    parser.add_argument('--output', type=Path, help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    repo_sizes = [int(n) for n in args.repo_sizes.split(",") if n.strip()] if "initialize-repo" in scenarios else []
+    latency = parse_latency(args.latency)
+
+    workdir = Path(tempfile.mkdtemp(prefix='northstar_bench_e2e_'))
+    harness = None
+    try:
+        harness = Harness(workdir, latency, repo_sizes, args.context_files)
+        harness.start_app()
+        report = {
+            "latency": latency,
+            "parameters": {"burst": args.burst, "requests": args.requests, "concurrency": args.concurrency,
+                           "repo_sizes": repo_sizes, "context_files": args.context_files},
+            "scenarios": {name: run_scenario(name, harness, args) for name in scenarios}
+        }
+    finally:
+        if harness is not None:
+            harness.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("latency") != latency or baseline.get("parameters") != report["parameters"]:
+            print("\nBaseline was recorded with different latency/parameters; comparison may not be meaningful")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (p95 > +{args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark: single-pass scan_repository vs. the old pair of os.walk passes.
+
+Generates a synthetic checkout and times how long initialize_repo's file
+discovery takes both ways.
+
+Usage (from backend/):
+    python -m benchmarks.bench_repo_scan --files 200000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Dict, Any
+
+from repo_indexer import scan_repository
+
+
+def legacy_get_indexable_files(repo_dir: Path) -> List[Path]:
+    """The os.walk + Path.stat() implementation scan_repository replaced."""
+    ignore_dirs = {
+        '.git', 'node_modules', 'venv', '__pycache__', 'dist', 'build',
+        '.next', '.nuxt', 'coverage', '.pytest_cache', '.mypy_cache'
+    }
+    ignore_files = {
+        '.DS_Store', 'Thumbs.db', 'package-lock.json', 'yarn.lock',
+        'pnpm-lock.yaml', '.gitignore'
+    }
+    indexable_extensions = {
+        '.pdf', '.docx', '.txt', '.md', '.xlsx', '.xls', '.csv', '.json',
+        '.pptx', '.ppt', '.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff',
+        '.py', '.ts', '.js', '.html', '.css', '.php', '.java',
+        '.tsx', '.jsx', '.vue', '.svelte', '.go', '.rs', '.rb',
+        '.c', '.cpp', '.h', '.hpp', '.sh', '.bash', '.yaml', '.yml',
+        '.toml', '.xml', '.sql', '.graphql', '.proto'
+    }
+
+    files_to_index = []
+    for root, dirs, files in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+        for file in files:
+            if file in ignore_files:
+                continue
+            file_path = Path(root) / file
+            if file_path.suffix.lower() not in indexable_extensions:
+                continue
+            try:
+                if file_path.stat().st_size > 1_000_000:
+                    continue
+            except OSError:
+                continue
+            files_to_index.append(file_path)
+    return files_to_index
+
+
+def legacy_analyze_repository_structure(repo_dir: Path) -> Dict[str, Any]:
+    """The second os.walk pass scan_repository replaced."""
+    structure = {
+        'directories': [],
+        'file_counts_by_type': {},
+        'total_files': 0,
+        'languages_detected': set()
+    }
+    ignore_dirs = {'.git', 'node_modules', 'venv', '__pycache__'}
+    for root, dirs, files in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+        rel_path = Path(root).relative_to(repo_dir)
+        if str(rel_path) != '.':
+            structure['directories'].append(str(rel_path))
+        for file in files:
+            structure['total_files'] += 1
+            ext = Path(file).suffix.lower()
+            structure['file_counts_by_type'][ext] = structure['file_counts_by_type'].get(ext, 0) + 1
+    structure['languages_detected'] = list(structure['languages_detected'])
+    return structure
+
+
+def generate_tree(root: Path, total_files: int, seed: int = 42) -> None:
+    """Create a synthetic repo: nested source dirs, a node_modules blob and a .gitignore."""
+    rng = random.Random(seed)
+    extensions = ['.py', '.js', '.jsx', '.ts', '.tsx', '.css', '.md', '.json', '.png', '.lock', '.txt']
+    (root / '.gitignore').write_text("node_modules/\n*.log\n/dist\n")
+
+    files_per_dir = 40
+    written = 0
+    dir_index = 0
+    while written < total_files:
+        depth = rng.randint(1, 5)
+        parts = [f"pkg{rng.randint(0, 30)}" for _ in range(depth - 1)] + [f"mod{dir_index}"]
+        if dir_index % 10 == 0:
+            parts = ['node_modules'] + parts
+        directory = root.joinpath(*parts)
+        directory.mkdir(parents=True, exist_ok=True)
+        for i in range(min(files_per_dir, total_files - written)):
+            ext = rng.choice(extensions)
+            path = directory / f"file{i}{ext}"
+            if ext == '.png':
+                path.write_bytes(b'\x89PNG\r\n\x1a\n\0\0')
+            else:
+                path.write_text(f"// file {written}\n")
+            written += 1
+        dir_index += 1
+
+
+def time_call(label: str, fn, repeat: int) -> float:
+    """Run fn `repeat` times and return the best wall time."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<40} {best * 1000:9.1f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200_000, help='Number of files to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant (best is reported)')
+    parser.add_argument('--git', action='store_true', help='Also benchmark a git checkout (git ls-files path)')
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix='northstar_bench_scan_'))
+    try:
+        print(f"Generating {args.files} files under {root} ...")
+        generate_tree(root, args.files)
+
+        print("Plain directory (.gitignore parsing):")
+        legacy = time_call(
+            'legacy: 2x os.walk',
+            lambda: (legacy_analyze_repository_structure(root), legacy_get_indexable_files(root)),
+            args.repeat
+        )
+        single = time_call('scan_repository', lambda: scan_repository(root), args.repeat)
+        no_sniff = time_call(
+            'scan_repository(sniff_binary=False)',
+            lambda: scan_repository(root, sniff_binary=False),
+            args.repeat
+        )
+        print(f"  speedup: {legacy / single:.2f}x ({legacy / no_sniff:.2f}x without binary sniffing)")
+
+        if args.git:
+            subprocess.run(['git', 'init', '-q'], cwd=root, check=True)
+            subprocess.run(['git', 'add', '-A'], cwd=root, check=True)
+            print("Git checkout (git ls-files):")
+            single_git = time_call('scan_repository', lambda: scan_repository(root), args.repeat)
+            print(f"  speedup vs legacy: {legacy / single_git:.2f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
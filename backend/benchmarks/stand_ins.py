@@ -0,0 +1,568 @@
+"""
+Local stand-ins for the services Northstar calls, for offline benchmarks.
+
+Each stand-in is a small HTTP server on 127.0.0.1 that answers the subset of
+its service's API the backend uses, after an injected latency:
+
+    openai    /v1/chat/completions (plain, JSON mode and streamed)
+    supabase  PostgREST /rest/v1/{table} (eq/in filters, order, limit), in memory
+    github    the REST endpoints PyGithub needs for context fetching and PRs,
+              serving files from generated repositories on disk
+    captain   database/upload/query endpoints plus its OpenAI-compatible /v1
+    morph     /v1/chat/completions for Fast Apply merges
+    slack     chat.postMessage / chat.update
+
+Metorial runs MCP sessions rather than plain HTTP, so it is replaced in
+process: stand_in_metorial_run() walks a short tool loop against the OpenAI
+stand-in (through the client the gateway passes) and posts to the Slack
+stand-in.
+
+git clones of github.com are redirected to the generated repositories with
+git_redirect_env().
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit, unquote
+
+import requests
+from metorial_core.types import RunResult
+
+from benchmarks.bench_repo_scan import generate_tree
+
+
+class StandIn:
+    """HTTP server answering one service's API after an injected latency."""
+
+    name = "service"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2):
+        """
+        Args:
+            latency: Seconds added to every response
+            jitter: Relative random variation of the latency (0.2 = +-20%)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StandIn":
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with stand_in._lock:
+                    stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency * (1 + random.uniform(-stand_in.jitter, stand_in.jitter)))
+                extra_headers: Dict[str, str] = {}
+                try:
+                    result = stand_in.handle(
+                        self.command, unquote(parts.path), dict(parse_qsl(parts.query)), body, self.headers
+                    )
+                    status, payload, content_type = result[:3]
+                    if len(result) > 3:
+                        extra_headers = result[3]
+                except Exception as e:
+                    status, payload, content_type = 500, {"message": f"{type(e).__name__}: {e}"}, "application/json"
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in {**stand_in.response_headers(), **extra_headers}.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"stand-in-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes, headers) -> Tuple:
+        """Answer a request: (status, JSON-serializable payload or bytes, content type[, extra headers])."""
+        raise NotImplementedError
+
+    def response_headers(self) -> Dict[str, str]:
+        """Extra headers sent with every response."""
+        return {}
+
+
+# --- OpenAI-compatible completions ------------------------------------------
+
+_TRIAGE_RULES = [
+    (re.compile(r"\b(propose|experiment|suggest)", re.I), "EXPERIMENT_PROPOSAL"),
+    (re.compile(r"\b(change|make a pr|update|add|rename|fix)\b", re.I), "CODE_CHANGE"),
+    (re.compile(r"\b(dau|mau|retention|conversion|signups|analytics)\b", re.I), "ANALYTICS_QUERY"),
+    (re.compile(r"\b(what does|tell me about|how does|repo)\b", re.I), "REPO_ANALYSIS"),
+]
+
+
+def _completion(model: str, content: Optional[str] = None, tool_calls: Optional[List[Dict]] = None,
+                prompt_chars: int = 0) -> Dict[str, Any]:
+    completion_tokens = max(1, len(content or json.dumps(tool_calls or [])) // 4)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+            "message": {"role": "assistant", "content": content, "tool_calls": tool_calls}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_chars // 4 + completion_tokens
+        }
+    }
+
+
+def _stream(completion: Dict[str, Any]) -> bytes:
+    """A completion as server-sent events: a few content chunks, then usage."""
+    text = completion["choices"][0]["message"]["content"] or ""
+    base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+            "model": completion["model"]}
+    events = []
+    step = max(1, len(text) // 8)
+    for i in range(0, len(text), step):
+        events.append({**base, "choices": [{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}]})
+    events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    events.append({**base, "choices": [], "usage": completion["usage"]})
+    return b"".join(f"data: {json.dumps(e)}\n\n".encode("utf-8") for e in events) + b"data: [DONE]\n\n"
+
+
+class OpenAIStandIn(StandIn):
+    """Chat completions whose answers fit the prompt shapes the backend sends."""
+
+    name = "openai"
+
+    def __init__(self, latency: float = 0.0, tool_steps: int = 2, **kwargs):
+        """
+        Args:
+            latency: Seconds per completion
+            tool_steps: Tool calls made before a tool-enabled conversation gets its final answer
+        """
+        super().__init__(latency, **kwargs)
+        self.tool_steps = tool_steps
+
+    def answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        messages = request.get("messages", [])
+        prompt = "\n".join(str(m.get("content") or "") for m in messages)
+        model = request.get("model", "stand-in")
+
+        if request.get("tools"):
+            tool_results = sum(1 for m in messages if m.get("role") == "tool")
+            if tool_results < self.tool_steps:
+                call = {
+                    "id": f"call_{uuid.uuid4().hex[:8]}",
+                    "type": "function",
+                    "function": {"name": request["tools"][0]["function"]["name"], "arguments": "{}"}
+                }
+                return _completion(model, None, [call], len(prompt))
+
+        if "Classify the request" in prompt:
+            user_request = re.search(r'User request: "(.*?)"', prompt, re.S)
+            text = user_request.group(1) if user_request else prompt
+            label = next((label for rule, label in _TRIAGE_RULES if rule.search(text)), "CASUAL_CHAT")
+            return _completion(model, label, prompt_chars=len(prompt))
+
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            paths = re.findall(r"^=== (.+?) ===$", prompt, re.M)
+            content = json.dumps({
+                "file_path": paths[0] if paths else "README.md",
+                "update_block": "// ... existing code ...\nexport const BENCHMARK = true;\n// ... existing code ...",
+                "summary": "Benchmark change",
+                "confidence": 0.9
+            })
+            return _completion(model, content, prompt_chars=len(prompt))
+
+        if '"proposal_id"' in prompt or 'idea_summary' in prompt:
+            files = re.findall(r"FILE: (\S+)", prompt) or re.findall(r"^=== (.+?) ===$", prompt, re.M)
+            content = json.dumps({
+                "proposal_id": f"exp-{uuid.uuid4().hex[:8]}",
+                "idea_summary": "Improve the primary call to action on the landing page",
+                "rationale": "The stand-in always proposes the same change so runs are comparable across commits. " * 2,
+                "expected_impact": {"metric": "conversion_rate", "delta_pct": 0.05},
+                "technical_plan": [{"file": files[0] if files else "src/App.jsx", "action": "Clarify button copy"}],
+                "update_block": "// ... existing code ...\n- Sign up\n+ Start free trial\n// ... existing code ...",
+                "category": "ui_optimization",
+                "confidence": 0.8
+            })
+            return _completion(model, content, prompt_chars=len(prompt))
+
+        return _completion(model, "Stand-in answer: the requested work is done.", prompt_chars=len(prompt))
+
+    def handle(self, method, path, query, body, headers):
+        if method == "POST" and path.endswith("/chat/completions"):
+            request = json.loads(body or b"{}")
+            completion = self.answer(request)
+            if request.get("stream"):
+                return 200, _stream(completion), "text/event-stream"
+            return 200, completion, "application/json"
+        return 404, {"error": {"message": f"{method} {path} not supported by the stand-in"}}, "application/json"
+
+
+# --- Supabase (PostgREST) -----------------------------------------------------
+
+class SupabaseStandIn(StandIn):
+    """In-memory tables behind the PostgREST subset supabase-py uses."""
+
+    name = "supabase"
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = {"id": str(uuid.uuid4()), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime()), **row}
+        with self._lock:
+            self.tables.setdefault(table, []).append(row)
+        return row
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], filters: List[Tuple[str, str]]) -> bool:
+        for column, condition in filters:
+            op, _, value = condition.partition(".")
+            actual = row.get(column)
+            actual = str(actual).lower() if isinstance(actual, bool) else str(actual)
+            if op == "eq" and actual != value:
+                return False
+            if op == "neq" and actual == value:
+                return False
+            if op == "in" and actual not in [v.strip('"') for v in value.strip("()").split(",")]:
+                return False
+        return True
+
+    def handle(self, method, path, query, body, headers):
+        match = re.match(r"^/rest/v1/(\w+)$", path)
+        if not match:
+            return 404, {"message": f"{path} not supported by the stand-in"}, "application/json"
+        table = match.group(1)
+        reserved = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+        filters = [(k, v) for k, v in query.items() if k not in reserved]
+
+        if method == "POST":
+            rows = json.loads(body or b"[]")
+            rows = rows if isinstance(rows, list) else [rows]
+            return 201, [self.insert(table, row) for row in rows], "application/json"
+
+        with self._lock:
+            rows = [row for row in self.tables.get(table, []) if self._matches(row, filters)]
+            if method == "PATCH":
+                changes = json.loads(body or b"{}")
+                for row in rows:
+                    row.update(changes)
+            elif method == "DELETE":
+                self.tables[table] = [row for row in self.tables.get(table, []) if row not in rows]
+            rows = [dict(row) for row in rows]
+
+        if "order" in query:
+            column, _, direction = query["order"].partition(".")
+            rows.sort(key=lambda row: str(row.get(column) or ""), reverse=direction.startswith("desc"))
+        if "limit" in query:
+            rows = rows[:int(query["limit"])]
+        return 200, rows, "application/json"
+
+
+# --- GitHub -------------------------------------------------------------------
+
+def create_repository(root: Path, files: int, seed: int = 42) -> Path:
+    """
+    A git repository of generated files with a README, package.json and a small app.
+
+    Args:
+        root: Directory to create the repository in
+        files: Number of generated files (besides the fixed app files)
+
+    Returns:
+        The repository's working directory
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    generate_tree(root, files, seed=seed)
+    (root / "README.md").write_text("# Stand-in app\n\nA generated repository for Northstar benchmarks.\n")
+    (root / "package.json").write_text(json.dumps({"name": "stand-in-app", "dependencies": {"react": "^18.0.0"}}))
+    (root / "src").mkdir(exist_ok=True)
+    (root / "src" / "App.jsx").write_text(
+        "export default function App() {\n  return <button className=\"cta\">Sign up</button>;\n}\n"
+    )
+    env = {"GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com", "PATH": "/usr/bin:/bin:/usr/local/bin"}
+    for args in (["init", "-q", "-b", "main"], ["add", "-A"], ["commit", "-q", "-m", "Initial commit"]):
+        subprocess.run(["git", *args], cwd=root, check=True, env=env)
+    return root
+
+
+def git_redirect_env(repos: Dict[str, Path], token: str) -> Dict[str, str]:
+    """
+    Environment that makes git fetch github.com/{owner}/{repo} from local repositories.
+
+    Args:
+        repos: "owner/repo" -> working directory
+        token: The GITHUB_TOKEN the app embeds in clone URLs
+
+    Returns:
+        GIT_CONFIG_* variables (git >= 2.31) to merge into os.environ
+    """
+    env = {}
+    index = 0
+    for full_name, path in repos.items():
+        for prefix in (f"https://{token}@github.com/{full_name}.git", f"https://github.com/{full_name}.git"):
+            env[f"GIT_CONFIG_KEY_{index}"] = f"url.{path}.insteadOf"
+            env[f"GIT_CONFIG_VALUE_{index}"] = prefix
+            index += 1
+    env["GIT_CONFIG_COUNT"] = str(index)
+    return env
+
+
+class GitHubStandIn(StandIn):
+    """
+    The REST endpoints PyGithub calls for repository context and PR creation.
+
+    GET responses carry an ETag; a matching If-None-Match gets a 304, which
+    (as on GitHub) doesn't count against the rate limit.
+    """
+
+    name = "github"
+
+    def __init__(self, repos: Dict[str, Path], latency: float = 0.0, rate_limit: int = 5000, **kwargs):
+        """
+        Args:
+            repos: "owner/repo" -> working directory served as that repository
+            rate_limit: Requests per (hour-long) window reported in X-RateLimit-* headers
+        """
+        super().__init__(latency, **kwargs)
+        self.repos = repos
+        self.rate_limit = rate_limit
+        self.rate_reset = int(time.time()) + 3600
+        self.rate_used = 0
+        self.not_modified = 0
+        self.pulls = 0
+        self.branches: Dict[str, str] = {}
+
+    def response_headers(self) -> Dict[str, str]:
+        used = min(self.rate_used, self.rate_limit)
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(self.rate_limit - used),
+            "X-RateLimit-Used": str(used),
+            "X-RateLimit-Reset": str(self.rate_reset)
+        }
+
+    def _repo_json(self, full_name: str) -> Dict[str, Any]:
+        owner, name = full_name.split("/")
+        return {
+            "id": abs(hash(full_name)) % 10 ** 8, "name": name, "full_name": full_name,
+            "owner": {"login": owner, "id": 1, "type": "Organization"},
+            "description": "Generated repository", "language": "JavaScript", "default_branch": "main",
+            "private": False, "url": f"{self.url}/repos/{full_name}",
+            "html_url": f"https://github.com/{full_name}"
+        }
+
+    def _content_json(self, full_name: str, root: Path, relative: str) -> Dict[str, Any]:
+        path = root / relative
+        entry = {
+            "name": path.name, "path": relative, "sha": uuid.uuid5(uuid.NAMESPACE_URL, relative).hex,
+            "url": f"{self.url}/repos/{full_name}/contents/{relative}",
+            "type": "dir" if path.is_dir() else "file", "size": 0 if path.is_dir() else path.stat().st_size
+        }
+        return entry
+
+    def handle(self, method, path, query, body, headers):
+        status, payload, content_type = self._route(method, path, query, body, headers)
+        if method != "GET" or status != 200:
+            with self._lock:
+                self.rate_used += 1
+            return status, payload, content_type
+        data = payload if isinstance(payload, bytes) else json.dumps(payload, sort_keys=True).encode("utf-8")
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        with self._lock:
+            if headers.get("If-None-Match") == etag:
+                self.not_modified += 1
+                return 304, b"", content_type, {"ETag": etag}
+            self.rate_used += 1
+        return status, payload, content_type, {"ETag": etag}
+
+    def _route(self, method, path, query, body, headers):
+        match = re.match(r"^/repos/([^/]+/[^/]+)(/.*)?$", path)
+        if not match or match.group(1) not in self.repos:
+            return 404, {"message": "Not Found"}, "application/json"
+        full_name, rest = match.group(1), match.group(2) or ""
+        root = self.repos[full_name]
+        head = "0" * 40
+
+        if rest == "":
+            return 200, self._repo_json(full_name), "application/json"
+
+        if rest.startswith("/contents"):
+            relative = rest[len("/contents"):].strip("/")
+            target = root / relative
+            if method == "PUT":
+                payload = json.loads(body or b"{}")
+                return 200, {"content": {"path": relative, "sha": uuid.uuid4().hex},
+                             "commit": {"sha": uuid.uuid4().hex, "message": payload.get("message")}}, "application/json"
+            if not target.exists() or ".git" in Path(relative).parts:
+                return 404, {"message": "Not Found"}, "application/json"
+            if target.is_dir():
+                entries = sorted(p for p in target.iterdir() if p.name != ".git")
+                return 200, [self._content_json(full_name, root, str(p.relative_to(root))) for p in entries], "application/json"
+            entry = self._content_json(full_name, root, relative)
+            entry.update({"encoding": "base64", "content": base64.b64encode(target.read_bytes()).decode("ascii")})
+            return 200, entry, "application/json"
+
+        if rest.startswith("/branches/"):
+            return 200, {"name": rest.split("/")[-1], "commit": {
+                "sha": head, "url": f"{self.url}/repos/{full_name}/commits/{head}",
+                "commit": {"sha": head, "message": "Initial commit", "tree": {"sha": head, "url": f"{self.url}/repos/{full_name}/git/trees/{head}"}}
+            }}, "application/json"
+        if rest.startswith("/git/commits/") and method == "GET":
+            sha = rest.split("/")[-1]
+            return 200, {"sha": sha, "message": "Base commit", "url": f"{self.url}/repos/{full_name}{rest}",
+                         "tree": {"sha": head, "url": f"{self.url}/repos/{full_name}/git/trees/{head}"}}, "application/json"
+        if rest in ("/git/blobs", "/git/trees", "/git/commits") and method == "POST":
+            sha = uuid.uuid4().hex + "00000000"
+            return 201, {"sha": sha, "url": f"{self.url}/repos/{full_name}{rest}/{sha}"}, "application/json"
+        if rest == "/git/refs" and method == "POST":
+            payload = json.loads(body or b"{}")
+            self.branches[payload.get("ref", "")] = payload.get("sha", head)
+            return 201, {"ref": payload.get("ref"), "url": f"{self.url}/repos/{full_name}/git/{payload.get('ref')}",
+                         "object": {"sha": payload.get("sha"), "type": "commit"}}, "application/json"
+        if rest.startswith("/git/refs/") and method == "DELETE":
+            self.branches.pop(rest[len("/git/"):], None)
+            return 204, b"", "application/json"
+        if rest.startswith("/commits"):
+            commit = {"sha": head, "commit": {"message": "Initial commit", "author": {"name": "bench", "date": "2024-01-01T00:00:00Z"}},
+                      "url": f"{self.url}/repos/{full_name}/commits/{head}"}
+            return 200, [commit] if rest == "/commits" else commit, "application/json"
+        if rest == "/pulls" and method == "POST":
+            with self._lock:
+                self.pulls += 1
+                number = self.pulls
+            return 201, {"number": number, "html_url": f"https://github.com/{full_name}/pull/{number}",
+                         "url": f"{self.url}/repos/{full_name}/pulls/{number}", "state": "open"}, "application/json"
+        return 404, {"message": f"{method} {rest} not supported by the stand-in"}, "application/json"
+
+
+# --- Captain, Morph, Slack ---------------------------------------------------
+
+class CaptainStandIn(OpenAIStandIn):
+    """Captain's database endpoints and its OpenAI-compatible /v1 API."""
+
+    name = "captain"
+
+    def handle(self, method, path, query, body, headers):
+        if path.endswith("/chat/completions"):
+            return super().handle(method, path, query, body, headers)
+        if path == "/v1/create-database":
+            return 200, {"status": "created"}, "application/json"
+        if path == "/v1/upload-file":
+            return 200, {"status": "queued", "job_id": uuid.uuid4().hex}, "application/json"
+        if path.startswith("/v1/indexing-status/"):
+            return 200, {"status": "completed", "completed": True}, "application/json"
+        if path == "/v1/list-databases":
+            return 200, {"databases": []}, "application/json"
+        if path == "/v1/list-files":
+            return 200, {"files": []}, "application/json"
+        if path == "/v1/query":
+            return 200, {"response": "Stand-in answer from the knowledge base."}, "application/json"
+        return 404, {"message": f"{path} not supported by the stand-in"}, "application/json"
+
+
+class MorphStandIn(StandIn):
+    """Fast Apply merges: the update block's non-marker lines appended to the code."""
+
+    name = "morph"
+
+    def handle(self, method, path, query, body, headers):
+        request = json.loads(body or b"{}")
+        content = request["messages"][0]["content"]
+        code = re.search(r"<code>(.*?)</code>", content, re.S)
+        update = re.search(r"<update>(.*?)</update>", content, re.S)
+        added = [line for line in (update.group(1) if update else "").splitlines() if "existing code" not in line]
+        merged = (code.group(1) if code else "") + "\n".join(added) + "\n"
+        return 200, _completion("morph-v3-fast", merged), "application/json"
+
+
+class SlackStandIn(StandIn):
+    """chat.postMessage and chat.update; keeps the posted messages."""
+
+    name = "slack"
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.messages: List[Dict[str, Any]] = []
+
+    def handle(self, method, path, query, body, headers):
+        payload = json.loads(body or b"{}")
+        if path.endswith("/chat.postMessage"):
+            ts = f"{time.time():.6f}"
+            with self._lock:
+                self.messages.append({"channel": payload.get("channel"), "ts": ts, "text": payload.get("text")})
+            return 200, {"ok": True, "channel": payload.get("channel"), "ts": ts}, "application/json"
+        if path.endswith("/chat.update"):
+            return 200, {"ok": True, "channel": payload.get("channel"), "ts": payload.get("ts")}, "application/json"
+        return 200, {"ok": False, "error": "unknown_method"}, "application/json"
+
+
+def stand_in_metorial_run(slack: SlackStandIn):
+    """
+    Replacement for Metorial.run: a tool loop against the completions client,
+    with every tool call answered by posting to the Slack stand-in.
+    """
+    tool = {"type": "function", "function": {
+        "name": "slack_post_message",
+        "description": "Post a message to a Slack channel",
+        "parameters": {"type": "object", "properties": {"channel": {"type": "string"}, "text": {"type": "string"}}}
+    }}
+
+    async def run(self, *, message, server_deployments, client, model, max_steps=10, **kwargs):
+        messages = [{"role": "user", "content": message}]
+        kwargs = {k: v for k, v in kwargs.items() if v is not None and k in ("temperature", "max_tokens")}
+        for step in range(1, max_steps + 1):
+            response = await client.chat.completions.create(model=model, messages=messages, tools=[tool], **kwargs)
+            choice = response.choices[0].message
+            if not choice.tool_calls:
+                return RunResult(choice.content or "", step)
+            messages.append({"role": "assistant", "content": None, "tool_calls": [c.model_dump() for c in choice.tool_calls]})
+            for call in choice.tool_calls:
+                await asyncio.to_thread(
+                    requests.post, f"{slack.url}/api/chat.postMessage",
+                    json={"channel": "C-bench", "text": message[:200]}, timeout=30
+                )
+                messages.append({"role": "tool", "tool_call_id": call.id, "content": "ok"})
+        return RunResult("Stopped at the step limit.", max_steps)
+
+    return run
@@ -6,6 +6,11 @@ import time
 from typing import Optional, Dict, Any, List
 from urllib.parse import quote
 
+from metrics import time_dependency
+
+
+CAPTAIN_BASE_URL = os.getenv("CAPTAIN_BASE_URL", "https://api.runcaptain.com")
+
 
 class CaptainClient:
     """Client for interacting with Captain API."""
@@ -14,7 +19,7 @@ class CaptainClient:
         self,
         api_key: Optional[str] = None,
         organization_id: Optional[str] = None,
-        base_url: str = "https://api.runcaptain.com"
+        base_url: str = CAPTAIN_BASE_URL
     ):
         self.api_key = api_key or os.getenv("CAPTAIN_API_KEY")
         self.organization_id = organization_id or os.getenv("CAPTAIN_ORGANIZATION_ID")
@@ -35,6 +40,7 @@ class CaptainClient:
             headers["X-Organization-ID"] = self.organization_id
         return headers
 
+    @time_dependency("captain")
     def create_database(self, database_name: str) -> Dict[str, Any]:
         """Create a new Captain database."""
         headers = {
@@ -55,6 +61,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def delete_database(self, database_name: str) -> Dict[str, Any]:
         """Delete a Captain database."""
         headers = {
@@ -75,6 +82,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def list_databases(self) -> List[Dict[str, Any]]:
         """List all databases."""
         headers = {
@@ -94,6 +102,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def index_github_repo(
         self,
         database_name: str,
@@ -115,6 +124,7 @@ class CaptainClient:
             "Use clone + index_local_files instead."
         )
 
+    @time_dependency("captain")
     def check_indexing_status(self, job_id: str) -> Dict[str, Any]:
         """Check the status of an indexing job."""
         response = requests.get(
@@ -125,6 +135,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def wait_for_indexing(
         self,
         job_id: str,
@@ -158,6 +169,7 @@ class CaptainClient:
 
             time.sleep(poll_interval)
 
+    @time_dependency("captain")
     def query(
         self,
         database_name: str,
@@ -190,6 +202,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def list_files(
         self,
         database_name: str,
@@ -217,6 +230,7 @@ class CaptainClient:
         response.raise_for_status()
         return response.json()
 
+    @time_dependency("captain")
     def upload_file(
         self,
         database_name: str,
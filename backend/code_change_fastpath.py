@@ -0,0 +1,255 @@
+"""Deterministic fast path for CODE_CHANGE requests.
+
+The agent loop handles a code change by letting the model browse the
+repository with GitHub MCP tools, one step at a time, before it calls
+execute_code_change - often minutes for a one-line tweak. The fast path
+does the browsing itself:
+
+1. fetch the local mirror, locate candidate files (path/keyword match
+   against the request, weighted by churn) and read them at the fetched
+   base commit
+2. one LLM call over that targeted context picks the file and writes a
+   Fast Apply update block
+3. the block is merged into the file (locally when the anchors are
+   unambiguous, otherwise by Morph), and the PR is opened directly, with
+   its commit based on the commit the file was read from - a change pushed
+   upstream since then shows up as a conflict instead of being reverted
+
+Anything it can't handle confidently (no matching files, low confidence,
+no effective change) raises FastPathUnavailable, and the caller falls back
+to the agent loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Dict, Any, List, Optional, Callable
+
+from northstar_mcp.fast_apply import apply_update
+from northstar_mcp.utils import unified_diff
+from pr_creator import PRCreator
+from repo_mirror import get_churn_index, head_commit, list_files, read_file
+from tracing import redact_secrets
+
+logger = logging.getLogger(__name__)
+
+
+ENABLED = os.getenv("NORTHSTAR_CODE_CHANGE_FAST_PATH", "true").lower() == "true"
+
+MAX_CANDIDATES = 8         # files read from the mirror
+CONTEXT_FILES = 3          # files shown to the model
+MAX_FILE_CHARS = 12000
+MIN_CONFIDENCE = 0.6
+
+SOURCE_EXTENSIONS = {
+    '.js', '.jsx', '.ts', '.tsx', '.vue', '.svelte', '.css', '.scss', '.html',
+    '.py', '.go', '.rb', '.java', '.kt', '.swift', '.dart', '.php'
+}
+SKIP_DIRS = {'node_modules', 'dist', 'build', 'vendor', '.next', 'coverage', '__pycache__'}
+
+_STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'make', 'change', 'update', 'add', 'remove', 'please',
+    'can', 'you', 'our', 'from', 'into', 'should', 'would', 'northstar', 'pr', 'code', 'file', 'use'
+}
+
+
+class FastPathUnavailable(Exception):
+    """The request isn't a good fit for the fast path; use the agent loop."""
+
+
+def _tokens(text: str) -> set:
+    """Lowercase word tokens, splitting camelCase and path separators."""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text or "")
+    words = re.split(r'[^A-Za-z0-9]+', text.lower())
+    return {w.rstrip('s') for w in words if len(w) >= 3 and w not in _STOPWORDS}
+
+
+def rank_candidates(paths: List[str], instruction: str, churn=None, limit: int = MAX_CANDIDATES) -> List[str]:
+    """
+    Source files most likely to be touched by an instruction.
+
+    File-name matches count double directory matches; churn breaks ties
+    towards actively developed files.
+    """
+    wanted = _tokens(instruction)
+    scored = []
+    for path in paths:
+        parts = path.split('/')
+        if any(part in SKIP_DIRS for part in parts[:-1]) or '.min.' in parts[-1]:
+            continue
+        if os.path.splitext(path)[1].lower() not in SOURCE_EXTENSIONS:
+            continue
+        name_hits = len(wanted & _tokens(parts[-1]))
+        dir_hits = len(wanted & _tokens('/'.join(parts[:-1])))
+        churn_score = churn.score(path) if churn else 0.0
+        score = 2 * name_hits + dir_hits + min(churn_score, 5.0) / 5.0
+        if name_hits or dir_hits or churn_score:
+            scored.append((score, path))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [path for _, path in scored[:limit]]
+
+
+def _content_score(instruction: str, content: str) -> int:
+    lowered = content.lower()
+    return sum(1 for token in _tokens(instruction) if token in lowered)
+
+
+async def locate_files(repo_fullname: str, branch: str, instruction: str, revision: Optional[str] = None) -> Dict[str, str]:
+    """
+    Read the most relevant files for an instruction from the local mirror.
+
+    Args:
+        repo_fullname: Repository in "owner/name" format
+        branch: Branch whose churn ranks the candidates
+        instruction: The user's request
+        revision: Commit to read the files at (default: the mirror's branch head)
+
+    Returns:
+        {path: content} for up to CONTEXT_FILES files, best match first
+    """
+    revision = revision or branch
+    paths = await asyncio.to_thread(list_files, repo_fullname, revision)
+    try:
+        churn = await asyncio.to_thread(get_churn_index, repo_fullname, branch)
+    except Exception as e:
+        logger.warning(f"Churn index unavailable for fast path: {redact_secrets(str(e))}")
+        churn = None
+
+    candidates = rank_candidates(paths, instruction, churn)
+    if not candidates:
+        raise FastPathUnavailable("no candidate files match the request")
+
+    contents = await asyncio.to_thread(
+        lambda: {path: read_file(repo_fullname, path, revision) for path in candidates}
+    )
+    readable = {path: text for path, text in contents.items() if text and len(text) <= MAX_FILE_CHARS}
+    if not readable:
+        raise FastPathUnavailable("candidate files are missing or too large for a single-call edit")
+
+    # Re-rank by how much of the request the file's content mentions (stable for ties)
+    ranked = sorted(readable, key=lambda path: -_content_score(instruction, readable[path]))
+    return {path: readable[path] for path in ranked[:CONTEXT_FILES]}
+
+
+async def generate_change(llm, instruction: str, files: Dict[str, str], extra_context: str = "") -> Dict[str, Any]:
+    """
+    One LLM call choosing the file and writing the Fast Apply update block.
+
+    Returns:
+        {'file_path', 'update_block', 'summary', 'confidence'}
+    """
+    file_sections = "\n\n".join(f"=== {path} ===\n{content}" for path, content in files.items())
+    response = await llm.chat(
+        "code_change.fast_path",
+        route="code_change",
+        response_format={"type": "json_object"},
+        temperature=0.1,
+        messages=[{
+            "role": "user",
+            "content": f"""Make this code change: "{instruction}"
+{extra_context}
+
+Candidate files (full contents):
+
+{file_sections}
+
+Pick the ONE file above that should change and write a Fast Apply update block for it:
+- Show only the changed code with a few unchanged lines around it
+- Replace unchanged regions with "// ... existing code ..." (use the file's comment syntax, e.g. "# ... existing code ..." in Python, "<!-- ... existing code ... -->" in HTML)
+- Match the file's framework, syntax and style exactly
+
+Respond with JSON only:
+{{"file_path": "path from above", "update_block": "...", "summary": "short PR title, imperative mood", "confidence": 0.0-1.0}}
+Use a confidence below {MIN_CONFIDENCE} if the change needs more than one file or none of the files fit."""
+        }]
+    )
+    try:
+        change = json.loads(response.choices[0].message.content)
+    except (TypeError, ValueError) as e:
+        raise FastPathUnavailable(f"model returned invalid JSON: {e}")
+
+    if change.get("file_path") not in files:
+        raise FastPathUnavailable(f"model chose a file outside the candidates: {change.get('file_path')}")
+    if not change.get("update_block"):
+        raise FastPathUnavailable("model returned no update block")
+    try:
+        confidence = float(change.get("confidence", 0))
+    except (TypeError, ValueError):
+        confidence = 0.0
+    if confidence < MIN_CONFIDENCE:
+        raise FastPathUnavailable(f"low confidence ({confidence:.2f})")
+    change["confidence"] = confidence
+    change["summary"] = (change.get("summary") or instruction).strip()[:100]
+    return change
+
+
+async def run_fast_path(
+    llm,
+    instruction: str,
+    repo_fullname: str,
+    base_branch: str = "main",
+    extra_context: str = "",
+    on_status: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Locate, generate, apply and open a PR for a code change without the agent loop.
+
+    Args:
+        llm: LLMGateway
+        instruction: The user's request
+        repo_fullname: Repository in "owner/name" format
+        base_branch: Branch the PR targets
+        extra_context: Conversation/proposal details to include in the prompt
+        on_status: Progress callback (e.g. StreamingReply.status)
+
+    Returns:
+        {'pr_url', 'pr_number', 'branch_name', 'file_path', 'summary', 'confidence', 'diff', 'merge'}
+
+    Raises:
+        FastPathUnavailable: The agent loop should handle the request instead
+    """
+    def status(label: str) -> None:
+        if on_status:
+            on_status(label)
+
+    status("Finding the files to change")
+    # Fetch first: the PR's commit is based on the commit the files are read at
+    base_sha = await asyncio.to_thread(head_commit, repo_fullname, base_branch, True)
+    files = await locate_files(repo_fullname, base_branch, instruction, revision=base_sha)
+    logger.info(f"Fast path candidates for {repo_fullname}: {list(files)}")
+
+    status("Writing the change")
+    change = await generate_change(llm, instruction, files, extra_context)
+    file_path = change["file_path"]
+    original = files[file_path]
+
+    merge = await asyncio.to_thread(apply_update, change["summary"], original, change["update_block"])
+    merged = merge.code
+    diff = unified_diff(original, merged, file_path)
+    if not diff:
+        raise FastPathUnavailable("the update block produced no change")
+
+    status("Opening the PR")
+    pr_result = await asyncio.to_thread(
+        PRCreator().create_pr,
+        repo_fullname=repo_fullname,
+        instruction=change["summary"],
+        update_block=change["update_block"],
+        file_path=file_path,
+        base_branch=base_branch,
+        new_content=merged,
+        base_sha=base_sha
+    )
+    if pr_result.get("status") != "success":
+        raise FastPathUnavailable(f"PR creation failed: {pr_result.get('error')}")
+
+    return {
+        **pr_result,
+        "file_path": file_path,
+        "summary": change["summary"],
+        "confidence": change["confidence"],
+        "diff": diff,
+        "merge": merge.to_dict()
+    }
@@ -0,0 +1,256 @@
+"""Token budgeting for prompt context.
+
+Prompts are assembled from named sections (repo header, file tree, file
+contents, ...). A ContextBudget packs them into a fixed token allowance:
+sections are considered in priority order, oversized sections are cut at
+line boundaries, and whole low-priority sections are dropped first when the
+budget runs out.
+"""
+
+import re
+from typing import List, Dict, Any, Optional
+
+from context_compressor import skeletonize
+
+
+# Average characters per token for source code and English prose with
+# OpenAI's tokenizers. Slightly pessimistic so estimates err on the high side.
+CHARS_PER_TOKEN = 3.5
+
+# Sections smaller than this are dropped rather than cut down to a stub
+DEFAULT_MIN_SECTION_TOKENS = 64
+
+TRUNCATION_MARKER = "... (truncated)"
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast token estimate for a string (no tokenizer round trip)."""
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = TRUNCATION_MARKER) -> str:
+    """
+    Cut text down to roughly max_tokens, ending on a line boundary.
+
+    Args:
+        text: Text to truncate
+        max_tokens: Token allowance including the marker
+        marker: Line appended when anything was cut
+
+    Returns:
+        The original text if it fits, otherwise a prefix of whole lines plus marker
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    max_chars = int((max_tokens - estimate_tokens(marker) - 1) * CHARS_PER_TOKEN)
+    if max_chars <= 0:
+        return ""
+
+    cut = text.rfind("\n", 0, max_chars)
+    if cut <= 0:
+        # A single very long line (minified code) - cut it mid-line
+        cut = max_chars
+    return text[:cut].rstrip() + "\n" + marker
+
+
+class ContextSection:
+    """A named piece of prompt context with a priority and token allocation."""
+
+    def __init__(
+        self,
+        name: str,
+        text: str,
+        priority: int = 0,
+        max_tokens: Optional[int] = None,
+        min_tokens: int = DEFAULT_MIN_SECTION_TOKENS,
+        compact: Optional[str] = None
+    ):
+        """
+        Args:
+            name: Label used in reports (e.g. a file path)
+            text: Section content
+            priority: Higher values are packed first and dropped last
+            max_tokens: Per-section allocation; longer sections are truncated to it
+            min_tokens: Drop the section instead of truncating it below this size
+            compact: Cheaper rendering (e.g. a skeleton) used before truncating
+        """
+        self.name = name
+        self.text = text
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.compact = compact
+
+
+class PackedContext:
+    """Result of ContextBudget.pack()."""
+
+    def __init__(
+        self,
+        text: str,
+        tokens_used: int,
+        max_tokens: int,
+        included: List[str],
+        truncated: List[str],
+        dropped: List[str],
+        compacted: Optional[List[str]] = None
+    ):
+        self.text = text
+        self.tokens_used = tokens_used
+        self.max_tokens = max_tokens
+        self.included = included
+        self.truncated = truncated
+        self.dropped = dropped
+        self.compacted = compacted or []
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact report for logs and API responses."""
+        return {
+            "tokens_used": self.tokens_used,
+            "max_tokens": self.max_tokens,
+            "sections_included": len(self.included),
+            "sections_compacted": len(self.compacted),
+            "sections_truncated": len(self.truncated),
+            "sections_dropped": len(self.dropped)
+        }
+
+
+class ContextBudget:
+    """
+    Packs prompt sections into a fixed token budget.
+
+    Example:
+        budget = ContextBudget(max_tokens=2000)
+        budget.add("README.md", readme, priority=10, max_tokens=800)
+        budget.add("src/App.jsx", app_source, priority=5)
+        packed = budget.pack()
+        prompt = f"...{packed.text}..."
+    """
+
+    def __init__(self, max_tokens: int, separator: str = "\n\n"):
+        self.max_tokens = max_tokens
+        self.separator = separator
+        self.sections: List[ContextSection] = []
+
+    def add(
+        self,
+        name: str,
+        text: str,
+        priority: int = 0,
+        max_tokens: Optional[int] = None,
+        min_tokens: int = DEFAULT_MIN_SECTION_TOKENS,
+        compact: Optional[str] = None
+    ) -> None:
+        """Add a section. See ContextSection for the arguments."""
+        if text:
+            self.sections.append(ContextSection(name, text, priority, max_tokens, min_tokens, compact))
+
+    def pack(self) -> PackedContext:
+        """
+        Fit sections into the budget.
+
+        Sections are considered from highest to lowest priority (ties keep
+        insertion order) and emitted in insertion order, so the prompt reads
+        the same way it was assembled.
+        """
+        separator_tokens = estimate_tokens(self.separator)
+        remaining = self.max_tokens
+        chosen: Dict[int, str] = {}
+        truncated = []
+        dropped = []
+        compacted = []
+
+        order = sorted(range(len(self.sections)), key=lambda i: -self.sections[i].priority)
+        for index in order:
+            section = self.sections[index]
+            available = remaining - (separator_tokens if chosen else 0)
+            allowance = min(available, section.max_tokens or available)
+
+            text = section.text
+            tokens = estimate_tokens(text)
+            if tokens > allowance and section.compact is not None:
+                # Prefer the compact rendering over cutting the full text
+                text = section.compact
+                tokens = estimate_tokens(text)
+            if section.max_tokens is not None and tokens > section.max_tokens:
+                text = truncate_to_tokens(text, section.max_tokens)
+                tokens = estimate_tokens(text)
+
+            if tokens > available:
+                if available < section.min_tokens:
+                    dropped.append(section.name)
+                    continue
+                text = truncate_to_tokens(text, available)
+                tokens = estimate_tokens(text)
+
+            if text == section.compact:
+                compacted.append(section.name)
+            elif text != section.text:
+                truncated.append(section.name)
+            chosen[index] = text
+            remaining = available - tokens
+
+        ordered = [chosen[i] for i in sorted(chosen)]
+        packed_text = self.separator.join(ordered)
+        return PackedContext(
+            text=packed_text,
+            tokens_used=estimate_tokens(packed_text),
+            max_tokens=self.max_tokens,
+            included=[self.sections[i].name for i in sorted(chosen)],
+            truncated=truncated,
+            dropped=dropped,
+            compacted=compacted
+        )
+
+
+# Lines that start a new block in fetch_repository_context() output
+_SECTION_START = re.compile(r"^(?:--- .+ ---|=== .+ ===)$")
+# "--- src/App.jsx (USER-WRITTEN CODE) ---" - full file contents follow
+_FULL_FILE_HEADER = re.compile(r"^--- (\S+) \(USER-WRITTEN CODE\) ---$")
+
+
+def split_context_sections(context: str) -> List[ContextSection]:
+    """
+    Split an assembled repository context string back into sections.
+
+    fetch_repository_context() emits "=== Heading ===" and "--- path ---"
+    delimited blocks, most important first. Each block becomes a section whose
+    priority decreases with its position; the leading repository header keeps
+    the highest priority so the model always sees which repo it is looking at.
+    Full-file blocks carry a skeleton as their compact form, so a tight budget
+    keeps an outline of a file instead of its first few lines.
+    """
+    blocks: List[List[str]] = [[]]
+    names = ["header"]
+    for line in context.split("\n"):
+        stripped = line.strip()
+        if _SECTION_START.match(stripped) and blocks[-1]:
+            blocks.append([])
+            names.append(stripped.strip("-= ").strip())
+        blocks[-1].append(line)
+
+    count = len(blocks)
+    sections = []
+    for position, (name, lines) in enumerate(zip(names, blocks)):
+        text = "\n".join(lines).strip("\n")
+        if not text:
+            continue
+        priority = count + 1 if position == 0 else count - position
+        compact = None
+        file_header = _FULL_FILE_HEADER.match(lines[0].strip()) if lines else None
+        if file_header:
+            file_path = file_header.group(1)
+            body = "\n".join(lines[1:])
+            compact = f"--- {file_path} (USER-WRITTEN CODE - SKELETON) ---\n{skeletonize(file_path, body)}"
+        sections.append(ContextSection(name, text, priority=priority, compact=compact))
+    return sections
+
+
+def pack_context(context: str, max_tokens: int) -> PackedContext:
+    """Pack an assembled repository context string into max_tokens."""
+    budget = ContextBudget(max_tokens, separator="\n")
+    budget.sections = split_context_sections(context)
+    return budget.pack()
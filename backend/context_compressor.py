@@ -0,0 +1,288 @@
+"""Context compression for low-priority files.
+
+Renders source files as skeletons - imports, class and function signatures,
+JSX component outlines and docstring first lines - so far more of a
+repository fits into a prompt than whole-file prefixes allow. Only the most
+relevant files need to be sent verbatim.
+"""
+
+import re
+from typing import List, Tuple
+
+
+PYTHON_EXTENSIONS = {'.py'}
+JS_EXTENSIONS = {'.js', '.jsx', '.ts', '.tsx', '.mjs', '.cjs', '.vue', '.svelte'}
+C_STYLE_EXTENSIONS = JS_EXTENSIONS | {
+    '.java', '.kt', '.swift', '.go', '.rs', '.c', '.cpp', '.h', '.hpp',
+    '.cs', '.php', '.scala', '.dart', '.css', '.scss', '.less'
+}
+HASH_COMMENT_EXTENSIONS = {'.py', '.rb', '.sh', '.bash', '.yaml', '.yml', '.toml'}
+MARKUP_EXTENSIONS = {'.html', '.xml', '.vue', '.svelte'}
+STYLE_EXTENSIONS = {'.css', '.scss', '.less'}
+
+# Runs of data-like lines longer than this are collapsed
+BOILERPLATE_RUN_LINES = 8
+
+_BLOCK_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_MARKUP_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+# '//' only counts as a comment at line start or after whitespace, so URLs survive
+_LINE_COMMENT = re.compile(r'(^|\s)//.*$', re.MULTILINE)
+_HASH_COMMENT = re.compile(r'(^|\s)#(?![!{\[]).*$', re.MULTILINE)
+_DATA_LINE = re.compile(r'''^\s*(?:["'`][^"'`]*["'`]|[-\d.]+|true|false|null|None)\s*[,;]?\s*$''')
+
+_PY_SIGNATURE = re.compile(r'^\s*(?:class\s|def\s|async\s+def\s)')
+_PY_DECORATOR = re.compile(r'^\s*@')
+_PY_IMPORT = re.compile(r'^(?:import\s|from\s+\S+\s+import\s)')
+_PY_CONSTANT = re.compile(r'^[A-Z][A-Z0-9_]*\s*(?::[^=]+)?=')
+
+_JS_IMPORT = re.compile(r'^\s*(?:import\s|export\s+\*|export\s+\{|(?:const|let|var)\s+\w+\s*=\s*require\()')
+_JS_SIGNATURE = re.compile(
+    r'^\s*(?:export\s+)?(?:default\s+)?(?:'
+    r'(?:async\s+)?function\b'
+    r'|class\s'
+    r'|interface\s|type\s+\w+\s*='
+    r'|(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:\([^)]*\)|\w+)\s*=>'
+    r'|(?:const|let|var)\s+\w+\s*=\s*(?:React\.)?(?:memo|forwardRef|styled)\b'
+    r')'
+)
+_JS_METHOD = re.compile(r'^\s+(?:static\s+|async\s+|get\s+|set\s+)*(?!if\b|for\b|while\b|switch\b|catch\b|return\b)\w+\s*\([^)]*\)\s*\{\s*$')
+_JS_HOOK = re.compile(r'^\s*(?:const|let)\s+.*=\s*use[A-Z]\w*\(')
+_JSX_COMPONENT = re.compile(r'<([A-Z][\w.]*)')
+_JS_EXPORT_DEFAULT = re.compile(r'^\s*export\s+default\s+\w+\s*;?\s*$')
+
+_CSS_SELECTOR = re.compile(r'^\s*[^{};]+\{\s*$')
+
+
+def _extension(file_path: str) -> str:
+    """Lower-cased extension including the dot ('' if none)."""
+    name = file_path.rsplit('/', 1)[-1]
+    return '.' + name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def collapse_whitespace(text: str) -> str:
+    """Strip trailing whitespace and squeeze runs of blank lines to one."""
+    lines = [line.rstrip() for line in text.split('\n')]
+    collapsed = []
+    for line in lines:
+        if not line and (not collapsed or not collapsed[-1]):
+            continue
+        collapsed.append(line)
+    return '\n'.join(collapsed).strip('\n')
+
+
+def strip_comments(text: str, file_path: str) -> str:
+    """
+    Remove comments (including license headers) and redundant whitespace.
+
+    Comment syntax is picked from the file extension; string literals are not
+    parsed, so the patterns are deliberately conservative.
+    """
+    ext = _extension(file_path)
+    if ext in MARKUP_EXTENSIONS:
+        text = _MARKUP_COMMENT.sub('', text)
+    if ext in C_STYLE_EXTENSIONS:
+        text = _BLOCK_COMMENT.sub('', text)
+        if ext not in STYLE_EXTENSIONS:
+            text = _LINE_COMMENT.sub(r'\1', text)
+    if ext in HASH_COMMENT_EXTENSIONS:
+        text = _HASH_COMMENT.sub(r'\1', text)
+    return collapse_whitespace(text)
+
+
+def collapse_boilerplate(text: str) -> str:
+    """Replace long runs of data-only lines (string/number tables) with a count."""
+    lines = text.split('\n')
+    output = []
+    run: List[str] = []
+
+    def flush():
+        if len(run) > BOILERPLATE_RUN_LINES:
+            output.extend(run[:2])
+            indent = run[2][:len(run[2]) - len(run[2].lstrip())]
+            output.append(f"{indent}... ({len(run) - 3} similar lines)")
+            output.append(run[-1])
+        else:
+            output.extend(run)
+        run.clear()
+
+    for line in lines:
+        if _DATA_LINE.match(line):
+            run.append(line)
+        else:
+            flush()
+            output.append(line)
+    flush()
+    return '\n'.join(output)
+
+
+def _scan_brackets(line: str, depth: int) -> Tuple[int, int]:
+    """
+    Follow bracket nesting through a line of Python, skipping strings and comments.
+
+    Returns:
+        (index of the first ":" outside brackets or -1, bracket depth at the end of the scan)
+    """
+    quote = None
+    k = 0
+    while k < len(line):
+        ch = line[k]
+        if quote:
+            if ch == '\\':
+                k += 1
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '#':
+            break
+        elif ch in '([{':
+            depth += 1
+        elif ch in ')]}':
+            depth -= 1
+        elif ch == ':' and depth == 0:
+            return k, depth
+        k += 1
+    return -1, depth
+
+
+def _python_skeleton(text: str) -> List[str]:
+    """Imports, constants, decorators, signatures and docstring first lines."""
+    lines = text.split('\n')
+    output = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if _PY_IMPORT.match(line) or _PY_CONSTANT.match(line):
+            output.append(line)
+        elif _PY_DECORATOR.match(line):
+            # Kept on their own lines (arguments may span several); the def below gets the docstring
+            output.append(line)
+            _, depth = _scan_brackets(line, 0)
+            while depth > 0 and i + 1 < len(lines):
+                i += 1
+                output.append(lines[i])
+                _, depth = _scan_brackets(lines[i], depth)
+        elif _PY_SIGNATURE.match(line):
+            # Signatures may span several lines; they end at the colon after the parameter list
+            signature = []
+            depth = 0
+            inline_body = False
+            while True:
+                end, depth = _scan_brackets(lines[i], depth)
+                if end >= 0:
+                    rest = lines[i][end + 1:].strip()
+                    inline_body = bool(rest) and not rest.startswith('#')
+                    # A one-line body ("def one(a): return a * 2") is elided
+                    signature.append(lines[i][:end + 1] + ' ...' if inline_body else lines[i])
+                    break
+                signature.append(lines[i])
+                if i + 1 >= len(lines) or len(signature) >= 10:
+                    break
+                i += 1
+            output.extend(signature)
+            if not inline_body:
+                # Keep the first line of the docstring, if there is one
+                j = i + 1
+                while j < len(lines) and not lines[j].strip():
+                    j += 1
+                if j < len(lines) and lines[j].strip()[:3] in ('"""', "'''"):
+                    doc = lines[j].strip()
+                    body = doc[3:].strip() or (lines[j + 1].strip() if j + 1 < len(lines) else '')
+                    indent = lines[j][:len(lines[j]) - len(lines[j].lstrip())]
+                    quote = doc[:3]
+                    body = body.rstrip(quote).strip()
+                    output.append(f"{indent}{quote}{body}{quote}")
+                    output.append(f"{indent}...")
+                elif j < len(lines):
+                    indent = lines[j][:len(lines[j]) - len(lines[j].lstrip())]
+                    output.append(f"{indent}...")
+        elif i == 0 and stripped[:3] in ('"""', "'''"):
+            output.append(stripped if stripped.endswith(stripped[:3]) and len(stripped) > 3 else stripped + '...')
+        i += 1
+    return output
+
+
+def _js_skeleton(text: str) -> List[str]:
+    """Imports, exports, signatures, hooks and the components each one renders."""
+    lines = text.split('\n')
+    output = []
+    trailing_exports = []
+    rendered: List[str] = []
+    has_top_level = False
+
+    def flush_components():
+        if has_top_level and rendered:
+            unique = list(dict.fromkeys(rendered))
+            output.append(f"  // renders: {', '.join(unique[:15])}")
+        rendered.clear()
+
+    for line in lines:
+        if _JS_EXPORT_DEFAULT.match(line):
+            trailing_exports.append(line)
+        elif _JS_IMPORT.match(line):
+            output.append(line)
+        elif _JS_SIGNATURE.match(line) or _JS_METHOD.match(line):
+            # JSX seen so far belongs to the previous top-level component
+            if not line[:1].isspace():
+                flush_components()
+                has_top_level = True
+            output.append(line.rstrip() + (' ... }' if line.rstrip().endswith('{') else ''))
+        elif _JS_HOOK.match(line):
+            output.append(line)
+        rendered.extend(_JSX_COMPONENT.findall(line))
+    flush_components()
+    return output + trailing_exports
+
+
+def _css_skeleton(text: str) -> List[str]:
+    """Selectors only."""
+    return [line.rstrip() + ' ... }' for line in text.split('\n') if _CSS_SELECTOR.match(line)]
+
+
+def skeletonize(file_path: str, text: str) -> str:
+    """
+    Render a file as a compact outline for low-priority context.
+
+    Args:
+        file_path: Path used to pick the language (by extension)
+        text: Full file contents
+
+    Returns:
+        Skeleton text; falls back to comment/whitespace-stripped contents for
+        languages without an outline, or when the outline would be empty
+    """
+    ext = _extension(file_path)
+    stripped = strip_comments(text, file_path)
+
+    if ext in PYTHON_EXTENSIONS:
+        # Docstrings are read from the original so their first line survives
+        outline = _python_skeleton(text)
+    elif ext in JS_EXTENSIONS:
+        outline = _js_skeleton(stripped)
+    elif ext in STYLE_EXTENSIONS:
+        outline = _css_skeleton(stripped)
+    else:
+        outline = []
+
+    if not outline:
+        return collapse_boilerplate(stripped)
+    return collapse_whitespace('\n'.join(outline))
+
+
+def compress_for_context(file_path: str, text: str, full: bool) -> str:
+    """
+    Render a file for prompt context.
+
+    Args:
+        file_path: Repository-relative path
+        text: File contents
+        full: Keep the verbatim text (most relevant files, which the model may
+            quote in update blocks); otherwise render a skeleton
+
+    Returns:
+        Text to place in the prompt
+    """
+    if full:
+        return text
+    return skeletonize(file_path, text)
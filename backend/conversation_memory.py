@@ -0,0 +1,252 @@
+"""Per-conversation memory for the Slack agent.
+
+The README's flow ("propose an experiment" -> "make it happen" -> "nice
+work") only works if a follow-up can see what happened before it. A
+conversation is a Slack thread, or a channel's top level when the message
+isn't threaded. For each one the store keeps:
+
+- recent turns verbatim; older turns are folded into a running summary
+- the last proposal ID, so "make it happen" knows what to implement
+- context handles (e.g. the packed repo profile), so follow-ups skip re-fetching
+- the latest tool results (bounded, truncated)
+
+Conversations idle for longer than the TTL are dropped, and the least recently
+used ones go first once the store is full. State is in-process: a restart
+starts every conversation over, same as before this store existed.
+
+Configuration:
+    NORTHSTAR_MEMORY_TTL_SECONDS        - idle time before a conversation is forgotten (default 7200)
+    NORTHSTAR_MEMORY_MAX_CONVERSATIONS  - conversations kept at once (default 500)
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TTL = float(os.getenv("NORTHSTAR_MEMORY_TTL_SECONDS", "7200"))
+DEFAULT_MAX_CONVERSATIONS = int(os.getenv("NORTHSTAR_MEMORY_MAX_CONVERSATIONS", "500"))
+MAX_TURNS = 10            # verbatim turns kept; older ones are summarised
+MAX_TURN_CHARS = 1500
+MAX_TOOL_RESULTS = 5
+MAX_TOOL_RESULT_CHARS = 2000
+MAX_SUMMARY_CHARS = 1500
+
+# Proposal IDs as they appear in proposal JSON or Slack posts ("exp-001", "proposal_id": "...")
+_PROPOSAL_ID_PATTERNS = [
+    re.compile(r'"proposal_id"\s*:\s*"([^"]+)"'),
+    re.compile(r"\b(exp-[A-Za-z0-9-]+)\b"),
+]
+
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+
+def conversation_key(channel: str, thread_ts: Optional[str] = None) -> str:
+    """Key of a Slack thread, or of the channel's top level for unthreaded messages."""
+    return f"{channel}:{thread_ts or 'main'}"
+
+
+def extract_proposal_id(text: Optional[str]) -> Optional[str]:
+    """Proposal ID mentioned in an agent answer, if any."""
+    for pattern in _PROPOSAL_ID_PATTERNS:
+        match = pattern.search(text or "")
+        if match:
+            return match.group(1)
+    return None
+
+
+def _clip(text: str, limit: int) -> str:
+    text = text or ""
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _extractive_summary(previous: str, turns: List[Dict[str, Any]]) -> str:
+    """Summary used when no summarizer is configured (or it fails): first line of each turn."""
+    lines = [previous] if previous else []
+    for turn in turns:
+        first_line = (turn["text"] or "").strip().split("\n")[0]
+        lines.append(f"{turn['role']}: {_clip(first_line, 160)}")
+    return _clip("\n".join(lines)[-MAX_SUMMARY_CHARS:], MAX_SUMMARY_CHARS)
+
+
+class Conversation:
+    """State of one Slack conversation."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.turns: List[Dict[str, Any]] = []
+        self.summary = ""
+        self.last_proposal_id: Optional[str] = None
+        self.last_request_type: Optional[str] = None
+        self.context: Dict[str, Any] = {}
+        self.tool_results: List[Dict[str, Any]] = []
+        self.created_at = time.time()
+        self.updated_at = time.time()
+
+    def add_turn(self, role: str, text: str, request_type: Optional[str] = None) -> None:
+        self.turns.append({
+            "role": role,
+            "text": _clip(text, MAX_TURN_CHARS),
+            "request_type": request_type,
+            "at": time.time()
+        })
+        if request_type:
+            self.last_request_type = request_type
+        proposal_id = extract_proposal_id(text) if role == "assistant" else None
+        if proposal_id:
+            self.last_proposal_id = proposal_id
+        self.updated_at = time.time()
+
+    def remember_tool_result(self, name: str, text: str) -> None:
+        self.tool_results = [r for r in self.tool_results if r["name"] != name]
+        self.tool_results.append({"name": name, "text": _clip(text, MAX_TOOL_RESULT_CHARS), "at": time.time()})
+        del self.tool_results[:-MAX_TOOL_RESULTS]
+        self.updated_at = time.time()
+
+    def tool_result(self, name: str) -> Optional[str]:
+        for result in self.tool_results:
+            if result["name"] == name:
+                return result["text"]
+        return None
+
+    def prompt_context(self, max_chars: int = 3000) -> str:
+        """
+        Earlier conversation, formatted for a prompt (empty for a new conversation).
+
+        Most recent turns are kept when the block has to be cut to max_chars.
+        """
+        if not self.turns and not self.summary:
+            return ""
+        lines = ["Earlier in this conversation:"]
+        if self.summary:
+            lines.append(f"(Summary of older messages) {self.summary}")
+        budget = max_chars - sum(len(line) + 1 for line in lines)
+        recent = []
+        for turn in reversed(self.turns):
+            line = f"{turn['role']}: {turn['text']}"
+            if len(line) + 1 > budget:
+                break
+            recent.append(line)
+            budget -= len(line) + 1
+        lines.extend(reversed(recent))
+        if self.last_proposal_id:
+            lines.append(f"Most recent proposal: {self.last_proposal_id}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "turns": len(self.turns),
+            "summary_chars": len(self.summary),
+            "last_proposal_id": self.last_proposal_id,
+            "last_request_type": self.last_request_type,
+            "context_handles": sorted(self.context),
+            "tool_results": [r["name"] for r in self.tool_results],
+            "idle_seconds": round(time.time() - self.updated_at, 1)
+        }
+
+
+class ConversationMemory:
+    """Bounded, expiring store of Conversations."""
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        max_conversations: int = DEFAULT_MAX_CONVERSATIONS,
+        max_turns: int = MAX_TURNS,
+        summarizer: Optional[Summarizer] = None
+    ):
+        """
+        Args:
+            ttl: Seconds of inactivity after which a conversation is dropped
+            max_conversations: Maximum conversations kept (least recently used evicted)
+            max_turns: Turns kept verbatim before older ones are summarised
+            summarizer: async (previous_summary, turns) -> summary; extractive if None
+        """
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self.summarizer = summarizer
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, conversation: Conversation) -> bool:
+        return time.time() - conversation.updated_at > self.ttl
+
+    def get(self, key: str) -> Optional[Conversation]:
+        """The conversation, or None if unknown or expired."""
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                return None
+            if self._expired(conversation):
+                del self._conversations[key]
+                return None
+            self._conversations.move_to_end(key)
+            return conversation
+
+    def get_or_create(self, key: str) -> Conversation:
+        conversation = self.get(key)
+        if conversation is not None:
+            return conversation
+        with self._lock:
+            conversation = self._conversations[key] = Conversation(key)
+            self._evict()
+            return conversation
+
+    def _evict(self) -> None:
+        for key in [k for k, c in self._conversations.items() if self._expired(c)]:
+            del self._conversations[key]
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+    async def record_exchange(
+        self,
+        conversation: Conversation,
+        user_message: str,
+        answer: Optional[str],
+        request_type: Optional[str] = None
+    ) -> None:
+        """
+        Add a user message and the agent's answer, then summarise overflowing turns.
+
+        Args:
+            conversation: Conversation from get_or_create()
+            user_message: What the user said
+            answer: What the agent replied (or its run output)
+            request_type: Triaged type of the message
+        """
+        conversation.add_turn("user", user_message, request_type)
+        if answer:
+            conversation.add_turn("assistant", answer, request_type)
+        await self._compact(conversation)
+
+    async def _compact(self, conversation: Conversation) -> None:
+        if len(conversation.turns) <= self.max_turns:
+            return
+        # Fold the older half into the summary so summarisation runs every few turns, not every turn
+        keep = self.max_turns // 2
+        overflow, conversation.turns = conversation.turns[:-keep], conversation.turns[-keep:]
+        summary = None
+        if self.summarizer is not None:
+            try:
+                summary = await self.summarizer(conversation.summary, overflow)
+            except Exception as e:
+                logger.warning(f"Conversation summary failed for {conversation.key}, using extractive summary: {e}")
+        conversation.summary = _clip(summary, MAX_SUMMARY_CHARS) if summary else _extractive_summary(conversation.summary, overflow)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conversations = list(self._conversations.values())
+        return {
+            "conversations": len(conversations),
+            "max_conversations": self.max_conversations,
+            "ttl_seconds": self.ttl,
+            "recent": [c.to_dict() for c in reversed(conversations[-20:])]
+        }
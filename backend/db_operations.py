@@ -5,10 +5,12 @@ from datetime import datetime
 import time
 import uuid
 from supabase_client import supabase
+from metrics import time_dependency
 
 
 # Repository operations
 
+@time_dependency("supabase")
 def create_repository(
     repo_fullname: str,
     default_branch: str = "main",
@@ -71,6 +73,7 @@ def create_repository(
         raise Exception(f"Failed to create repository: {str(e)}")
 
 
+@time_dependency("supabase")
 def get_repository(repo_fullname: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
     Get a repository by full name, optionally filtered by user.
@@ -103,6 +106,7 @@ def get_repository(repo_fullname: str, user_id: Optional[str] = None) -> Optiona
         raise Exception(f"Failed to get repository: {str(e)}")
 
 
+@time_dependency("supabase")
 def get_active_repository(user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
     Get the active repository (first active repo) for a user.
@@ -135,6 +139,7 @@ def get_active_repository(user_id: Optional[str] = None) -> Optional[Dict[str, A
         raise Exception(f"Failed to get active repository: {str(e)}")
 
 
+@time_dependency("supabase")
 def list_repositories(limit: int = 50, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     List all repositories, optionally filtered by user.
@@ -167,6 +172,7 @@ def list_repositories(limit: int = 50, user_id: Optional[str] = None) -> List[Di
         raise Exception(f"Failed to list repositories: {str(e)}")
 
 
+@time_dependency("supabase")
 def update_repository(
     repo_fullname: str,
     is_active: Optional[bool] = None,
@@ -225,6 +231,7 @@ def update_repository(
 
 
 
+@time_dependency("supabase")
 def create_proposal(
     proposal_id: str,
     idea_summary: str,
@@ -339,6 +346,7 @@ def create_proposal(
         raise Exception(f"Failed to create proposal: {str(e)}")
 
 
+@time_dependency("supabase")
 def get_proposal(proposal_id: str) -> Optional[Dict[str, Any]]:
     """
     Get a proposal by ID.
@@ -356,6 +364,7 @@ def get_proposal(proposal_id: str) -> Optional[Dict[str, Any]]:
         raise Exception(f"Failed to get proposal: {str(e)}")
 
 
+@time_dependency("supabase")
 def list_proposals(limit: int = 50, status: Optional[str] = None, repo_id: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     List all proposals, optionally filtered by status, repository, or user.
@@ -408,6 +417,7 @@ def list_proposals(limit: int = 50, status: Optional[str] = None, repo_id: Optio
         raise Exception(f"Failed to list proposals: {str(e)}")
 
 
+@time_dependency("supabase")
 def update_proposal(
     proposal_id: str,
     status: Optional[str] = None,
@@ -444,6 +454,7 @@ def update_proposal(
         raise Exception(f"Failed to update proposal: {str(e)}")
 
 
+@time_dependency("supabase")
 def update_proposal_status(proposal_id: str, status: str) -> Dict[str, Any]:
     """
     Update proposal status (convenience function).
@@ -458,6 +469,7 @@ def update_proposal_status(proposal_id: str, status: str) -> Dict[str, Any]:
     return update_proposal(proposal_id, status=status)
 
 
+@time_dependency("supabase")
 def create_experiment(
     proposal_id: str,
     instruction: str,
@@ -502,6 +514,7 @@ def create_experiment(
         raise Exception(f"Failed to create experiment: {str(e)}")
 
 
+@time_dependency("supabase")
 def get_experiment(experiment_id: str) -> Optional[Dict[str, Any]]:
     """
     Get an experiment by ID.
@@ -519,6 +532,7 @@ def get_experiment(experiment_id: str) -> Optional[Dict[str, Any]]:
         raise Exception(f"Failed to get experiment: {str(e)}")
 
 
+@time_dependency("supabase")
 def get_experiment_by_proposal(proposal_id: str) -> Optional[Dict[str, Any]]:
     """
     Get an experiment by proposal ID.
@@ -536,6 +550,7 @@ def get_experiment_by_proposal(proposal_id: str) -> Optional[Dict[str, Any]]:
         raise Exception(f"Failed to get experiment by proposal: {str(e)}")
 
 
+@time_dependency("supabase")
 def list_experiments(limit: int = 50, status: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     List all experiments, optionally filtered by status or user.
@@ -584,6 +599,7 @@ def list_experiments(limit: int = 50, status: Optional[str] = None, user_id: Opt
         raise Exception(f"Failed to list experiments: {str(e)}")
 
 
+@time_dependency("supabase")
 def update_experiment(
     experiment_id: str,
     status: Optional[str] = None,
@@ -638,6 +654,7 @@ def update_experiment(
         raise Exception(f"Failed to update experiment: {str(e)}")
 
 
+@time_dependency("supabase")
 def create_activity_log(
     message: str,
     proposal_id: Optional[str] = None,
@@ -671,6 +688,7 @@ def create_activity_log(
         raise Exception(f"Failed to create activity log: {str(e)}")
 
 
+@time_dependency("supabase")
 def list_activity_logs(limit: int = 50, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     List recent activity logs, optionally filtered by user.
@@ -711,3 +729,40 @@ def list_activity_logs(limit: int = 50, user_id: Optional[str] = None) -> List[D
                 return []
         raise Exception(f"Failed to list activity logs: {str(e)}")
 
+
+
+# Slack event operations
+
+@time_dependency("supabase")
+def claim_slack_event_keys(keys: List[str]) -> bool:
+    """
+    Insert idempotency keys of a Slack event delivery.
+
+    Args:
+        keys: Keys identifying the delivery (event ID, message ID, channel + ts)
+
+    Returns:
+        True if the keys were inserted, False if any of them already exists
+    """
+    try:
+        supabase.table("slack_events").insert([{"event_key": key} for key in keys]).execute()
+        return True
+    except Exception as e:
+        # Unique violation: another delivery (or worker) claimed one of the keys first
+        if getattr(e, "code", None) == "23505" or "duplicate key" in str(e).lower():
+            return False
+        raise Exception(f"Failed to claim Slack event: {str(e)}")
+
+
+@time_dependency("supabase")
+def delete_slack_events_before(cutoff: str) -> None:
+    """
+    Delete Slack event keys claimed before a timestamp.
+
+    Args:
+        cutoff: ISO timestamp; older rows are deleted
+    """
+    try:
+        supabase.table("slack_events").delete().lt("created_at", cutoff).execute()
+    except Exception as e:
+        raise Exception(f"Failed to prune Slack events: {str(e)}")
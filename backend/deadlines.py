@@ -0,0 +1,255 @@
+"""End-to-end deadlines and adaptive step budgets for agent runs.
+
+Every agent request gets a latency SLO by request type. run_autonomous_agent
+opens a deadline for it, and outbound calls made inside the request take
+their timeout from what is left:
+
+    with deadline_scope(slo_for(request_type)):
+        await llm.run(...)                     # gateway timeout <= remaining time
+        requests.post(..., timeout=deadline_timeout(10))
+
+The deadline lives in a context variable, so it follows the request into
+tasks and asyncio.to_thread workers without being threaded through every
+signature.
+
+StepBudgets replaces the fixed max_steps of each branch with a budget sized
+from what runs of that type have needed. It uses the steps that successful
+runs took and the observed time per step. It is capped by the static
+maximum and by what still fits before the deadline.
+
+Configuration:
+    NORTHSTAR_REQUEST_SLOS - JSON overrides in seconds, e.g.
+        {"CODE_CHANGE": 240, "CASUAL_CHAT": 20}
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds an agent request of each type may take end to end
+DEFAULT_SLOS: Dict[str, float] = {
+    "CASUAL_CHAT": 30.0,
+    "REPO_ANALYSIS": 120.0,
+    "ANALYTICS_QUERY": 120.0,
+    "CODE_CHANGE": 300.0,
+    "EXPERIMENT_PROPOSAL": 240.0,
+}
+DEFAULT_SLO = 180.0
+
+# Time kept back from a run so a partial answer can still be posted
+POST_RESERVE_SECONDS = 10.0
+
+MIN_STEPS = 2
+HISTORY_SIZE = 50           # recent runs per request type used for budgets
+HEADROOM = 1.25             # budget = p90 steps of successful runs * HEADROOM
+MIN_OBSERVATIONS = 5        # below this the static maximum is used
+EWMA_ALPHA = 0.2
+
+_current_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar(
+    "northstar_deadline", default=None
+)
+
+
+def _load_slos() -> Dict[str, float]:
+    slos = dict(DEFAULT_SLOS)
+    raw = os.getenv("NORTHSTAR_REQUEST_SLOS")
+    if raw:
+        try:
+            slos.update({key: float(value) for key, value in json.loads(raw).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Ignoring invalid NORTHSTAR_REQUEST_SLOS: {e}")
+    return slos
+
+
+REQUEST_SLOS = _load_slos()
+
+
+def slo_for(request_type: str) -> float:
+    """Latency SLO in seconds of a request type."""
+    return REQUEST_SLOS.get(request_type, DEFAULT_SLO)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when work is started after the request's deadline has passed."""
+
+
+class Deadline:
+    """A point in (monotonic) time by which a request must be answered."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, what: str = "request") -> None:
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceeded(f"{what} is past its {self.seconds:.0f}s deadline")
+
+    def extend_to(self, seconds: float) -> None:
+        """Move the deadline to `seconds` after the start (once the SLO is known)."""
+        self.seconds = seconds
+        self.expires_at = self.started_at + seconds
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextlib.contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """
+    Run a block under a deadline.
+
+    A nested scope never outlives the enclosing one. seconds=None opens an
+    unbounded scope (e.g. for posting an apology after the deadline passed).
+
+    Yields:
+        The Deadline in effect (None for an unbounded scope)
+    """
+    if seconds is None:
+        deadline = None
+    else:
+        deadline = Deadline(seconds)
+        outer = _current_deadline.get()
+        if outer is not None and outer.expires_at < deadline.expires_at:
+            deadline.expires_at = outer.expires_at
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_timeout(default: float, minimum: float = 1.0) -> float:
+    """
+    Timeout for an outbound call: the default, shortened to the time left.
+
+    Args:
+        default: The call's usual timeout in seconds
+        minimum: Floor, so a nearly expired deadline still gets one quick try
+
+    Returns:
+        Timeout in seconds
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    return max(minimum, min(default, deadline.remaining()))
+
+
+class _TypeHistory:
+    def __init__(self):
+        self.successful_steps: deque = deque(maxlen=HISTORY_SIZE)
+        self.seconds_per_step: Optional[float] = None
+        self.runs = 0
+        self.failures = 0
+        self.cut_short = 0
+
+    def p90_steps(self) -> Optional[int]:
+        if len(self.successful_steps) < MIN_OBSERVATIONS:
+            return None
+        ordered = sorted(self.successful_steps)
+        return ordered[min(len(ordered) - 1, math.ceil(0.9 * len(ordered)) - 1)]
+
+
+class StepBudgets:
+    """
+    Adaptive max_steps per request type.
+
+    Example:
+        max_steps = step_budgets.budget("CODE_CHANGE", 25, deadline.remaining())
+        ...
+        step_budgets.observe("CODE_CHANGE", steps=9, seconds=41.0, success=True)
+    """
+
+    def __init__(self):
+        self._history: Dict[str, _TypeHistory] = {}
+        self._lock = threading.Lock()
+
+    def _for(self, request_type: str) -> _TypeHistory:
+        return self._history.setdefault(request_type, _TypeHistory())
+
+    def budget(self, request_type: str, max_steps: int, remaining: Optional[float] = None) -> int:
+        """
+        Steps a run may take.
+
+        Args:
+            request_type: Triaged request type
+            max_steps: Static maximum of the branch (never exceeded)
+            remaining: Seconds left before the deadline, if any
+
+        Returns:
+            Step limit, at least MIN_STEPS (or max_steps if that is lower)
+        """
+        floor = min(MIN_STEPS, max_steps)
+        with self._lock:
+            history = self._for(request_type)
+            p90 = history.p90_steps()
+            seconds_per_step = history.seconds_per_step
+
+        steps = max_steps
+        if p90 is not None:
+            # Headroom over what successful runs needed; runs that loop past it rarely recover
+            steps = min(steps, math.ceil(p90 * HEADROOM) + 1)
+        if remaining is not None and seconds_per_step:
+            steps = min(steps, int((remaining - POST_RESERVE_SECONDS) / seconds_per_step))
+        return max(floor, steps)
+
+    def observe(self, request_type: str, steps: int, seconds: float, success: bool, cut_short: bool = False) -> None:
+        """
+        Record a finished run.
+
+        Args:
+            request_type: Triaged request type
+            steps: Model steps the run took
+            seconds: Wall-clock duration of the run
+            success: The run completed normally
+            cut_short: The run was stopped by its deadline
+        """
+        with self._lock:
+            history = self._for(request_type)
+            history.runs += 1
+            if success:
+                history.successful_steps.append(steps)
+            else:
+                history.failures += 1
+            if cut_short:
+                history.cut_short += 1
+            if steps:
+                per_step = seconds / steps
+                history.seconds_per_step = per_step if history.seconds_per_step is None else \
+                    EWMA_ALPHA * per_step + (1 - EWMA_ALPHA) * history.seconds_per_step
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                request_type: {
+                    "slo_seconds": slo_for(request_type),
+                    "runs": history.runs,
+                    "failures": history.failures,
+                    "cut_short": history.cut_short,
+                    "p90_steps": history.p90_steps(),
+                    "seconds_per_step": round(history.seconds_per_step, 2) if history.seconds_per_step else None
+                }
+                for request_type, history in sorted(self._history.items())
+            }
@@ -0,0 +1,597 @@
+"""Single gateway for every LLM and Metorial call.
+
+All model traffic from the API goes through one LLMGateway so it shares:
+- bounded concurrency per model
+- retries with exponential backoff and jitter on 429/5xx/connection errors
+- per-call deadlines covering all attempts, capped by the request's deadline (see deadlines.py)
+- singleflight coalescing: identical in-flight requests share one upstream call
+- per-call-site token and latency accounting (see LLMGateway.stats())
+- model routing with fallback and per-route cost (see model_router.py)
+- warm, health-checked MCP sessions for Metorial runs (see mcp_session_pool.py)
+- progress hooks: per-step callbacks for runs, token streaming for chat
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, Any, List, Optional, Callable
+
+import openai
+from metorial import MetorialSDKError
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+from context_budget import estimate_tokens
+from deadlines import current_deadline
+from metrics import (
+    LLM_CALL_DURATION, LLM_TOKENS, LLM_RETRIES, LLM_COALESCED, LLM_COST, LLM_FALLBACKS, LLM_ROUTE_DURATION
+)
+from mcp_session_pool import MCPSessionPool
+from model_router import ModelRouter, estimate_cost
+from tracing import child_span
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+DEFAULT_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "300"))
+
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 20.0
+
+# Usage accumulator of the call currently executing (set per attempt)
+_current_usage: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar(
+    "llm_gateway_usage", default=None
+)
+
+# Called with every completion of the Metorial run currently executing (see LLMGateway.run on_step)
+_step_listener: contextvars.ContextVar[Optional[Callable[[Any], None]]] = contextvars.ContextVar(
+    "llm_gateway_step_listener", default=None
+)
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when a gateway call (including retries) runs past its deadline."""
+
+
+class _UsageRecordingCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    async def create(self, *args, **kwargs):
+        response = await self._completions.create(*args, **kwargs)
+        usage = _current_usage.get()
+        if usage is not None and getattr(response, "usage", None) is not None:
+            usage["prompt_tokens"] += response.usage.prompt_tokens or 0
+            usage["completion_tokens"] += response.usage.completion_tokens or 0
+            usage["requests"] += 1
+        listener = _step_listener.get()
+        if listener is not None and not kwargs.get("stream"):
+            try:
+                listener(response)
+            except Exception as e:
+                logger.warning(f"Step listener failed: {e}")
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class _UsageRecordingChat:
+    def __init__(self, chat):
+        self._chat = chat
+        self.completions = _UsageRecordingCompletions(chat.completions)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+class UsageRecordingAsyncOpenAI:
+    """
+    AsyncOpenAI wrapper handed to metorial.run so the tokens of every
+    completion inside a multi-step tool loop are counted, not just the final text.
+
+    The class name keeps "AsyncOpenAI" in it - Metorial picks its provider
+    adapter (and async code path) from the client's class name.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = _UsageRecordingChat(client.chat)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class CallSiteStats:
+    """Counters for one call site (e.g. "propose.mcp") or route (e.g. "triage")."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.deadline_exceeded = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.upstream_requests = 0
+        self.cost_usd = 0.0
+        self.fallbacks = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "deadline_exceeded": self.deadline_exceeded,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "upstream_requests": self.upstream_requests,
+            "cost_usd": round(self.cost_usd, 6),
+            "fallbacks": self.fallbacks,
+            "avg_latency_ms": round(self.total_latency / self.calls * 1000, 1) if self.calls else 0.0,
+            "max_latency_ms": round(self.max_latency * 1000, 1)
+        }
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limits, server errors and transport failures."""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, MetorialSDKError):
+        return error.status == 429 or error.status >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Server-provided Retry-After in seconds, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when given."""
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY) + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class LLMGateway:
+    """
+    Routes Metorial runs and chat completions through shared limits.
+
+    Example:
+        gateway = LLMGateway(metorial, openai_client)
+        result = await gateway.run("propose.mcp", message=prompt, server_deployments=deps,
+                                   route="proposal", max_steps=10)
+        response = await gateway.chat("agent.triage", messages=[...], route="triage", max_tokens=10)
+    """
+
+    def __init__(
+        self,
+        metorial_client,
+        openai_client,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        default_timeout: float = DEFAULT_TIMEOUT,
+        router: Optional[ModelRouter] = None,
+        sessions: Optional[MCPSessionPool] = None
+    ):
+        """
+        Args:
+            metorial_client: Metorial instance used for tool-calling runs
+            openai_client: AsyncOpenAI instance used for completions
+            max_concurrency: In-flight calls allowed per model
+            model_limits: Per-model overrides of max_concurrency
+            max_retries: Retries after the first attempt for retryable errors
+            default_timeout: Deadline in seconds for a call including retries
+            router: Model routing policy (defaults to ModelRouter.from_env())
+            sessions: Warm MCP session pool for runs (None: Metorial sets sessions up itself)
+        """
+        self.metorial = metorial_client
+        self.openai_client = openai_client
+        self._recording_client = UsageRecordingAsyncOpenAI(openai_client)
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self.default_timeout = default_timeout
+        self.router = router or ModelRouter.from_env()
+        self.sessions = sessions
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._stats: Dict[str, CallSiteStats] = {}
+        self._route_stats: Dict[str, CallSiteStats] = {}
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.model_limits.get(model, self.max_concurrency))
+        return self._semaphores[model]
+
+    def _site(self, call_site: str) -> CallSiteStats:
+        return self._stats.setdefault(call_site, CallSiteStats())
+
+    def _route(self, route: str) -> CallSiteStats:
+        return self._route_stats.setdefault(route, CallSiteStats())
+
+    async def run(
+        self,
+        call_site: str,
+        message: str,
+        server_deployments: List[Any],
+        route: Optional[str] = None,
+        model: Optional[str] = None,
+        max_steps: int = 10,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        coalesce: bool = True,
+        side_effects: bool = False,
+        accept: Optional[Callable[[Any], bool]] = None,
+        on_step: Optional[Callable[[int, List[str]], None]] = None,
+        **kwargs
+    ):
+        """
+        Run a Metorial tool-calling loop.
+
+        Args:
+            call_site: Stable name of the caller, used for stats
+            message: User message for the run
+            server_deployments: Metorial deployment IDs or dicts
+            route: Routing policy entry (see model_router.py) picking the models
+            model: Explicit model, overriding the route (no fallback)
+            max_steps: Tool-calling step limit
+            timeout: Deadline in seconds (defaults to the gateway's; never past
+                the deadline of the enclosing deadline_scope)
+            retries: Retry limit per model (defaults to the gateway's)
+            coalesce: Share the result with identical in-flight runs
+            side_effects: The run's tools act externally (posting to Slack,
+                opening PRs). Disables retries, coalescing and fallback, since
+                a failed run may already have performed some of them.
+            accept: Returns False for low-confidence results, triggering fallback
+            on_step: Called after each model step with the step number and the
+                names of the tools the model asked for (progress reporting)
+            **kwargs: Passed through to metorial.run (temperature, tools, ...)
+
+        Returns:
+            Metorial RunResult
+        """
+        def make_attempt(model_name: str):
+            async def attempt():
+                steps = 0
+
+                def listen(response) -> None:
+                    nonlocal steps
+                    steps += 1
+                    tool_calls = (response.choices[0].message.tool_calls or []) if response.choices else []
+                    on_step(steps, [call.function.name for call in tool_calls])
+
+                token = _step_listener.set(listen if on_step else None)
+                lease = self.sessions.lease(server_deployments) if self.sessions else contextlib.nullcontext()
+                try:
+                    async with lease:
+                        result = await self.metorial.run(
+                            client=self._recording_client,
+                            message=message,
+                            server_deployments=server_deployments,
+                            model=model_name,
+                            max_steps=max_steps,
+                            **kwargs
+                        )
+                finally:
+                    _step_listener.reset(token)
+                return result, result.text
+            return attempt
+
+        def make_key(model_name: str) -> str:
+            return self._key("run", model_name, message, server_deployments, max_steps, kwargs)
+
+        return await self._routed(
+            call_site, route, model, make_attempt, make_key, message,
+            timeout, retries, coalesce, side_effects, accept
+        )
+
+    async def chat(
+        self,
+        call_site: str,
+        messages: List[Dict[str, Any]],
+        route: Optional[str] = None,
+        model: Optional[str] = None,
+        client=None,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        coalesce: bool = True,
+        accept: Optional[Callable[[Any], bool]] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        **kwargs
+    ):
+        """
+        Create a chat completion.
+
+        Args:
+            call_site: Stable name of the caller, used for stats
+            messages: Chat messages
+            route: Routing policy entry (see model_router.py) picking the models
+            model: Explicit model, overriding the route (no fallback)
+            client: AsyncOpenAI-compatible client (defaults to the gateway's)
+            timeout: Deadline in seconds (defaults to the gateway's)
+            retries: Retry limit per model (defaults to the gateway's)
+            coalesce: Share the result with identical in-flight requests
+            accept: Returns False for low-confidence responses, triggering fallback
+            on_delta: Stream the completion, calling this with the text so far
+                after every chunk (implies coalesce=False)
+            **kwargs: Passed through to chat.completions.create
+
+        Returns:
+            The ChatCompletion response (assembled from the chunks when streaming)
+        """
+        completions = self._recording_client.chat.completions if client is None else \
+            _UsageRecordingCompletions(client.chat.completions)
+        base_url = str(getattr(client, "base_url", "")) if client is not None else ""
+
+        def make_attempt(model_name: str):
+            async def attempt():
+                if on_delta is not None:
+                    return await self._stream(completions, model_name, messages, on_delta, kwargs)
+                response = await completions.create(model=model_name, messages=messages, **kwargs)
+                return response, None
+            return attempt
+
+        def make_key(model_name: str) -> str:
+            return self._key("chat", model_name, messages, base_url, kwargs)
+
+        prompt_text = "\n".join(str(m.get("content", "")) for m in messages)
+        return await self._routed(
+            call_site, route, model, make_attempt, make_key, prompt_text,
+            timeout, retries, coalesce and on_delta is None, False, accept
+        )
+
+    @staticmethod
+    async def _stream(completions, model: str, messages: List[Dict[str, Any]],
+                      on_delta: Callable[[str], None], kwargs: Dict[str, Any]):
+        """Stream a completion into on_delta and assemble the final ChatCompletion."""
+        stream = await completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        parts: List[str] = []
+        response_id, created, finish_reason, usage = "", int(time.time()), "stop", None
+        async for chunk in stream:
+            response_id, created = chunk.id, chunk.created
+            if chunk.usage is not None:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    on_delta("".join(parts))
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+
+        recorded = _current_usage.get()
+        if recorded is not None and usage is not None:
+            recorded["prompt_tokens"] += usage.prompt_tokens or 0
+            recorded["completion_tokens"] += usage.completion_tokens or 0
+            recorded["requests"] += 1
+
+        text = "".join(parts)
+        response = ChatCompletion(
+            id=response_id or "stream",
+            object="chat.completion",
+            created=created,
+            model=model,
+            choices=[Choice(
+                index=0,
+                finish_reason=finish_reason,
+                message=ChatCompletionMessage(role="assistant", content=text)
+            )],
+            usage=usage
+        )
+        return response, text
+
+    @staticmethod
+    def _key(*parts) -> str:
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _routed(self, call_site, route, model, make_attempt, make_key, prompt_text,
+                      timeout, retries, coalesce, side_effects, accept):
+        """Try the route's models in order until one succeeds with an accepted answer."""
+        route = route or "unrouted"
+        models = [model] if model else self.router.models_for(route)
+        if side_effects:
+            retries, coalesce = 0, False
+        deadline = time.monotonic() + (timeout if timeout is not None else self.default_timeout)
+        request_deadline = current_deadline()
+        if request_deadline is not None:
+            # Never outlive the request this call serves
+            deadline = min(deadline, request_deadline.expires_at)
+            if deadline <= time.monotonic():
+                self._site(call_site).deadline_exceeded += 1
+                raise LLMDeadlineExceeded(f"LLM call {call_site} started after its request deadline")
+        route_stats = self._route(route)
+        route_stats.calls += 1
+        started = time.monotonic()
+        outcome = "error"
+
+        try:
+            for index, model_name in enumerate(models):
+                is_last = index == len(models) - 1
+                key = make_key(model_name) if coalesce else None
+                try:
+                    result = await self._call(
+                        call_site, route, model_name, make_attempt(model_name),
+                        prompt_text, key, deadline, retries
+                    )
+                except LLMDeadlineExceeded:
+                    raise
+                except Exception as e:
+                    if side_effects or is_last:
+                        raise
+                    self._fallback(route, model_name, models[index + 1], "error", str(e))
+                    continue
+
+                if accept is not None and not is_last and not accept(result):
+                    self._fallback(route, model_name, models[index + 1], "low_confidence", "answer rejected")
+                    continue
+                outcome = "success"
+                return result
+        except Exception:
+            route_stats.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            route_stats.total_latency += elapsed
+            route_stats.max_latency = max(route_stats.max_latency, elapsed)
+            LLM_ROUTE_DURATION.observe(elapsed, route=route, outcome=outcome)
+
+    def _fallback(self, route: str, from_model: str, to_model: str, reason: str, detail: str) -> None:
+        self._route(route).fallbacks += 1
+        LLM_FALLBACKS.inc(route=route, from_model=from_model, reason=reason)
+        logger.warning(f"LLM route {route}: falling back from {from_model} to {to_model} ({reason}: {detail[:200]})")
+
+    async def _call(self, call_site, route, model, attempt, prompt_text, key, deadline, retries):
+        with child_span(f"llm.{call_site}", model=model, route=route) as call_span:
+            return await self._call_in_span(call_span, call_site, route, model, attempt, prompt_text, key, deadline, retries)
+
+    async def _call_in_span(self, call_span, call_site, route, model, attempt, prompt_text, key, deadline, retries):
+        stats = self._site(call_site)
+        stats.calls += 1
+        started = time.monotonic()
+        retries = self.max_retries if retries is None else retries
+
+        if key is not None and key in self._inflight:
+            stats.coalesced += 1
+            LLM_COALESCED.inc(call_site=call_site, model=model)
+            if call_span:
+                call_span.set_attribute("coalesced", True)
+            task = self._inflight[key]
+            logger.info(f"LLM call {call_site} coalesced with an identical in-flight request")
+        else:
+            task = asyncio.create_task(
+                self._execute(call_site, route, model, attempt, prompt_text, deadline, retries)
+            )
+            if key is not None:
+                self._inflight[key] = task
+                task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+
+        waiter_key = key or id(task)
+        self._waiters[waiter_key] = self._waiters.get(waiter_key, 0) + 1
+        outcome = "error"
+        try:
+            remaining = deadline - time.monotonic()
+            result = await asyncio.wait_for(asyncio.shield(task), timeout=max(remaining, 0))
+            outcome = "success"
+            return result
+        except asyncio.TimeoutError:
+            outcome = "deadline_exceeded"
+            stats.deadline_exceeded += 1
+            stats.errors += 1
+            raise LLMDeadlineExceeded(f"LLM call {call_site} exceeded its deadline")
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            stats.total_latency += elapsed
+            stats.max_latency = max(stats.max_latency, elapsed)
+            LLM_CALL_DURATION.observe(elapsed, call_site=call_site, model=model, outcome=outcome)
+            self._waiters[waiter_key] -= 1
+            if not self._waiters[waiter_key]:
+                del self._waiters[waiter_key]
+                # Nobody is waiting for the result any more
+                if not task.done():
+                    task.cancel()
+
+    async def _execute(self, call_site, route, model, attempt, prompt_text, deadline, retries):
+        stats = self._site(call_site)
+        for attempt_number in range(retries + 1):
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "requests": 0}
+            output_text = None
+            token = _current_usage.set(usage)
+            try:
+                with child_span("llm.attempt", attempt=attempt_number + 1) as attempt_span:
+                    queued_at = time.monotonic()
+                    async with self._semaphore(model):
+                        if attempt_span:
+                            attempt_span.set_attribute("queue_ms", round((time.monotonic() - queued_at) * 1000, 1))
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        result, output_text = await asyncio.wait_for(attempt(), timeout=remaining)
+                    if attempt_span:
+                        attempt_span.set_attribute("prompt_tokens", usage["prompt_tokens"])
+                        attempt_span.set_attribute("completion_tokens", usage["completion_tokens"])
+                        attempt_span.set_attribute("upstream_requests", usage["requests"])
+                return result
+            except Exception as e:
+                if not is_retryable(e) or attempt_number >= retries:
+                    raise
+                delay = _backoff_delay(attempt_number, e)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                stats.retries += 1
+                LLM_RETRIES.inc(call_site=call_site, model=model)
+                logger.warning(
+                    f"LLM call {call_site} failed ({type(e).__name__}: {str(e)[:200]}), "
+                    f"retrying in {delay:.1f}s (attempt {attempt_number + 1}/{retries})"
+                )
+                await asyncio.sleep(delay)
+            finally:
+                _current_usage.reset(token)
+                self._record_usage(call_site, route, model, usage, prompt_text, output_text)
+
+    def _record_usage(self, call_site: str, route: str, model: str, usage: Dict[str, int],
+                      prompt_text: str, output_text: Optional[str]):
+        """Add an attempt's token usage and cost, estimating tokens when the provider reported none."""
+        if usage["requests"]:
+            prompt_tokens = usage["prompt_tokens"]
+            completion_tokens = usage["completion_tokens"]
+        elif output_text is not None:
+            prompt_tokens = estimate_tokens(prompt_text)
+            completion_tokens = estimate_tokens(output_text)
+        else:
+            return
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        for stats in (self._site(call_site), self._route(route)):
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.upstream_requests += usage["requests"]
+            stats.cost_usd += cost
+        LLM_TOKENS.inc(prompt_tokens, call_site=call_site, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, call_site=call_site, model=model, kind="completion")
+        LLM_COST.inc(cost, route=route, model=model)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-call-site and per-route counters plus current concurrency per model."""
+        return {
+            "call_sites": {site: s.to_dict() for site, s in sorted(self._stats.items())},
+            "routes": {route: s.to_dict() for route, s in sorted(self._route_stats.items())},
+            "routing_table": self.router.table(),
+            "models": {
+                model: {
+                    "limit": self.model_limits.get(model, self.max_concurrency),
+                    "in_flight": self.model_limits.get(model, self.max_concurrency) - sem._value
+                }
+                for model, sem in self._semaphores.items()
+            },
+            "inflight_coalescing_keys": len(self._inflight),
+            "mcp_sessions": self.sessions.stats() if self.sessions else None
+        }
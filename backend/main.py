@@ -2,41 +2,66 @@
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from metorial import Metorial
 from openai import AsyncOpenAI
 from github import Github
 from github.GithubException import UnknownObjectException
+from northstar_mcp.github_pool import BACKGROUND, github_client, github_stats
 import os
 import json
 import re
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import time
 import tempfile
 import shutil
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
-from captain_client import CaptainClient
+from captain_client import CaptainClient, CAPTAIN_BASE_URL
 from repo_indexer import (
     clone_repository,
-    get_indexable_files,
+    scan_repository,
+    iter_files_bulk,
     read_key_files,
-    analyze_repository_structure,
     prepare_file_for_captain
 )
 
 import db_operations
-from pr_creator import PRCreator
+from pr_creator import PRCreator, GITHUB_API_URL
+from context_budget import ContextBudget, CHARS_PER_TOKEN, pack_context
+from context_compressor import compress_for_context
+from repo_mirror import get_churn_index, list_files, read_file
+import code_change_fastpath
+from northstar_mcp.morph_client import get_morph_client
+from llm_gateway import LLMGateway, LLMDeadlineExceeded
+import replay
+from deadlines import DEFAULT_SLO, POST_RESERVE_SECONDS, StepBudgets, deadline_scope, slo_for
+from mcp_session_pool import MCPSessionPool, session_key
+from speculative_prefetch import SpeculativePrefetch, mentions_code
+from slack_stream import NOT_SHOWN, PARTIAL, SHOWN, StreamingReply
+from conversation_memory import ConversationMemory, Conversation, conversation_key
+from slack_dedup import create_event_store, event_keys
+from mention_coalescer import MentionCoalescer, mark_committed
+from metrics import (
+    render_metrics, time_stage, HTTP_REQUEST_DURATION, AGENT_REQUEST_DURATION, AGENT_REQUESTS
+)
+import tracing
 import logging
 
 load_dotenv()
 
-# Configure logging to show INFO level messages
+# Configure logging to show INFO level messages, tagged with the active trace ID
+log_handler = logging.StreamHandler()  # Output to console
+log_handler.addFilter(tracing.TraceIdLogFilter())
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Output to console
-    ]
+    format='%(asctime)s - %(name)s - %(levelname)s - [trace %(trace_id)s] %(message)s',
+    handlers=[log_handler]
 )
 logger = logging.getLogger(__name__)
 logger.info("🚀 Northstar backend starting up...")
@@ -85,20 +110,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by its route template (not the raw path, to keep label cardinality bounded)."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status)
+        )
+
 # Initialize logging
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Record or replay outbound calls for offline runs (NORTHSTAR_REPLAY_MODE, see replay.py)
+replay_cassette = replay.install_from_env()
+replaying = replay_cassette is not None and replay_cassette.mode == "replay"
+
 # Initialize Metorial, OpenAI, and Captain
 metorial = Metorial(api_key=os.getenv("METORIAL_API_KEY"))
 openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Every LLM/Metorial call goes through the gateway (concurrency, retries, deadlines, coalescing)
+# and runs on warm MCP sessions from the pool (none when replaying: runs never reach Metorial)
+mcp_sessions = MCPSessionPool(metorial)
+llm = LLMGateway(metorial, openai_client, sessions=None if replaying else mcp_sessions)
 slack_deployment_id = os.getenv("SLACK_DEPLOYMENT_ID")
 github_deployment_id = os.getenv("GITHUB_DEPLOYMENT_ID", "srv_0mg8iy70b29Y2sPqULfav8")
 northstar_mcp_deployment_id = os.getenv("NORTHSTAR_DEPLOYMENT_ID")  # Updated to match .env
 posthog_deployment_id = os.getenv("POSTHOG_DEPLOYMENT_ID")  # PostHog analytics MCP
 slack_oauth_session_id = os.getenv("SLACK_OAUTH_SESSION_ID")  # Global Slack OAuth session
 
+
+def warm_deployment_sets() -> List[List[Dict[str, str]]]:
+    """Deployment sets used by the Slack agent, in the form run_autonomous_agent passes them."""
+    slack = {"serverDeploymentId": slack_deployment_id, "oauthSessionId": slack_oauth_session_id}
+    candidates = [
+        [slack],                                                    # casual chat, repo analysis
+        [{"serverDeploymentId": posthog_deployment_id}, slack],     # analytics
+        [slack, {"serverDeploymentId": github_deployment_id},
+         {"serverDeploymentId": northstar_mcp_deployment_id}],      # code change, proposals
+    ]
+    return [deployments for deployments in candidates if session_key(deployments)]
+
+
+@app.on_event("startup")
+async def start_mcp_session_pool():
+    """Start pool maintenance and warm the agent's sessions in the background."""
+    if replaying:
+        return
+    mcp_sessions.start()
+    if os.getenv("NORTHSTAR_MCP_WARM_ON_STARTUP", "true").lower() == "true":
+        asyncio.create_task(mcp_sessions.warm(warm_deployment_sets()))
+
+
+@app.on_event("shutdown")
+async def stop_mcp_session_pool():
+    await mcp_sessions.close()
+
+# Prompt context budgets in tokens (see context_budget.py)
+PROPOSAL_MCP_CONTEXT_TOKENS = 850  # Kept small to avoid content filter issues
+PROPOSAL_FALLBACK_CONTEXT_TOKENS = 2300
+INIT_ANALYSIS_CONTEXT_TOKENS = 60000
+INIT_ANALYSIS_FILE_TOKENS = 2800  # Per-file allocation (~10k chars)
+REPO_ANALYSIS_CONTEXT_TOKENS = 4000
+
+# Files of the repository context fetched from GitHub at once
+CONTEXT_FETCH_WORKERS = int(os.getenv("NORTHSTAR_CONTEXT_FETCH_WORKERS", "8"))
+
 # Initialize Captain client (optional - will be None if not configured)
 try:
     captain = CaptainClient()
@@ -107,6 +196,7 @@ except ValueError:
     print("Warning: Captain not configured - knowledge base features disabled")
 
 
+@time_stage("context_fetch")
 async def fetch_repository_context(repo_fullname: str, active_repo: Optional[Dict[str, Any]] = None) -> str:
     """
     Fetch repository code context from GitHub to understand the codebase.
@@ -116,6 +206,10 @@ async def fetch_repository_context(repo_fullname: str, active_repo: Optional[Dic
     2. If GITHUB_TOKEN is not set: Returns instructions for providing code directly
     
     Returns a formatted string with repository structure and key files WITH FULL CODE CONTENT.
+
+    The crawl runs on a pooled GitHub client at BACKGROUND priority: when the
+    rate-limit budget runs low its requests are refused (files are skipped)
+    so that PR creation keeps the remaining budget.
     """
     github_token = os.getenv("GITHUB_TOKEN")
     if not github_token:
@@ -124,9 +218,26 @@ Note: GITHUB_TOKEN not set. To analyze your codebase:
 Option 1: Set GITHUB_TOKEN in .env to automatically fetch from GitHub
 Option 2: Provide codebase_context in the request with your code
 Option 3: The system will generate generic proposals without code analysis."""
-    
+
+    base_branch = active_repo.get("base_branch", "main") if active_repo else "main"
+
+    # Per-file change frequency/recency from the local mirror, used to rank
+    # actively developed files ahead of dead code
+    churn = None
+    try:
+        churn = await asyncio.to_thread(get_churn_index, repo_fullname, base_branch)
+    except Exception as e:
+        logger.warning(f"Churn index unavailable for {repo_fullname}: {tracing.redact_secrets(str(e))}")
+
+    # The crawl makes dozens of blocking GitHub requests; it runs on a worker
+    # thread so other requests keep being served meanwhile
+    with github_client(BACKGROUND, github_token, GITHUB_API_URL) as g:
+        return await asyncio.to_thread(_crawl_repository_context, g, github_token, repo_fullname, base_branch, churn)
+
+
+def _crawl_repository_context(g: Github, github_token: str, repo_fullname: str, base_branch: str, churn) -> str:
+    """fetch_repository_context() with a borrowed client, run on a worker thread."""
     try:
-        g = Github(github_token)
         try:
             repo = g.get_repo(repo_fullname)
         except UnknownObjectException:
@@ -141,8 +252,6 @@ Please provide codebase_context manually in the request, or check that:
 - GITHUB_TOKEN has access to this repository
 - The repository is not private (or the token has access to private repos)
 """
-        base_branch = active_repo.get("base_branch", "main") if active_repo else "main"
-        
         # Get repository info
         context_parts = [
             f"Repository: {repo_fullname}",
@@ -207,11 +316,45 @@ Please provide codebase_context manually in the request, or check that:
                        "widgets", "services", "models", "utils", "helpers", "api", 
                        "controllers", "views", "backend", "server"]
         
+        if churn:
+            active_files = [
+                f for f in churn.top_files(limit=40)
+                if f['path'].split('/')[-1] not in config_files
+            ][:15]
+            if active_files:
+                context_parts.append("\n=== Actively Developed Files (most recently and frequently changed) ===")
+                for f in active_files:
+                    last_changed = datetime.fromtimestamp(f['last_changed'], tz=timezone.utc).strftime('%Y-%m-%d')
+                    context_parts.append(f"  - {f['path']} ({f['commits']} commits, last changed {last_changed})")
+
         context_parts.append("\n=== USER-WRITTEN SOURCE CODE (PRIORITY) ===")
         files_read = 0
-        max_files = 30  # Increased to prioritize source code
+        max_files = 80  # Most files beyond the first few are rendered as skeletons
+        full_text_files = 8  # Most relevant files keep their verbatim contents
         total_chars = 0
         max_total_chars = 60000  # Increased total character limit
+
+        def add_file_to_context(file_path: str, content_text: str) -> bool:
+            """
+            Append a file to the context, verbatim for the top-ranked files and
+            as a skeleton for the rest (or when the full text no longer fits).
+
+            Returns True if the file was added.
+            """
+            nonlocal files_read, total_chars
+            full = files_read < full_text_files
+            rendered = compress_for_context(file_path, content_text, full=full)
+            if full and total_chars + len(rendered) > max_total_chars:
+                full = False
+                rendered = compress_for_context(file_path, content_text, full=False)
+            if not rendered.strip() or total_chars + len(rendered) > max_total_chars:
+                return False
+            label = "USER-WRITTEN CODE" if full else "USER-WRITTEN CODE - SKELETON"
+            context_parts.append(f"\n--- {file_path} ({label}) ---")
+            context_parts.append(rendered)
+            files_read += 1
+            total_chars += len(rendered)
+            return True
         
         # Helper function to check if a file is source code
         def is_source_file(file_path: str) -> bool:
@@ -275,34 +418,35 @@ Please provide codebase_context manually in the request, or check that:
             except Exception:
                 continue
         
-        # Sort by depth (shallow first) to prioritize main files
-        prioritized_files.sort(key=lambda x: (x['depth'], x['path']))
+        # Actively developed files first, then shallow files (main entry points)
+        prioritized_files.sort(key=lambda x: (
+            -churn.score(x['path']) if churn else 0,
+            x['depth'],
+            x['path']
+        ))
         
-        # Read prioritized source files
-        for file_info in prioritized_files[:max_files]:
-            if files_read >= max_files or total_chars >= max_total_chars:
-                break
+        def fetch_text(file_path: str) -> Optional[str]:
+            """Contents of a file, fetched on a pooled client of this thread's own."""
             try:
-                file_content = file_info['content_obj']
-                file_path = file_info['path']
-                
-                if file_content.size < 80000:  # 80KB limit per file
-                    content_text = file_content.decoded_content.decode('utf-8')
-                    file_chars = len(content_text)
-                    if total_chars + file_chars <= max_total_chars:
-                        context_parts.append(f"\n--- {file_path} (USER-WRITTEN CODE) ---")
-                        context_parts.append(content_text)
-                        files_read += 1
-                        total_chars += file_chars
-                    elif max_total_chars - total_chars > 5000:
-                        # Include partial if we have significant space left
-                        remaining = max_total_chars - total_chars
-                        context_parts.append(f"\n--- {file_path} (USER-WRITTEN CODE - PARTIAL) ---")
-                        context_parts.append(content_text[:remaining])
-                        files_read += 1
-                        total_chars += remaining
+                with github_client(BACKGROUND, github_token, GITHUB_API_URL) as worker:
+                    file_content = worker.get_repo(repo_fullname, lazy=True).get_contents(file_path, ref=base_branch)
+                    return file_content.decoded_content.decode('utf-8')
             except Exception:
-                continue
+                return None
+
+        # Read prioritized source files, a batch at a time fetched concurrently
+        candidates = [f for f in prioritized_files[:max_files] if f['content_obj'].size < 80000]  # 80KB limit per file
+        with ThreadPoolExecutor(max_workers=CONTEXT_FETCH_WORKERS) as fetchers:
+            for start in range(0, len(candidates), CONTEXT_FETCH_WORKERS):
+                if files_read >= max_files or total_chars >= max_total_chars:
+                    break
+                batch = candidates[start:start + CONTEXT_FETCH_WORKERS]
+                texts = fetchers.map(fetch_text, [f['path'] for f in batch])
+                for file_info, content_text in zip(batch, texts):
+                    if files_read >= max_files or total_chars >= max_total_chars:
+                        break
+                    if content_text is not None:
+                        add_file_to_context(file_info['path'], content_text)
         
         # If we haven't read enough, also try top-level source files
         if files_read < max_files and total_chars < max_total_chars:
@@ -319,12 +463,7 @@ Please provide codebase_context manually in the request, or check that:
                         try:
                             if file_content.size < 50000:
                                 content_text = file_content.decoded_content.decode('utf-8')
-                                file_chars = len(content_text)
-                                if total_chars + file_chars <= max_total_chars:
-                                    context_parts.append(f"\n--- {file_content.name} (USER-WRITTEN CODE) ---")
-                                    context_parts.append(content_text)
-                                    files_read += 1
-                                    total_chars += file_chars
+                                add_file_to_context(file_content.name, content_text)
                         except Exception:
                             continue
             except Exception:
@@ -342,12 +481,7 @@ Please provide codebase_context manually in the request, or check that:
                     file_content = repo.get_contents(file_path, ref=base_branch)
                     if file_content.size < 80000:  # 80KB limit per file
                         content_text = file_content.decoded_content.decode('utf-8')
-                        file_chars = len(content_text)
-                        if total_chars + file_chars <= max_total_chars:
-                            context_parts.append(f"\n--- {file_path} (USER-WRITTEN CODE) ---")
-                            context_parts.append(content_text)
-                            files_read += 1
-                            total_chars += file_chars
+                        add_file_to_context(file_path, content_text)
                 except Exception as e:
                     # Log but continue - file might not exist or be inaccessible
                     continue
@@ -429,6 +563,7 @@ class ExecuteExperimentRequest(BaseModel):
     oauth_session_id: str
     repo_fullname: Optional[str] = None
     file_path: Optional[str] = None
+    file_paths: Optional[List[str]] = None  # every file of a multi-file change (file_path is the first)
     base_branch: Optional[str] = None
 
 
@@ -498,6 +633,7 @@ async def complete_oauth(session_id: str):
 
 
 @app.post("/northstar/propose")
+@tracing.start_trace("northstar.propose")
 async def propose_experiment(
     req: ProposeExperimentRequest,
     request: Request,
@@ -653,11 +789,14 @@ User-provided codebase context:
         try:
             if northstar_mcp_deployment_id:
                 # Try to use propose_experiment tool with a simpler, less directive prompt
-                # Truncate context to avoid content filter issues
-                safe_context = repo_context[:3000] if len(repo_context) > 3000 else repo_context
+                # Pack context into a small budget to avoid content filter issues
+                packed_context = pack_context(repo_context, PROPOSAL_MCP_CONTEXT_TOKENS)
+                safe_context = packed_context.text
+                logger.info(f"Proposal context (MCP path): {packed_context.summary()}")
                 
-                result = await metorial.run(
-                    client=openai_client,
+                result = await llm.run(
+                    "propose.mcp",
+                    side_effects=True,
                     message=f"""CRITICAL: You MUST analyze and use ONLY the actual code provided below. Do NOT generate generic or pseudo code.
 
 Repository: {repo_fullname}
@@ -671,8 +810,9 @@ REQUIREMENTS:
 3. Do NOT create generic examples or pseudo code - only use real code from the context
 4. In your technical_plan, reference actual file paths that appear in the code above
 5. In your update_block, show actual code snippets from the context with your proposed changes
+6. If technical_plan lists more than one file, start each file's part of the update_block with a line "=== path/from/technical_plan ==="
 
-Task: Find ONE specific UI/styling issue in the actual code above and propose a concrete fix using real code from the context.
+Task: Find ONE specific UI/styling issue in the actual code above and propose a concrete fix using real code from the context. Prefer files listed under "Actively Developed Files" over code that hasn't changed in a long time.
 
 CRITICAL: Your modified code MUST match the exact syntax, framework, and code style of the original code:
 - If the original code uses React JSX, use React JSX syntax (not Vue, not Flutter)
@@ -692,7 +832,7 @@ After analyzing the actual code, use the propose_experiment tool or return a JSO
 - category: "ui_optimization"
 - confidence: 0.8
 """,
-                    model="gpt-4o",
+                    route="proposal",
                     server_deployments=deployments,
                     max_steps=10
                 )
@@ -700,15 +840,17 @@ After analyzing the actual code, use the propose_experiment tool or return a JSO
                 raise Exception("MCP tool not available")
         except Exception as mcp_error:
             # Fallback: Generate proposal directly using GPT-4o with repository context
-            result = await metorial.run(
-                client=openai_client,
+            packed_context = pack_context(repo_context, PROPOSAL_FALLBACK_CONTEXT_TOKENS)
+            logger.info(f"Proposal context (fallback path): {packed_context.summary()}")
+            result = await llm.run(
+                "propose.fallback",
                 message=f"""
 CRITICAL: You MUST analyze and use ONLY the actual code provided below. Do NOT create generic examples or pseudo code.
 
 Repository: {repo_fullname}
 
 ACTUAL CODEBASE CONTEXT - YOU MUST USE ONLY THIS REAL CODE:
-{repo_context[:8000] if len(repo_context) > 8000 else repo_context}
+{packed_context.text}
 
 MANDATORY REQUIREMENTS:
 1. You MUST reference specific files, components, classes, functions, and code patterns that appear in the code above
@@ -716,7 +858,7 @@ MANDATORY REQUIREMENTS:
 3. Do NOT generate generic examples, pseudo code, or placeholder code - ONLY use real code from the context provided
 4. In technical_plan, use actual file paths that appear in the code above (not made-up paths)
 5. Reference actual component names, class names, function names from the code above
-6. In update_block, show the actual code snippet from the context with your changes - include real context lines
+6. In update_block, show the actual code snippet from the context with your changes - include real context lines (if technical_plan lists more than one file, start each file's part with a line "=== path/from/technical_plan ===")
 7. CRITICAL SYNTAX MATCH: Your modified code MUST match the exact syntax, framework, and code style of the original code:
    - If the original code uses React JSX, use React JSX syntax (not Vue, not Flutter)
    - If the original code uses Tailwind CSS classes, use Tailwind CSS (not plain CSS, not styled-components)
@@ -732,6 +874,7 @@ Instructions:
 3. Propose a fix using ONLY the actual code from the context (not generic examples)
 4. Focus on UI/styling code files (CSS, Tailwind classes, component styling, HTML structure, React/Flutter UI components)
 5. Ignore configuration files and backend/functional logic
+6. Prefer files listed under "Actively Developed Files" - they are where the team is working now
 
 Identify one specific visual/UI improvement in the ACTUAL CODE above:
                    
@@ -863,7 +1006,7 @@ CRITICAL REQUIREMENTS FOR update_block:
 - The update_block must contain real code snippets from the context, not made-up examples
 - MATCH THE FRAMEWORK: If the original code is React, your output must be React. If it's Flutter, your output must be Flutter. Match the exact syntax and style.
                 """,
-                model="gpt-4o",
+                route="proposal",
                 server_deployments=deployments if slack_deployment_id else [],
                 max_steps=8
             )
@@ -1152,11 +1295,19 @@ CRITICAL REQUIREMENTS FOR update_block:
             update_block = str(update_block)
         
         # Clean up update_block: Remove git diff headers if present
+        # (for a change spanning several files they become "=== path ===" section headers)
         if update_block:
             update_lines = update_block.split('\n')
+            diff_files = {
+                line.strip()[4:].strip().removeprefix('b/') for line in update_lines
+                if line.strip().startswith('+++ ') and line.strip() != '+++ /dev/null'
+            }
             cleaned_lines = []
             for line in update_lines:
                 trimmed = line.strip()
+                if len(diff_files) > 1 and trimmed.startswith('+++ ') and trimmed != '+++ /dev/null':
+                    cleaned_lines.append(f"=== {trimmed[4:].strip().removeprefix('b/')} ===")
+                    continue
                 # Skip git diff headers
                 if (trimmed.startswith('diff --git') or 
                     trimmed.startswith('index ') or 
@@ -1186,9 +1337,6 @@ CRITICAL REQUIREMENTS FOR update_block:
         actual_proposal_id = proposal.get("proposal_id", unique_proposal_id)
 
         # Send Slack notification if OAuth session ID is available
-        import logging
-        logger = logging.getLogger(__name__)
-        
         if not slack_deployment_id:
             logger.info("SLACK_DEPLOYMENT_ID not set, skipping Slack notification for new proposal")
         elif not req.oauth_session_id:
@@ -1247,11 +1395,12 @@ async def execute_experiment(req: ExecuteExperimentRequest):
                 status_code=400,
                 detail="Repository name is required for execution"
             )
-        if not req.file_path:
+        if not req.file_path and not req.file_paths:
             raise HTTPException(
                 status_code=400,
                 detail="File path is required for execution"
             )
+        file_paths = req.file_paths or [req.file_path]
         
         base_branch = req.base_branch or "main"
 
@@ -1289,13 +1438,14 @@ async def execute_experiment(req: ExecuteExperimentRequest):
             logger.info(f"Using direct PR creation for experiment {req.proposal_id}")
 
             try:
-                # Create PR directly
+                # Create PR directly: every planned file is merged concurrently into one commit
                 pr_creator = PRCreator()
-                pr_result = pr_creator.create_pr(
+                pr_result = await asyncio.to_thread(
+                    pr_creator.create_update_pr,
                     repo_fullname=req.repo_fullname,
                     instruction=req.instruction,
                     update_block=req.update_block,
-                    file_path=req.file_path,
+                    file_paths=file_paths,
                     base_branch=base_branch
                 )
 
@@ -1384,7 +1534,7 @@ async def execute_experiment(req: ExecuteExperimentRequest):
         logger = logging.getLogger(__name__)
         
         logger.info(f"Executing experiment {req.proposal_id}")
-        logger.info(f"Repository: {req.repo_fullname}, File: {req.file_path}, Branch: {base_branch}")
+        logger.info(f"Repository: {req.repo_fullname}, Files: {file_paths}, Branch: {base_branch}")
         logger.info(f"Deployments: {deployments}")
         logger.info(f"NORTHSTAR_MCP_DEPLOYMENT_ID: {northstar_mcp_deployment_id}")
         logger.info(f"Total deployments count: {len(deployments)}")
@@ -1396,8 +1546,9 @@ async def execute_experiment(req: ExecuteExperimentRequest):
             
             # Use explicit function/tool calling approach
             # Metorial should automatically discover tools from the deployment
-            result = await metorial.run(
-                client=openai_client,
+            result = await llm.run(
+                "execute.mcp",
+                side_effects=True,
                 message=f"""You have access to tools from the MCP server deployment {northstar_mcp_deployment_id}.
 
 Call the execute_code_change tool with these parameters:
@@ -1405,12 +1556,13 @@ Call the execute_code_change tool with these parameters:
   "instruction": {json_module.dumps(req.instruction)},
   "update_block": {escaped_update_block},
   "repo": {json_module.dumps(req.repo_fullname)},
-  "file_path": {json_module.dumps(req.file_path)},
+  "file_path": {json_module.dumps(file_paths[0])},
+  "file_paths": {json_module.dumps(file_paths)},
   "base_branch": {json_module.dumps(base_branch)}
 }}
 
 The tool will return JSON with a pr_url field. Extract and return only that JSON.""",
-                model="gpt-4o",
+                route="execute",
                 server_deployments=deployments,
                 max_steps=20,
                 temperature=0.1  # Lower temperature for more deterministic tool calling
@@ -1661,8 +1813,9 @@ async def send_slack_message(req: SlackMessageRequest):
             logger.warning("⚠️ Warning: No PR URL detected in message")
         
         # Try to post with explicit channel flexibility
-        result = await metorial.run(
-            client=openai_client,
+        result = await llm.run(
+            "slack.message",
+            side_effects=True,
             message=f"""Post this EXACT message to Slack. Copy and paste it EXACTLY as shown:
 
 MESSAGE TO POST:
@@ -1676,7 +1829,7 @@ INSTRUCTIONS:
 5. All URLs MUST be included exactly as shown - they are critical
 6. All line breaks MUST be preserved exactly
 7. Post the complete message with all 4 URL references included""",
-            model="gpt-4o",
+            route="notification",
             server_deployments=[{
                 "serverDeploymentId": slack_deployment_id,
                 "oauthSessionId": req.oauth_session_id
@@ -1864,10 +2017,10 @@ async def debug_mcp_deployment():
         
         logger.info(f"Testing MCP deployment: {northstar_mcp_deployment_id}")
         
-        result = await metorial.run(
-            client=openai_client,
+        result = await llm.run(
+            "debug.mcp_deployment",
             message="List all available tools from the deployment. What tools can you access?",
-            model="gpt-4o",
+            route="debug",
             server_deployments=deployments,
             max_steps=5
         )
@@ -1889,6 +2042,99 @@ async def debug_mcp_deployment():
         }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus scrape endpoint (text exposition format).
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/conversations")
+async def list_conversations():
+    """
+    Conversation memory: recently active Slack conversations and what is remembered for each.
+    """
+    return memory.stats()
+
+
+@app.get("/debug/slack-events")
+async def get_slack_event_dedup():
+    """
+    Slack event deduplication: deliveries claimed and duplicates (retries) acknowledged without work.
+    """
+    return slack_event_ids.stats()
+
+
+@app.get("/debug/mention-coalescing")
+async def get_mention_coalescing():
+    """
+    Slack mention coalescing: messages merged into one run, superseded runs and runs waiting for a channel slot.
+    """
+    return mention_coalescer.stats()
+
+
+@app.get("/debug/step-budgets")
+async def get_step_budgets():
+    """
+    Agent run SLOs and the step budgets learned per request type.
+    """
+    return step_budgets.stats()
+
+
+@app.get("/debug/morph")
+async def get_morph_status():
+    """
+    Morph Fast Apply client: circuit breaker state, retries and merges served from cache.
+    """
+    return get_morph_client().stats()
+
+
+@app.get("/debug/github")
+async def get_github_status():
+    """
+    Pooled GitHub clients, the rate-limit scheduler (budget left, requests admitted,
+    held or refused per priority) and the ETag response cache.
+    """
+    return github_stats()
+
+
+@app.get("/debug/replay")
+async def get_replay_status():
+    """
+    Record/replay cassette in use, if any (NORTHSTAR_REPLAY_MODE).
+    """
+    return replay_cassette.stats() if replay_cassette else {"mode": "off"}
+
+
+@app.get("/debug/traces")
+async def list_traces(limit: int = Query(50)):
+    """
+    Most recent traces (newest first).
+    """
+    return {"traces": tracing.collector.recent(limit)}
+
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """
+    Waterfall view of one trace: spans in call order with offsets and durations.
+    """
+    waterfall = tracing.build_waterfall(trace_id)
+    if waterfall is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found (it may have aged out)")
+    return waterfall
+
+
+@app.get("/debug/llm-stats")
+async def debug_llm_stats():
+    """
+    Token usage, cost, latency, retries and coalescing per LLM call site and model route,
+    plus the resolved routing table.
+    """
+    return llm.stats()
+
+
 @app.get("/repositories/active")
 async def get_active_repository(
     request: Request,
@@ -2071,6 +2317,7 @@ async def get_activity_logs(
 # Proposal approval endpoint
 
 @app.post("/proposals/{proposal_id}/approve")
+@tracing.start_trace("proposal.approve")
 async def approve_proposal(
     proposal_id: str,
     req: ApproveProposalRequest
@@ -2112,13 +2359,15 @@ async def approve_proposal(
                 detail="No active repository connected. Please connect a repository first."
             )
 
-        # Extract file path from technical_plan
-        file_path = None
+        # Extract the file paths from technical_plan (in plan order, without duplicates)
+        file_paths = []
         technical_plan = proposal.get("technical_plan", [])
-        if technical_plan and len(technical_plan) > 0:
-            file_path = technical_plan[0].get("file")
+        for step in technical_plan or []:
+            path = step.get("file") if isinstance(step, dict) else None
+            if path and path not in file_paths:
+                file_paths.append(path)
 
-        if not file_path:
+        if not file_paths:
             raise HTTPException(
                 status_code=400,
                 detail="No file path found in proposal's technical plan. Cannot execute experiment."
@@ -2134,7 +2383,8 @@ async def approve_proposal(
             update_block=req.update_block,
             oauth_session_id=oauth_session_id,
             repo_fullname=active_repo.get("repo_fullname"),
-            file_path=file_path,
+            file_path=file_paths[0],
+            file_paths=file_paths,
             base_branch=active_repo.get("base_branch") or active_repo.get("default_branch") or "main"
         )
 
@@ -2243,6 +2493,7 @@ async def reject_proposal(proposal_id: str):
 # Knowledge base endpoints
 
 @app.post("/northstar/initialize-repo")
+@tracing.start_trace("northstar.initialize_repo")
 async def initialize_repo(req: InitializeRepoRequest, background_tasks: BackgroundTasks):
     """
     Initialize a repository in the knowledge base.
@@ -2279,11 +2530,12 @@ async def initialize_repo(req: InitializeRepoRequest, background_tasks: Backgrou
         # 2. Read key files for analysis
         key_files_content = read_key_files(repo_path)
 
-        # 3. Analyze repository structure
-        repo_structure = analyze_repository_structure(repo_path)
-
-        # 4. Get indexable files
-        indexable_files = get_indexable_files(repo_path)
+        # 3-4. Analyze repository structure and collect indexable files in one walk
+        # (binary files are recognised from the buffers read below)
+        repo_scan = scan_repository(repo_path, sniff_binary=False)
+        repo_structure = repo_scan['structure']
+        indexable_files = repo_scan['indexable_files']
+        file_sizes = repo_scan['file_sizes']
 
         # 5. Read ALL indexable files for comprehensive analysis
         all_file_contents = {}
@@ -2291,18 +2543,29 @@ async def initialize_repo(req: InitializeRepoRequest, background_tasks: Backgrou
         # Start with key files
         all_file_contents.update(key_files_content)
 
-        # Read all source code and other indexable files
-        for file_path in indexable_files:
-            try:
-                relative_path = str(file_path.relative_to(repo_path))
+        # Read all source code and other indexable files once, concurrently.
+        # Only the buffers of the files uploaded to Captain below stay in memory.
+        max_file_chars = int(INIT_ANALYSIS_FILE_TOKENS * CHARS_PER_TOKEN * 2)
+        max_upload_files = 100  # Limit to 100 files for MVP
+
+        def read_indexable_files() -> Tuple[Dict[Path, Any], int]:
+            upload_buffers = {}
+            files_read = 0
+            for buffer in iter_files_bulk(indexable_files):
+                files_read += 1
+                relative_path = str(buffer.path.relative_to(repo_path))
                 # Skip if already read as a key file
                 if relative_path not in all_file_contents:
-                    content = file_path.read_text(encoding='utf-8', errors='ignore')
-                    # Limit individual file size to avoid overwhelming the context
-                    all_file_contents[relative_path] = content[:10000]  # First 10k chars per file
-            except Exception as e:
-                print(f"Failed to read {file_path}: {e}")
-                continue
+                    # Decode a little more than the per-file allocation; the budget
+                    # below trims it at a line boundary
+                    all_file_contents[relative_path] = buffer.text_prefix(max_file_chars)
+                if len(upload_buffers) < max_upload_files:
+                    upload_buffers[buffer.path] = buffer
+            return upload_buffers, files_read
+
+        # Binary files are not counted as indexable
+        upload_buffers, indexable_count = await asyncio.to_thread(read_indexable_files)
+        upload_files = list(upload_buffers)
 
         # 6. Build comprehensive context for AI analysis
         context = f"""
@@ -2316,28 +2579,35 @@ Directories: {len(repo_structure['directories'])}
 File Types:
 {chr(10).join(f"  {ext}: {count}" for ext, count in sorted(repo_structure['file_counts_by_type'].items(), key=lambda x: -x[1])[:10])}
 
-=== ALL FILE CONTENTS ({len(all_file_contents)} files) ===
 """
 
-        # Add ALL file contents to context
+        # Pack file contents into the token budget - key files first, then
+        # source files; files that don't fit are dropped whole
+        budget = ContextBudget(INIT_ANALYSIS_CONTEXT_TOKENS, separator="\n")
         for filename, content in sorted(all_file_contents.items()):
-            context += f"\n{'='*60}\n"
-            context += f"FILE: {filename} ({len(content)} chars)\n"
-            context += f"{'='*60}\n"
-            context += content
-            if len(content) >= 10000:
-                context += "\n\n... (truncated at 10,000 characters)"
-            context += "\n"
+            budget.add(
+                filename,
+                f"{'='*60}\nFILE: {filename}\n{'='*60}\n{content}\n",
+                priority=1 if filename in key_files_content else 0,
+                max_tokens=INIT_ANALYSIS_FILE_TOKENS
+            )
+        packed_files = budget.pack()
+        logger.info(f"Initialize-repo analysis context: {packed_files.summary()}")
+        files_in_context = len(packed_files.included)
+
+        context += f"\n=== FILE CONTENTS ({files_in_context} of {len(all_file_contents)} files) ===\n"
+        context += packed_files.text
 
         # 7. Have AI analyze ALL file contents
-        result = await metorial.run(
-            client=openai_client,
+        result = await llm.run(
+            "initialize.analysis",
+            side_effects=True,
             message=f"""
 Analyze this repository thoroughly based on ACTUAL file contents from ALL files:
 
 {context}
 
-You have access to the complete contents of ALL {len(all_file_contents)} files in this repository.
+You have access to the contents of {files_in_context} files in this repository.
 
 Provide a comprehensive analysis:
 1. Product Overview: What does this product actually do? (based on README and actual code)
@@ -2351,12 +2621,12 @@ Then post this analysis to Slack in a well-formatted message starting with:
 "📚 Knowledge Base Initialized: {req.repo}"
 
 IMPORTANT:
-- You have READ ALL {len(all_file_contents)} files - reference specific code, functions, and implementations
+- You have READ {files_in_context} files - reference specific code, functions, and implementations
 - Be specific and factual - cite actual file names, function names, and code snippets
 - DO NOT use phrases like "likely includes" or "probably uses"
 - Only state facts from the actual files you've read
             """,
-            model="gpt-4o",
+            route="initialize",
             server_deployments=[{
                 "serverDeploymentId": slack_deployment_id,
                 "oauthSessionId": req.oauth_session_id
@@ -2374,10 +2644,10 @@ IMPORTANT:
         # 9. Index files into Captain in background
         async def index_files_background():
             try:
-                for file_path in indexable_files[:100]:  # Limit to 100 files for MVP
+                for file_path in upload_files:
                     try:
-                        file_content = file_path.read_bytes()
-                        file_info = prepare_file_for_captain(file_path, repo_path)
+                        file_content = upload_buffers[file_path].data
+                        file_info = prepare_file_for_captain(file_path, repo_path, size=file_sizes.get(file_path))
 
                         captain.upload_file(
                             database_name=database_name,
@@ -2401,12 +2671,13 @@ IMPORTANT:
             "analysis": result.text,
             "stats": {
                 "total_files": repo_structure['total_files'],
-                "files_read_and_analyzed": len(all_file_contents),
-                "indexable_files": len(indexable_files),
+                "files_read_and_analyzed": files_in_context,
+                "context_tokens": packed_files.tokens_used,
+                "indexable_files": indexable_count,
                 "languages": repo_structure['languages_detected'],
-                "files_analyzed": list(all_file_contents.keys())
+                "files_analyzed": packed_files.included
             },
-            "message": f"Repository analyzed - read {len(all_file_contents)} files, indexing {len(indexable_files)} files in background"
+            "message": f"Repository analyzed - read {files_in_context} files, indexing {indexable_count} files in background"
         }
 
     except Exception as e:
@@ -2490,6 +2761,271 @@ async def knowledge_status(repo: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+AGENT_REQUEST_TYPES = {
+    "UNTRIAGED", "CASUAL_CHAT", "REPO_ANALYSIS", "ANALYTICS_QUERY", "CODE_CHANGE", "EXPERIMENT_PROPOSAL"
+}
+
+# Model route (see model_router.py) for the Stage 2 run of each request type
+AGENT_ROUTES = {
+    "CASUAL_CHAT": "casual_chat",
+    "REPO_ANALYSIS": "notification",  # Only posts the already-written Captain answer
+    "ANALYTICS_QUERY": "analytics",
+    "CODE_CHANGE": "code_change",
+    "EXPERIMENT_PROPOSAL": "proposal",
+}
+
+# Speculative prefetch jobs (started alongside triage) each request type uses;
+# the rest are cancelled once triage returns
+PREFETCH_JOBS_BY_TYPE = {
+    "REPO_ANALYSIS": ("profile",),
+    "CODE_CHANGE": ("mirror",),
+    "EXPERIMENT_PROPOSAL": ("mirror",),
+}
+
+# Progress line shown in the streaming Slack reply while each request type runs
+REPLY_STATUS = {
+    "REPO_ANALYSIS": "Reading through the repository",
+    "ANALYTICS_QUERY": "Pulling the numbers",
+    "CODE_CHANGE": "Working on the change",
+    "EXPERIMENT_PROPOSAL": "Looking for an experiment worth running",
+}
+
+# Follow-ups that need no triage: "make it happen" right after a proposal
+IMPLEMENT_FOLLOW_UP = re.compile(
+    r"\b(make it happen|ship it|do it|go ahead|implement (it|that|this)|build it|let'?s do it)\b", re.IGNORECASE
+)
+
+
+async def summarize_turns(previous_summary: str, turns: List[Dict[str, Any]]) -> str:
+    """Fold older conversation turns into a short running summary (ConversationMemory summarizer)."""
+    transcript = "\n".join(f"{turn['role']}: {turn['text']}" for turn in turns)
+    response = await llm.chat(
+        "memory.summarize",
+        route="summarize",
+        messages=[{
+            "role": "user",
+            "content": f"""Summarize this Slack conversation between a user and Northstar, an engineering agent, in at most 5 short lines.
+Keep proposal IDs, file paths, PR links and decisions. Drop small talk.
+
+Previous summary:
+{previous_summary or "(none)"}
+
+New messages:
+{transcript}"""
+        }],
+        max_tokens=250
+    )
+    return response.choices[0].message.content.strip()
+
+
+memory = ConversationMemory(summarizer=summarize_turns)
+step_budgets = StepBudgets()
+slack_event_ids = create_event_store()
+
+
+def follow_up_request_type(conversation: Conversation, user_message: str) -> Optional[str]:
+    """Request type implied by the conversation so far, skipping triage (None if triage is needed)."""
+    if (conversation.last_request_type == "EXPERIMENT_PROPOSAL" and conversation.last_proposal_id
+            and IMPLEMENT_FOLLOW_UP.search(user_message)):
+        return "CODE_CHANGE"
+    return None
+
+
+def proposal_context(conversation: Conversation) -> Optional[str]:
+    """Details of the conversation's last proposal for a follow-up prompt (cached per conversation)."""
+    proposal_id = conversation.last_proposal_id
+    cached = conversation.tool_result(f"proposal:{proposal_id}")
+    if cached is not None:
+        return cached or None
+    proposal = db_operations.get_proposal(proposal_id)
+    details = ""
+    if proposal:
+        plan = "\n".join(f"- {step.get('file')}: {step.get('action')}" for step in proposal.get("technical_plan") or [])
+        details = f"""Proposal {proposal_id} to implement: {proposal.get('idea_summary')}
+Rationale: {proposal.get('rationale')}
+Technical plan:
+{plan}"""
+        if proposal.get("update_block"):
+            details += f"\nUpdate block:\n{proposal['update_block']}"
+    conversation.remember_tool_result(f"proposal:{proposal_id}", details)
+    return details or None
+
+
+def partial_answer(request_type: str, slo_seconds: float, steps_taken: List[List[str]]) -> str:
+    """Slack reply for a run stopped at its deadline: how far it got and which tools it used."""
+    tools = []
+    for step_tools in steps_taken:
+        tools.extend(tool for tool in step_tools if tool not in tools)
+    progress = f"after {len(steps_taken)} step(s)" if steps_taken else "before the first step finished"
+    if tools:
+        progress += f" ({', '.join(tools[:5])})"
+    return (f"This is taking longer than it should, so I stopped {progress} to stay within "
+            f"{slo_seconds:.0f}s. Anything already posted or opened stays as is - try a narrower request.")
+
+
+async def post_to_slack(channel: str, text: str, reply: Optional[StreamingReply] = None) -> None:
+    """
+    Show text in the streaming placeholder, or post it with the Slack deployment
+    if there is none (or only the parts the placeholder could not show).
+    """
+    if reply:
+        shown = await reply.finish(text)
+        if shown == SHOWN:
+            return
+        if shown == PARTIAL:
+            text = "\n".join(reply.unsent)
+    await llm.run(
+        "agent.notify",
+        side_effects=True,
+        message=f'Post this message to Slack channel {channel}: "{text}"',
+        route="notification",
+        server_deployments=[{
+            "serverDeploymentId": slack_deployment_id,
+            "oauthSessionId": slack_oauth_session_id
+        }],
+        max_steps=2
+    )
+
+
+def _triage_label(response) -> str:
+    """Normalized request type from a triage completion ("casual_chat." -> "CASUAL_CHAT")."""
+    return response.choices[0].message.content.strip().strip('".\'`* ').upper()
+
+
+@time_stage("repo_profile")
+def build_repo_profile(repo_fullname: str, branch: str = "main") -> str:
+    """
+    Pack the files that describe a repository (README, dependency manifests,
+    directory structure, entry point) for REPO_ANALYSIS.
+
+    Read from the local blobless mirror (repo_mirror.py), shared with the churn
+    index: the tree comes from the mirror's history and only the few files read
+    are fetched, so there is no clone per request.
+
+    Blocking - run it in a thread. Usually started speculatively alongside triage.
+
+    Args:
+        repo_fullname: Repository in "owner/name" format
+        branch: Branch to describe
+
+    Returns:
+        Packed context text for the analysis prompt
+    """
+    files = list_files(repo_fullname, branch)
+    file_set = set(files)
+
+    def read(path: str, label: str) -> Optional[str]:
+        try:
+            content = read_file(repo_fullname, path, branch)
+        except Exception as e:
+            logger.warning(f"Failed to read {label}: {tracing.redact_secrets(str(e))}")
+            return None
+        if content is not None:
+            logger.info(f"Read {label} ({len(content)} chars)")
+        return content
+
+    # Identify important files to read, packed into a token budget
+    # (README first, entry point last)
+    important_files = ContextBudget(REPO_ANALYSIS_CONTEXT_TOKENS)
+
+    # 1. Always read README
+    readme_files = sorted(path for path in files if "/" not in path and path.startswith("README"))
+    for readme in readme_files[:1]:  # Take first README
+        content = read(readme, readme)
+        if content is not None:
+            important_files.add(readme, f"=== {readme} ===\n{content}", priority=4, max_tokens=850)
+
+    # 2. Read package.json or requirements.txt to understand dependencies
+    for manifest in ("package.json", "requirements.txt"):
+        if manifest in file_set:
+            content = read(manifest, manifest)
+            if content is not None:
+                important_files.add(manifest, f"=== {manifest} ===\n{content}", priority=2)
+
+    # 3. Get directory structure
+    structure_lines = []
+    listed_dirs = set()
+    for path in sorted(files):
+        if ".git" in path or "node_modules" in path or "__pycache__" in path:
+            continue
+        parts = path.split("/")
+        for depth, name in enumerate(parts[:-1][:3]):  # Only show up to 3 levels deep
+            directory = "/".join(parts[:depth + 1])
+            if directory not in listed_dirs:
+                listed_dirs.add(directory)
+                structure_lines.append(f"{'  ' * depth}{name}/")
+        structure_lines.append(f"{'  ' * (len(parts) - 1)}{parts[-1]}")
+        if len(structure_lines) >= 100:  # Limit structure size
+            break
+
+    structure = "\n".join(structure_lines[:100])
+    important_files.add("structure", f"=== Repository Structure ===\n{structure}", priority=3)
+    logger.info(f"Generated directory structure")
+
+    # 4. Read main entry point files
+    entry_points = [
+        "index.js", "index.ts", "main.py", "app.py", "main.jsx", "App.jsx",
+        "index.html", "main.go", "index.php"
+    ]
+    has_src = any(path.startswith("src/") for path in files)
+    for entry in entry_points:
+        entry_path = f"src/{entry}" if has_src else entry
+        if entry_path in file_set:
+            content = read(entry_path, entry)
+            if content is not None:
+                important_files.add(entry, f"=== {entry} ===\n{content}", priority=1, max_tokens=570)
+                break  # Only read first found entry point
+
+    # Combine all context
+    packed_context = important_files.pack()
+    logger.info(f"Built context from {len(packed_context.included)} files: {packed_context.summary()}")
+    return packed_context.text
+
+
+@time_stage("triage")
+async def triage_request(user_message: str, repo_fullname: str, history: str = "") -> str:
+    """
+    Classify a user request so the agent only loads the deployments it needs.
+
+    Uses OpenAI directly (faster, no deployments needed).
+
+    Args:
+        user_message: The user's request/message
+        repo_fullname: Active repository (for context)
+        history: Earlier conversation, so short follow-ups classify correctly
+
+    Returns:
+        Request type in caps, e.g. "CASUAL_CHAT", "REPO_ANALYSIS", "CODE_CHANGE"
+    """
+    history_block = f"\n\n{history}" if history else ""
+    response = await llm.chat(
+        "agent.triage",
+        route="triage",
+        messages=[{
+            "role": "user",
+            "content": f"""Analyze this user request and determine what tools/actions are needed.
+
+User request: "{user_message}"
+Active repository: {repo_fullname}{history_block}
+
+Classify the request as ONE of these types and respond with ONLY the type name:
+
+1. "CASUAL_CHAT" - Greetings, small talk, "hey", "what's up", "how are you", general questions not about code
+2. "REPO_ANALYSIS" - Questions about the repo: "what does this repo do", "tell me about the code", "how does X work"
+3. "ANALYTICS_QUERY" - Questions about analytics, metrics, DAUs, MAUs, events, retention, user behavior: "how are our DAUs", "show me user retention", "what's our conversion rate", "how many signups", "most popular features"
+4. "CODE_CHANGE" - Requests to modify code: "make a pr", "change X to Y", "add feature Z", "update the button color"
+5. "EXPERIMENT_PROPOSAL" - "propose an experiment", "suggest improvements"
+
+Respond with ONLY ONE WORD - the type name in ALL CAPS."""
+        }],
+        max_tokens=10,
+        # An answer that isn't one of the types counts as low confidence
+        accept=lambda r: _triage_label(r) in AGENT_REQUEST_TYPES
+    )
+    return _triage_label(response)
+
+
+@tracing.traced("agent.run")
 async def run_autonomous_agent(
     user_message: str,
     channel: str,
@@ -2518,7 +3054,23 @@ async def run_autonomous_agent(
     import logging
     logger = logging.getLogger(__name__)
 
+    agent_start = time.perf_counter()
+    request_type = "UNTRIAGED"
+    outcome = "error"
+    prefetch = SpeculativePrefetch()
+    # Slack thread (or channel) state shared with earlier and later messages
+    conversation = memory.get_or_create(conversation_key(channel, (context or {}).get("thread_ts")))
+    answer = None
+    # Placeholder edited in place as the answer develops (None unless SLACK_BOT_TOKEN is set)
+    reply = StreamingReply.create(channel)
+    # Every outbound call of this request is bounded by its deadline; the SLO is set once triaged
+    deadline_stack = contextlib.ExitStack()
+    deadline = deadline_stack.enter_context(deadline_scope(DEFAULT_SLO))
+
     try:
+        if reply:
+            reply.start("_Thinking..._")
+
         # Get active repository context
         active_repo = db_operations.get_active_repository()
         repo_fullname = active_repo.get("repo_fullname") if active_repo else "No repository connected"
@@ -2531,30 +3083,22 @@ async def run_autonomous_agent(
         # STAGE 1: Quick triage - determine what tools are needed
         logger.info("🧠 Stage 1: Analyzing request to determine required tools...")
 
-        # Use OpenAI directly for triage (faster, no deployments needed)
-        triage_response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": f"""Analyze this user request and determine what tools/actions are needed.
-
-User request: "{user_message}"
-Active repository: {repo_fullname}
-
-Classify the request as ONE of these types and respond with ONLY the type name:
-
-1. "CASUAL_CHAT" - Greetings, small talk, "hey", "what's up", "how are you", general questions not about code
-2. "REPO_ANALYSIS" - Questions about the repo: "what does this repo do", "tell me about the code", "how does X work"
-3. "ANALYTICS_QUERY" - Questions about analytics, metrics, DAUs, MAUs, events, retention, user behavior: "how are our DAUs", "show me user retention", "what's our conversion rate", "how many signups", "most popular features"
-4. "CODE_CHANGE" - Requests to modify code: "make a pr", "change X to Y", "add feature Z", "update the button color"
-5. "EXPERIMENT_PROPOSAL" - "propose an experiment", "suggest improvements"
-
-Respond with ONLY ONE WORD - the type name in ALL CAPS."""
-            }],
-            max_tokens=10
-        )
+        # Repository work for code-related messages starts now instead of after triage
+        if active_repo and mentions_code(user_message):
+            prefetch.start("mirror", get_churn_index, repo_fullname, base_branch)
+            if f"profile:{repo_fullname}" not in conversation.context:
+                prefetch.start("profile", build_repo_profile, repo_fullname, base_branch)
 
-        request_type = triage_response.choices[0].message.content.strip().upper()
+        request_type = follow_up_request_type(conversation, user_message)
+        if request_type:
+            logger.info(f"Follow-up to proposal {conversation.last_proposal_id}, skipping triage")
+        else:
+            request_type = await triage_request(user_message, repo_fullname, conversation.prompt_context(max_chars=1200))
+        prefetch.discard(keep=PREFETCH_JOBS_BY_TYPE.get(request_type, ()))
+        deadline.extend_to(slo_for(request_type))
+        tracing.set_attribute("request_type", request_type)
+        if reply and request_type in REPLY_STATUS:
+            reply.status(REPLY_STATUS[request_type])
         logger.info(f"📊 Request classified as: {request_type}")
 
         # STAGE 2: Execute with appropriate deployments
@@ -2600,103 +3144,27 @@ Use the Slack chat.postMessage tool to post your reply to channel {channel}."""
             logger.info(f"User query: {query}")
             logger.info(f"📥 Analyzing repo: {repo_fullname}")
 
-            # Clone repo and read important files directly
-            import tempfile
-            import shutil
-            from pathlib import Path
-            repo_path = None
             response_text = ""
 
             try:
-                # Clone repository to temp directory
-                temp_dir = tempfile.mkdtemp(prefix=f"northstar_analysis_")
-                repo_path = Path(temp_dir)
-                clone_repository(f"https://github.com/{repo_fullname}.git", repo_path)
-                logger.info(f"Cloned repo to {repo_path}")
-
-                # Identify important files to read
-                important_files = []
-
-                # 1. Always read README
-                readme_files = list(repo_path.glob("README*"))
-                for readme in readme_files[:1]:  # Take first README
-                    try:
-                        content = readme.read_text(encoding='utf-8', errors='ignore')
-                        important_files.append(f"=== {readme.name} ===\n{content[:3000]}")
-                        logger.info(f"Read {readme.name} ({len(content)} chars)")
-                    except Exception as e:
-                        logger.warning(f"Failed to read {readme.name}: {e}")
-
-                # 2. Read package.json or requirements.txt to understand dependencies
-                package_json = repo_path / "package.json"
-                if package_json.exists():
-                    try:
-                        content = package_json.read_text(encoding='utf-8', errors='ignore')
-                        important_files.append(f"=== package.json ===\n{content}")
-                        logger.info(f"Read package.json")
-                    except Exception as e:
-                        logger.warning(f"Failed to read package.json: {e}")
-
-                requirements = repo_path / "requirements.txt"
-                if requirements.exists():
-                    try:
-                        content = requirements.read_text(encoding='utf-8', errors='ignore')
-                        important_files.append(f"=== requirements.txt ===\n{content}")
-                        logger.info(f"Read requirements.txt")
-                    except Exception as e:
-                        logger.warning(f"Failed to read requirements.txt: {e}")
-
-                # 3. Get directory structure
-                structure_lines = []
-                for item in sorted(repo_path.rglob("*")):
-                    if ".git" in str(item) or "node_modules" in str(item) or "__pycache__" in str(item):
-                        continue
-                    rel_path = item.relative_to(repo_path)
-                    depth = len(rel_path.parts) - 1
-                    indent = "  " * depth
-                    if item.is_file():
-                        structure_lines.append(f"{indent}{item.name}")
-                    elif item.is_dir() and depth < 3:  # Only show up to 3 levels deep
-                        structure_lines.append(f"{indent}{item.name}/")
-                    if len(structure_lines) >= 100:  # Limit structure size
-                        break
-
-                structure = "\n".join(structure_lines[:100])
-                important_files.append(f"=== Repository Structure ===\n{structure}")
-                logger.info(f"Generated directory structure")
-
-                # 4. Read main entry point files
-                entry_points = [
-                    "index.js", "index.ts", "main.py", "app.py", "main.jsx", "App.jsx",
-                    "index.html", "main.go", "index.php"
-                ]
-                for entry in entry_points:
-                    entry_file = repo_path / "src" / entry if (repo_path / "src").exists() else repo_path / entry
-                    if entry_file.exists():
-                        try:
-                            content = entry_file.read_text(encoding='utf-8', errors='ignore')
-                            important_files.append(f"=== {entry} ===\n{content[:2000]}")
-                            logger.info(f"Read {entry}")
-                            break  # Only read first found entry point
-                        except Exception as e:
-                            logger.warning(f"Failed to read {entry}: {e}")
-
-                # Combine all context
-                full_context = "\n\n".join(important_files)
-                logger.info(f"Built context from {len(important_files)} files ({len(full_context)} total chars)")
+                # Reuse this conversation's profile, else the one built alongside triage, else build it now
+                full_context = conversation.context.get(f"profile:{repo_fullname}") or await prefetch.result("profile")
+                if full_context is None:
+                    full_context = await asyncio.to_thread(build_repo_profile, repo_fullname, base_branch)
+                conversation.context[f"profile:{repo_fullname}"] = full_context
 
                 # Query OpenAI with Captain's infinite context API
-                from openai import OpenAI
-
-                captain_client = OpenAI(
-                    base_url="https://api.runcaptain.com/v1",
+                captain_client = AsyncOpenAI(
+                    base_url=f"{CAPTAIN_BASE_URL}/v1",
                     api_key=os.getenv("CAPTAIN_API_KEY"),
                     default_headers={
                         "X-Organization-ID": os.getenv("CAPTAIN_ORGANIZATION_ID")
                     }
                 )
 
-                gpt_response = captain_client.chat.completions.create(
+                gpt_response = await llm.chat(
+                    "agent.repo_analysis",
+                    client=captain_client,
                     model="captain-voyager-latest",
                     messages=[
                         {
@@ -2725,12 +3193,6 @@ Use the Slack chat.postMessage tool to post your reply to channel {channel}."""
                 logger.error(traceback.format_exc())
                 response_text = f"I encountered an error while analyzing {repo_fullname}: {str(e)}"
 
-            finally:
-                # Cleanup cloned repo
-                if repo_path and os.path.exists(str(repo_path)):
-                    shutil.rmtree(str(repo_path))
-                    logger.info(f"Cleaned up {repo_path}")
-
             # Now use Slack deployment to post the response
             deployments = [
                 {"serverDeploymentId": slack_deployment_id, "oauthSessionId": slack_oauth_session_id}
@@ -2888,19 +3350,146 @@ Use Slack markdown formatting:
 - Keep it clean and scannable"""
             max_steps = 20
 
-        logger.info(f"🚀 Stage 2: Executing with {len(deployments)} deployment(s), max_steps={max_steps}")
-
-        # Execute the actual task
-        result = await metorial.run(
-            client=openai_client,
-            message=prompt,
-            model="gpt-4o",
-            server_deployments=deployments,
-            max_steps=max_steps
-        )
+        # Follow-ups build on what was said and done earlier in the conversation
+        follow_up_context = ""
+        if request_type != "REPO_ANALYSIS":
+            sections = [conversation.prompt_context()]
+            if request_type == "CODE_CHANGE" and conversation.last_proposal_id:
+                sections.append(proposal_context(conversation))
+            follow_up_context = "\n\n".join(section for section in sections if section)
+            if follow_up_context:
+                prompt += "\n\n" + follow_up_context
+
+        # Point code-related runs at actively developed files so they spend fewer GitHub tool steps searching
+        if prefetch.started("mirror"):
+            churn = await prefetch.result("mirror")
+            active_files = churn.top_files(limit=10) if churn else []
+            if active_files:
+                prompt += "\n\nActively developed files in this repository (start here when looking for relevant code):\n"
+                prompt += "\n".join(f"- {f['path']}" for f in active_files)
+
+        # From here on the run posts, commits or opens PRs, so a newer message no longer supersedes it
+        mark_committed()
+
+        # Simple code changes: locate, edit and open the PR directly instead of
+        # letting the agent browse GitHub step by step
+        if request_type == "CODE_CHANGE" and active_repo and code_change_fastpath.ENABLED:
+            fast_result = None
+            try:
+                with time_stage("code_change_fast_path"):
+                    # Bounded as a whole: the git fetch, Morph and PyGithub calls inside
+                    # run on worker threads that can't all be given a timeout
+                    fast_result = await asyncio.wait_for(
+                        code_change_fastpath.run_fast_path(
+                            llm,
+                            user_message,
+                            repo_fullname,
+                            base_branch=base_branch,
+                            extra_context=follow_up_context,
+                            on_status=reply.status if reply else None
+                        ),
+                        timeout=max(deadline.remaining() - POST_RESERVE_SECONDS, 1.0)
+                    )
+            except asyncio.TimeoutError:
+                outcome = "deadline_exceeded"
+                answer = partial_answer(request_type, deadline.seconds, [["code_change_fast_path"]])
+                logger.warning(f"⏱️ {request_type} fast path stopped at its {deadline.seconds:.0f}s deadline")
+                with deadline_scope(None):
+                    await post_to_slack(channel, answer, reply)
+                return answer
+            except Exception as e:
+                logger.warning(f"Code change fast path not used, falling back to the agent loop: {tracing.redact_secrets(str(e))}")
+                if reply:
+                    reply.status(REPLY_STATUS[request_type])
+
+            if fast_result:
+                pr_message = f"*PR opened:* {fast_result['summary']}\n{fast_result['pr_url']}\n_Changed {fast_result['file_path']}_"
+                logger.info(f"⚡ Code change fast path opened PR #{fast_result['pr_number']} ({fast_result['file_path']})")
+                with deadline_scope(None):  # the PR exists; always tell the user
+                    await post_to_slack(channel, pr_message, reply)
+                conversation.remember_tool_result("agent.code_change", json.dumps(fast_result, default=str))
+                answer = pr_message
+                outcome = "success"
+                return pr_message
+
+        # Replies that need no tools go straight into the streaming placeholder,
+        # skipping the Metorial run that would only post them
+        if reply and request_type == "REPO_ANALYSIS":
+            shown = await reply.finish(response_text)
+            if shown != NOT_SHOWN:
+                if shown == PARTIAL:
+                    await post_to_slack(channel, "\n".join(reply.unsent))
+                outcome = "success"
+                answer = response_text
+                return response_text
+        elif reply and request_type == "CASUAL_CHAT":
+            with time_stage("agent_execute"):
+                response = await llm.chat(
+                    "agent.casual_chat",
+                    route=AGENT_ROUTES[request_type],
+                    messages=[
+                        {"role": "system", "content": "Reply with only the message text. It is posted to Slack for you."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    on_delta=reply.update
+                )
+            reply_text = response.choices[0].message.content.strip()
+            shown = await reply.finish(reply_text)
+            if shown != NOT_SHOWN:
+                if shown == PARTIAL:
+                    await post_to_slack(channel, "\n".join(reply.unsent))
+                outcome = "success"
+                answer = reply_text
+                return reply_text
+
+        # Size the step budget from past runs of this type and the time left
+        max_steps = step_budgets.budget(request_type, max_steps, deadline.remaining())
+        logger.info(f"🚀 Stage 2: Executing with {len(deployments)} deployment(s), max_steps={max_steps}, "
+                    f"{deadline.remaining():.0f}s left of {deadline.seconds:.0f}s")
+
+        steps_taken = []
+
+        def on_step(number: int, tools: List[str]) -> None:
+            steps_taken.append(tools)
+            if reply:
+                reply.step(number, tools)
+
+        # Execute the actual task, stopping early enough to post a partial answer
+        run_start = time.perf_counter()
+        try:
+            with time_stage("agent_execute"):
+                result = await llm.run(
+                    "agent.run",
+                    side_effects=True,
+                    message=prompt,
+                    route=AGENT_ROUTES.get(request_type, "proposal"),
+                    server_deployments=deployments,
+                    max_steps=max_steps,
+                    timeout=max(deadline.remaining() - POST_RESERVE_SECONDS, 1.0),
+                    on_step=on_step
+                )
+        except LLMDeadlineExceeded:
+            step_budgets.observe(request_type, len(steps_taken), time.perf_counter() - run_start,
+                                 success=False, cut_short=True)
+            outcome = "deadline_exceeded"
+            answer = partial_answer(request_type, deadline.seconds, steps_taken)
+            logger.warning(f"⏱️ {request_type} run stopped at its {deadline.seconds:.0f}s deadline after {len(steps_taken)} step(s)")
+            with deadline_scope(None):
+                await post_to_slack(channel, answer, reply)
+            return answer
+        except Exception:
+            step_budgets.observe(request_type, len(steps_taken), time.perf_counter() - run_start, success=False)
+            raise
+        step_budgets.observe(request_type, len(steps_taken), time.perf_counter() - run_start, success=True)
 
         logger.info(f"✅ Agent execution complete. Result: {result.text[:500]}...")
+        if reply:
+            await reply.finish(f"Done in {time.perf_counter() - agent_start:.0f}s.")
 
+        conversation.remember_tool_result(f"agent.{request_type.lower()}", result.text)
+        # For repo analysis the run only posted the Captain answer
+        answer = response_text if request_type == "REPO_ANALYSIS" else result.text
+        outcome = "success"
         return result.text
 
     except Exception as e:
@@ -2908,13 +3497,17 @@ Use Slack markdown formatting:
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
 
-        # Try to post error to Slack
+        # Try to post error to Slack (even when the request's deadline has passed)
+        deadline_stack.close()
         try:
-            if slack_deployment_id and slack_oauth_session_id:
-                error_result = await metorial.run(
-                    client=openai_client,
+            if reply and await reply.finish(f"Sorry, I encountered an error: {str(e)[:200]}") != NOT_SHOWN:
+                pass
+            elif slack_deployment_id and slack_oauth_session_id:
+                error_result = await llm.run(
+                    "agent.error_post",
+                    side_effects=True,
                     message=f'Post this message to Slack channel {channel}: "Sorry, I encountered an error: {str(e)[:200]}"',
-                    model="gpt-4o",
+                    route="notification",
                     server_deployments=[{
                         "serverDeploymentId": slack_deployment_id,
                         "oauthSessionId": slack_oauth_session_id
@@ -2926,6 +3519,31 @@ Use Slack markdown formatting:
 
         return f"Error: {str(e)}"
 
+    except asyncio.CancelledError:
+        # Superseded by a newer message (see mention_coalescer); that run repeats this message
+        outcome = "superseded"
+        if reply:
+            await reply.finish("_Picking this up together with your next message._")
+        raise
+
+    finally:
+        deadline_stack.close()
+        prefetch.discard()
+        try:
+            if outcome != "superseded":
+                await memory.record_exchange(conversation, user_message, answer, request_type)
+        except Exception as memory_error:
+            logger.warning(f"Could not update conversation memory: {memory_error}")
+        # Unexpected triage answers are bucketed to keep label cardinality bounded
+        if request_type not in AGENT_REQUEST_TYPES:
+            request_type = "OTHER"
+        AGENT_REQUEST_DURATION.observe(time.perf_counter() - agent_start, request_type=request_type, outcome=outcome)
+        AGENT_REQUESTS.inc(request_type=request_type, outcome=outcome)
+
+
+# Slack mentions are debounced and coalesced per conversation before they reach the agent
+mention_coalescer = MentionCoalescer(run_autonomous_agent)
+
 
 @app.post("/test-agent")
 async def test_agent():
@@ -2952,10 +3570,11 @@ async def test_slack_post(channel: str = "C09QL9V1J1F"):
     logger.info(f"Testing Slack post to channel {channel}")
 
     try:
-        result = await metorial.run(
-            client=openai_client,
+        result = await llm.run(
+            "test.slack_post",
+            side_effects=True,
             message=f'Use the Slack post_message tool to post "Test message from Northstar backend" to channel {channel}',
-            model="gpt-4o",
+            route="notification",
             server_deployments=[{
                 "serverDeploymentId": slack_deployment_id,
                 "oauthSessionId": slack_oauth_session_id
@@ -2973,6 +3592,7 @@ async def test_slack_post(channel: str = "C09QL9V1J1F"):
 
 
 @app.post("/slack/events")
+@tracing.start_trace("slack.event")
 async def slack_events(request: Request):
     """
     Slack Events API webhook.
@@ -2999,6 +3619,7 @@ async def slack_events(request: Request):
         # Handle app_mention or message events
         event = body.get("event", {})
         event_type = event.get("type")
+        tracing.set_attribute("event_type", event_type)
         logger.info(f"Event type: {event_type}")
 
         # Ignore bot messages to prevent loops
@@ -3024,19 +3645,29 @@ async def slack_events(request: Request):
         user_message = event.get("text", "")
         user_id = event.get("user")
 
+        tracing.set_attribute("channel", channel)
+        tracing.set_attribute("user", user_id)
         logger.info(f"✅ Northstar mentioned by user {user_id} in channel {channel}: {user_message}")
+
+        # Slack retries deliveries it didn't see acknowledged in 3s, and a mention can
+        # arrive as both app_mention and message: only the first one starts an agent
+        retry_num = request.headers.get("X-Slack-Retry-Num")
+        if retry_num:
+            tracing.set_attribute("slack_retry", retry_num)
+        if not await asyncio.to_thread(slack_event_ids.claim, event_keys(body)):
+            tracing.set_attribute("duplicate", True)
+            logger.info(f"Duplicate delivery of event {body.get('event_id')} "
+                        f"(retry {retry_num or 0}, reason {request.headers.get('X-Slack-Retry-Reason')}), ignoring")
+            return {"ok": True}
+
         logger.info(f"🚀 Starting autonomous agent in background...")
 
         # Run the autonomous agent (non-blocking)
-        # Note: We return immediately to Slack, agent runs in background
-        import asyncio
-        asyncio.create_task(run_autonomous_agent(
-            user_message=user_message,
-            channel=channel,
-            user_id=user_id
-        ))
+        # Note: We return immediately to Slack, agent runs in background once the
+        # coalescing window closes (rapid follow-ups are merged into the same run)
+        mention_coalescer.submit(channel, user_id, user_message, event.get("thread_ts"))
 
-        logger.info("✓ Agent task created, returning OK to Slack")
+        logger.info(f"✓ Agent run queued (trace {tracing.current_trace_id()}), returning OK to Slack")
         return {"ok": True}
 
     except Exception as e:
@@ -3047,6 +3678,7 @@ async def slack_events(request: Request):
 
 
 @app.post("/slack/commands")
+@tracing.start_trace("slack.command")
 async def slack_commands(request: Request):
     """
     Slack slash commands webhook.
@@ -3069,6 +3701,9 @@ async def slack_commands(request: Request):
         user_id = form_data.get("user_id")
         channel_id = form_data.get("channel_id")
 
+        tracing.set_attribute("command", command)
+        tracing.set_attribute("channel", channel_id)
+        tracing.set_attribute("user", user_id)
         logger.info(f"Slash command {command} from user {user_id}: {text}")
 
         # Respond immediately (Slack requires response within 3 seconds)
@@ -0,0 +1,358 @@
+"""Warm pool of Metorial MCP sessions.
+
+Setting up a Metorial run for a deployment set costs a session-create API
+call, an MCP handshake per server and a capabilities listing before the model
+sees its first token. Metorial caches sessions by deployment set, but only
+after the first request has paid for them. It also never notices a dead
+connection and never drops anything.
+
+MCPSessionPool owns that cache:
+- warm(): establish sessions for known deployment sets ahead of requests
+  (at startup: Slack-only, PostHog+Slack, GitHub+Northstar+Slack)
+- lease(): used by LLMGateway.run around every metorial.run, so a run finds its
+  session in Metorial's cache already connected, with tools listed
+- health checks: sessions idle past the check interval are probed (open MCP
+  clients answer list_tools) and re-established when they fail
+- idle expiry and a maximum size (least recently used idle sessions go first)
+
+Configuration:
+    NORTHSTAR_MCP_POOL_SIZE            - max pooled sessions (default 8)
+    NORTHSTAR_MCP_POOL_IDLE_SECONDS    - close sessions unused this long (default 900)
+    NORTHSTAR_MCP_POOL_HEALTH_SECONDS  - probe idle sessions this often (default 120)
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from metrics import MCP_SESSION_EVENTS, time_dependency
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_SIZE = int(os.getenv("NORTHSTAR_MCP_POOL_SIZE", "8"))
+DEFAULT_IDLE_TTL = float(os.getenv("NORTHSTAR_MCP_POOL_IDLE_SECONDS", "900"))
+DEFAULT_HEALTH_INTERVAL = float(os.getenv("NORTHSTAR_MCP_POOL_HEALTH_SECONDS", "120"))
+
+SETUP_TIMEOUT = 30.0
+PROBE_TIMEOUT = 10.0
+
+
+def _normalize(deployments: List[Any]) -> Optional[List[Dict[str, str]]]:
+    """
+    Deployments in the form metorial.run hands to create_mcp_session.
+
+    Returns None if any deployment has no ID (e.g. an unset env var); such runs
+    are left to Metorial so its own error surfaces.
+    """
+    normalized = []
+    for dep in deployments or []:
+        if isinstance(dep, dict):
+            dep_id = dep.get("serverDeploymentId") or dep.get("id")
+            oauth_id = dep.get("oauthSessionId")
+        else:
+            dep_id, oauth_id = dep, None
+        if not dep_id:
+            return None
+        entry = {"id": dep_id}
+        if oauth_id:
+            entry["oauthSessionId"] = oauth_id
+        normalized.append(entry)
+    return normalized or None
+
+
+def session_key(deployments: List[Any]) -> Optional[str]:
+    """
+    Cache key of a deployment set - the same key Metorial's create_mcp_session uses.
+
+    Args:
+        deployments: Deployment IDs or dicts as passed to metorial.run
+
+    Returns:
+        Key string, or None if the set can't be pooled
+    """
+    normalized = _normalize(deployments)
+    if normalized is None:
+        return None
+    deployment_ids = sorted(dep["id"] for dep in normalized)
+    oauth_ids = sorted(dep["oauthSessionId"] for dep in normalized if "oauthSessionId" in dep)
+    return f"{':'.join(deployment_ids)}|{':'.join(oauth_ids)}"
+
+
+class _PooledSession:
+    def __init__(self, key: str, session, tool_count: int):
+        self.key = key
+        self.session = session
+        self.tool_count = tool_count
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.last_checked = time.monotonic()
+        self.in_use = 0
+        self.uses = 0
+        self.suspect = False  # a run on it failed; probe before the next lease
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tools": self.tool_count,
+            "in_use": self.in_use,
+            "uses": self.uses,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "age_seconds": round(time.time() - self.created_at, 1),
+            "suspect": self.suspect
+        }
+
+
+class MCPSessionPool:
+    """Keeps Metorial MCP sessions connected between runs."""
+
+    def __init__(
+        self,
+        metorial_client,
+        max_size: int = DEFAULT_MAX_SIZE,
+        idle_ttl: float = DEFAULT_IDLE_TTL,
+        health_interval: float = DEFAULT_HEALTH_INTERVAL
+    ):
+        """
+        Args:
+            metorial_client: Metorial instance whose session cache the pool manages
+            max_size: Maximum number of pooled sessions
+            idle_ttl: Seconds after which an unused session is closed
+            health_interval: Seconds between probes of an idle session
+        """
+        self.metorial = metorial_client
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.health_interval = health_interval
+        self._entries: "OrderedDict[str, _PooledSession]" = OrderedDict()
+        self._setup_locks: Dict[str, asyncio.Lock] = {}
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._counts: Dict[str, int] = {}
+
+    # Metorial keeps its sessions in a private dict keyed like session_key();
+    # these two helpers are the only places the pool touches it.
+    def _cache(self) -> Dict[str, Any]:
+        return getattr(self.metorial, "_session_cache", {})
+
+    def _count(self, event: str) -> None:
+        self._counts[event] = self._counts.get(event, 0) + 1
+        MCP_SESSION_EVENTS.inc(event=event)
+
+    async def warm(self, deployment_sets: List[List[Any]]) -> int:
+        """
+        Establish sessions for deployment sets before any request needs them.
+
+        Args:
+            deployment_sets: Deployment lists as passed to metorial.run
+
+        Returns:
+            Number of sets with a ready session
+        """
+        results = await asyncio.gather(
+            *(self.acquire(deployments, lease=False) for deployments in deployment_sets),
+            return_exceptions=True
+        )
+        ready = 0
+        for deployments, result in zip(deployment_sets, results):
+            if isinstance(result, Exception) or result is None:
+                logger.warning(f"Could not warm MCP session for {session_key(deployments)}: {result}")
+            else:
+                ready += 1
+        logger.info(f"Warmed {ready}/{len(deployment_sets)} MCP session(s)")
+        return ready
+
+    async def acquire(self, deployments: List[Any], lease: bool = True) -> Optional[str]:
+        """
+        Make sure a healthy session for the deployment set is in Metorial's cache.
+
+        Args:
+            deployments: Deployment IDs or dicts as passed to metorial.run
+            lease: Mark the session in use until release() (protects it from eviction)
+
+        Returns:
+            Session key, or None if the set can't be pooled
+        """
+        key = session_key(deployments)
+        if key is None:
+            return None
+
+        lock = self._setup_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.in_use == 0 and (
+                entry.suspect or time.monotonic() - entry.last_checked > self.health_interval
+            ):
+                if not await self._probe(entry):
+                    await self._evict(key, "unhealthy")
+                    entry = None
+
+            if entry is None:
+                entry = await self._establish(key, deployments)
+            else:
+                self._count("reused")
+
+            self._entries.move_to_end(key)
+            entry.last_used = time.monotonic()
+            if lease:
+                entry.in_use += 1
+                entry.uses += 1
+
+        await self._enforce_max_size()
+        return key
+
+    def release(self, key: Optional[str], failed: bool = False) -> None:
+        """
+        End a lease taken by acquire().
+
+        Args:
+            key: Key returned by acquire()
+            failed: The run errored; the session is probed before its next use
+        """
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            return
+        entry.in_use = max(0, entry.in_use - 1)
+        entry.last_used = time.monotonic()
+        if failed:
+            entry.suspect = True
+
+    @contextlib.asynccontextmanager
+    async def lease(self, deployments: List[Any]):
+        """
+        Hold a warm session for the duration of a metorial.run.
+
+        Pool failures never fail the run: Metorial then sets the session up itself.
+        """
+        key = None
+        try:
+            key = await self.acquire(deployments)
+        except Exception as e:
+            logger.warning(f"MCP session pool unavailable, running cold: {e}")
+        failed = False
+        try:
+            yield key
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.release(key, failed=failed)
+
+    @time_dependency("metorial", "session_setup")
+    async def _establish(self, key: str, deployments: List[Any]) -> _PooledSession:
+        session = self.metorial.create_mcp_session({"serverDeployments": _normalize(deployments)})
+        try:
+            tool_manager = await session.get_tool_manager(timeout=SETUP_TIMEOUT, enable_fallback=False)
+            tool_count = len(tool_manager.get_tools()) if tool_manager is not None else 0
+            if tool_count == 0:
+                raise RuntimeError("session exposes no tools")
+        except Exception:
+            self._count("setup_failed")
+            # Don't leave a broken session in Metorial's cache for the run to pick up
+            self._cache().pop(key, None)
+            await self._close(session)
+            raise
+
+        entry = _PooledSession(key, session, tool_count)
+        self._entries[key] = entry
+        self._count("created")
+        logger.info(f"MCP session ready for {key} ({tool_count} tools)")
+        return entry
+
+    async def _probe(self, entry: _PooledSession) -> bool:
+        """A session is healthy if its tools are listed and every open MCP client still answers."""
+        entry.last_checked = time.monotonic()
+        session = entry.session
+        if session.is_fallback_mode() or entry.tool_count == 0:
+            return False
+        client_tasks = list(getattr(session._mcp_session, "_client_promises", {}).values())
+        try:
+            for task in client_tasks:
+                if not task.done():
+                    continue
+                if task.cancelled() or task.exception() is not None:
+                    return False
+                client = task.result()
+                if getattr(client, "_closed", False):
+                    return False
+                await asyncio.wait_for(client.list_tools(), timeout=PROBE_TIMEOUT)
+        except Exception as e:
+            logger.info(f"MCP session {entry.key} failed health check: {e}")
+            return False
+        entry.suspect = False
+        return True
+
+    async def _close(self, session) -> None:
+        try:
+            await session.close()
+        except Exception as e:
+            logger.debug(f"Error closing MCP session: {e}")
+
+    async def _evict(self, key: str, reason: str) -> None:
+        entry = self._entries.pop(key, None)
+        session = self._cache().pop(key, None)
+        if entry is not None:
+            session = session or entry.session
+        if session is not None:
+            await self._close(session)
+        self._count(f"evicted_{reason}")
+        logger.info(f"Closed MCP session {key} ({reason})")
+
+    async def _enforce_max_size(self) -> None:
+        while len(self._entries) > self.max_size:
+            idle = [
+                key for key, entry in self._entries.items()
+                if entry.in_use == 0 and not self._setup_locks[key].locked()
+            ]
+            if not idle:
+                logger.warning(f"MCP session pool over its limit ({len(self._entries)}/{self.max_size}), all sessions busy")
+                return
+            await self._evict(idle[0], "lru")  # OrderedDict is in least-recently-used order
+
+    async def maintain(self) -> None:
+        """Close expired sessions and probe idle ones (one maintenance pass)."""
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.in_use:
+                continue
+            if now - entry.last_used > self.idle_ttl:
+                await self._evict(key, "idle")
+            elif now - entry.last_checked > self.health_interval:
+                lock = self._setup_locks.setdefault(key, asyncio.Lock())
+                async with lock:
+                    if entry.in_use == 0 and key in self._entries and not await self._probe(entry):
+                        await self._evict(key, "unhealthy")
+
+    async def _maintenance_loop(self) -> None:
+        interval = max(5.0, min(self.health_interval, self.idle_ttl) / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"MCP session pool maintenance failed: {e}")
+
+    def start(self) -> None:
+        """Start background expiry and health checks (call from a running event loop)."""
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def close(self) -> None:
+        """Stop maintenance and close every pooled session."""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        for key in list(self._entries):
+            await self._evict(key, "shutdown")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "idle_ttl_seconds": self.idle_ttl,
+            "health_interval_seconds": self.health_interval,
+            "events": dict(sorted(self._counts.items())),
+            "sessions": {key: entry.to_dict() for key, entry in self._entries.items()}
+        }
@@ -0,0 +1,199 @@
+"""Per-conversation coalescing of rapid-fire Slack mentions.
+
+People often send a request as several quick messages ("northstar change the
+button", "northstar make it blue too"). Dispatched one by one, each message
+gets its own triage and its own agent run. The coalescer sits between the
+webhook and run_autonomous_agent instead:
+
+    coalescer = MentionCoalescer(run_autonomous_agent)
+    coalescer.submit(channel, user_id, text, thread_ts)   # returns immediately
+
+- Debounce: messages from the same user in the same conversation are held for
+  a short window (extended by each new message, up to a maximum wait) and then
+  run as one request.
+- Supersede: a message arriving while the previous run is still triaging
+  cancels that run and is run together with the messages it was handling.
+  Once a run reaches its execution stage (tools post, commit and open PRs) it
+  calls mark_committed() and is left to finish.
+- Cap: at most a few runs per channel execute at once; the rest wait their turn.
+
+Configuration:
+    NORTHSTAR_COALESCE_WINDOW_SECONDS   - quiet time before a batch runs (default 0.75, 0 disables debouncing)
+    NORTHSTAR_COALESCE_MAX_WAIT_SECONDS - longest a message is held back (default 3)
+    NORTHSTAR_MAX_RUNS_PER_CHANNEL      - agent runs executing at once per channel (default 2)
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WINDOW = float(os.getenv("NORTHSTAR_COALESCE_WINDOW_SECONDS", "0.75"))
+DEFAULT_MAX_WAIT = float(os.getenv("NORTHSTAR_COALESCE_MAX_WAIT_SECONDS", "3"))
+DEFAULT_MAX_RUNS_PER_CHANNEL = int(os.getenv("NORTHSTAR_MAX_RUNS_PER_CHANNEL", "2"))
+
+_current_run: contextvars.ContextVar[Optional["_Run"]] = contextvars.ContextVar(
+    "northstar_coalesced_run", default=None
+)
+
+
+def mark_committed() -> None:
+    """Called by the running agent before it starts side effects: it can no longer be superseded."""
+    run = _current_run.get()
+    if run is not None:
+        run.committed = True
+
+
+def merge_messages(messages: List[str]) -> str:
+    """One request from several messages, in the order they were sent."""
+    return messages[0] if len(messages) == 1 else "\n".join(messages)
+
+
+class _Batch:
+    def __init__(self, messages: List[str], thread_ts: Optional[str], now: float, window: float, max_wait: float):
+        self.messages = messages
+        self.thread_ts = thread_ts
+        self.first_at = now
+        self.max_wait = max_wait
+        self.flush_at = min(now + window, self.first_at + max_wait)
+
+    def add(self, text: str, thread_ts: Optional[str], now: float, window: float) -> None:
+        self.messages.append(text)
+        self.thread_ts = thread_ts or self.thread_ts
+        self.flush_at = min(now + window, self.first_at + self.max_wait)
+
+
+class _Run:
+    def __init__(self, messages: List[str]):
+        self.messages = messages
+        self.committed = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class _ChannelSlots:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class MentionCoalescer:
+    """Debounces, supersedes and caps agent runs per Slack conversation."""
+
+    def __init__(
+        self,
+        run: Callable[..., Awaitable[Any]],
+        window: float = DEFAULT_WINDOW,
+        max_wait: float = DEFAULT_MAX_WAIT,
+        max_runs_per_channel: int = DEFAULT_MAX_RUNS_PER_CHANNEL
+    ):
+        """
+        Args:
+            run: Agent coroutine function, called as run(user_message=, channel=, user_id=, context=)
+            window: Seconds without a new message before a batch runs
+            max_wait: Maximum seconds the first message of a batch is held back
+            max_runs_per_channel: Runs executing at once per channel
+        """
+        self.run = run
+        self.window = window
+        self.max_wait = max_wait
+        self.max_runs_per_channel = max(1, max_runs_per_channel)
+        self._pending: Dict[str, _Batch] = {}
+        self._active: Dict[str, _Run] = {}
+        self._slots: Dict[str, _ChannelSlots] = {}
+        self.counts = {"messages": 0, "runs": 0, "merged": 0, "superseded": 0, "queued": 0}
+
+    @staticmethod
+    def _key(channel: str, user_id: Optional[str], thread_ts: Optional[str]) -> str:
+        return f"{channel}:{thread_ts or 'main'}:{user_id}"
+
+    def submit(self, channel: str, user_id: Optional[str], text: str, thread_ts: Optional[str] = None) -> None:
+        """
+        Queue a mention for the agent (must be called from the event loop).
+
+        Args:
+            channel: Slack channel ID
+            user_id: Slack user ID
+            text: Message text
+            thread_ts: Thread of the message, if threaded
+        """
+        key = self._key(channel, user_id, thread_ts)
+        now = time.monotonic()
+        self.counts["messages"] += 1
+
+        batch = self._pending.get(key)
+        if batch is not None:
+            batch.add(text, thread_ts, now, self.window)
+            self.counts["merged"] += 1
+            logger.info(f"Coalesced message into pending batch for {key} ({len(batch.messages)} messages)")
+            return
+
+        messages = [text]
+        active = self._active.get(key)
+        if active is not None and not active.committed and active.task and not active.task.done():
+            # The earlier run hasn't started acting yet: rerun its messages together with this one
+            active.task.cancel()
+            messages = active.messages + messages
+            self.counts["superseded"] += 1
+            self.counts["merged"] += len(active.messages)
+            logger.info(f"Superseded the run for {key}; rerunning {len(messages)} messages together")
+
+        self._pending[key] = _Batch(messages, thread_ts, now, self.window, self.max_wait)
+        asyncio.create_task(self._flush_later(key, channel, user_id))
+
+    async def _flush_later(self, key: str, channel: str, user_id: Optional[str]) -> None:
+        batch = self._pending[key]
+        while True:
+            delay = batch.flush_at - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        del self._pending[key]
+
+        run = _Run(batch.messages)
+        previous = self._active.get(key)
+        self._active[key] = run
+        run.task = asyncio.create_task(self._execute(key, channel, user_id, batch, run))
+        if previous is not None and previous.task and not previous.task.done():
+            logger.info(f"Earlier run for {key} is past the point of superseding; both will finish")
+
+    async def _execute(self, key: str, channel: str, user_id: Optional[str], batch: _Batch, run: _Run) -> None:
+        _current_run.set(run)
+        slots = self._slots.setdefault(channel, _ChannelSlots(self.max_runs_per_channel))
+        slots.users += 1
+        try:
+            if slots.semaphore.locked():
+                self.counts["queued"] += 1
+                logger.info(f"{self.max_runs_per_channel} runs already executing in {channel}; waiting for a slot")
+            async with slots.semaphore:
+                self.counts["runs"] += 1
+                await self.run(
+                    user_message=merge_messages(batch.messages),
+                    channel=channel,
+                    user_id=user_id,
+                    context={"thread_ts": batch.thread_ts, "coalesced_messages": len(batch.messages)}
+                )
+        except asyncio.CancelledError:
+            logger.info(f"Run for {key} cancelled (superseded by a newer message)")
+        except Exception as e:
+            logger.error(f"Agent run for {key} failed: {e}")
+        finally:
+            slots.users -= 1
+            if slots.users == 0 and self._slots.get(channel) is slots:
+                del self._slots[channel]
+            if self._active.get(key) is run:
+                del self._active[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window,
+            "max_wait_seconds": self.max_wait,
+            "max_runs_per_channel": self.max_runs_per_channel,
+            "pending_batches": len(self._pending),
+            "active_runs": len(self._active),
+            **self.counts
+        }
@@ -0,0 +1,286 @@
+"""Prometheus-style metrics.
+
+A small in-process registry of labelled counters and histograms, rendered in
+the Prometheus text exposition format by the /metrics endpoint. Timers are
+placed around the hot paths (agent stages, LLM calls, GitHub, Supabase,
+Captain, git) so latency in a Slack reply can be broken down by where it is
+actually spent. Inside a trace (see tracing.py) each timer is also a span.
+
+Example:
+    with time_stage("triage"):
+        ...
+
+    @time_dependency("supabase")
+    def get_proposal(...):
+        ...
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from tracing import child_span
+
+# Seconds. Spans fast DB queries up to multi-minute Metorial tool loops.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed observations (cumulative buckets, sum and count) per label set."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-1])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All registered metrics in Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded across the backend
+
+HTTP_REQUEST_DURATION = Histogram(
+    "northstar_http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ("method", "route", "status")
+)
+AGENT_REQUEST_DURATION = Histogram(
+    "northstar_agent_request_duration_seconds",
+    "End-to-end autonomous agent latency by triaged request type.",
+    ("request_type", "outcome")
+)
+AGENT_REQUESTS = Counter(
+    "northstar_agent_requests_total",
+    "Autonomous agent requests by triaged request type.",
+    ("request_type", "outcome")
+)
+STAGE_DURATION = Histogram(
+    "northstar_stage_duration_seconds",
+    "Latency of internal pipeline stages (triage, context fetch, ...).",
+    ("stage", "outcome")
+)
+DEPENDENCY_DURATION = Histogram(
+    "northstar_dependency_duration_seconds",
+    "Latency of calls to external dependencies.",
+    ("dependency", "operation", "outcome")
+)
+LLM_CALL_DURATION = Histogram(
+    "northstar_llm_call_duration_seconds",
+    "LLM gateway call latency (including retries and coalesced waits).",
+    ("call_site", "model", "outcome")
+)
+LLM_TOKENS = Counter(
+    "northstar_llm_tokens_total",
+    "Tokens used per LLM call site.",
+    ("call_site", "model", "kind")
+)
+LLM_RETRIES = Counter(
+    "northstar_llm_retries_total",
+    "LLM call retries after rate limits or server errors.",
+    ("call_site", "model")
+)
+LLM_COALESCED = Counter(
+    "northstar_llm_coalesced_total",
+    "LLM calls served by an identical in-flight request.",
+    ("call_site", "model")
+)
+LLM_ROUTE_DURATION = Histogram(
+    "northstar_llm_route_duration_seconds",
+    "Latency per model route, including fallbacks.",
+    ("route", "outcome")
+)
+LLM_COST = Counter(
+    "northstar_llm_cost_usd_total",
+    "Estimated LLM spend in USD per route and model.",
+    ("route", "model")
+)
+LLM_FALLBACKS = Counter(
+    "northstar_llm_fallbacks_total",
+    "Fallbacks to the next model of a route.",
+    ("route", "from_model", "reason")
+)
+MCP_SESSION_EVENTS = Counter(
+    "northstar_mcp_session_events_total",
+    "Warm MCP session pool events (created, reused, setup_failed, evicted_*).",
+    ("event",)
+)
+PREFETCH_JOBS = Counter(
+    "northstar_prefetch_jobs_total",
+    "Speculative prefetch jobs started alongside triage, by outcome (used, discarded, failed).",
+    ("job", "outcome")
+)
+
+
+class _Timer:
+    """
+    Times a block or function into a histogram, adding an `outcome` label.
+
+    Inside an active trace the block is also recorded as a span named `name`.
+    """
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str], name: str):
+        self.histogram = histogram
+        self.labels = labels
+        self.name = name
+        self._start: Optional[float] = None
+        self._span: Optional[child_span] = None
+
+    def __enter__(self):
+        self._span = child_span(self.name)
+        self._span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "success" if exc_type is None else "error"
+        self.histogram.observe(time.perf_counter() - self._start, outcome=outcome, **self.labels)
+        self._span.__exit__(exc_type, exc, tb)
+        return False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Timer(self.histogram, self.labels, self.name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels, self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def time_stage(stage: str) -> _Timer:
+    """Context manager / decorator timing an internal stage."""
+    return _Timer(STAGE_DURATION, {"stage": stage}, stage)
+
+
+def time_dependency(dependency: str, operation: Optional[str] = None):
+    """
+    Context manager / decorator timing a call to an external dependency.
+
+    As a decorator the operation defaults to the function name.
+    """
+    def timer(op: str) -> _Timer:
+        return _Timer(DEPENDENCY_DURATION, {"dependency": dependency, "operation": op}, f"{dependency}.{op}")
+
+    if operation is not None:
+        return timer(operation)
+
+    def decorator(func):
+        return timer(func.__name__)(func)
+    return decorator
@@ -0,0 +1,96 @@
+"""Model routing policy.
+
+Maps routes (what a call is for - triage, casual chat, code change,
+notification, ...) to an ordered list of model tiers. The first model is
+tried first; the LLM gateway falls back to the next one on errors or when the
+caller rejects the answer as low confidence. Trivial stages go to a cheap, fast
+tier, and work that needs careful reasoning or tool use goes to the standard tier.
+
+Configuration:
+    NORTHSTAR_FAST_MODEL / NORTHSTAR_STANDARD_MODEL  - models behind each tier
+    NORTHSTAR_MODEL_ROUTES - JSON overrides, e.g.
+        {"triage": ["fast", "standard"], "code_change": ["gpt-4.1", "standard"]}
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+MODEL_TIERS = {
+    "fast": os.getenv("NORTHSTAR_FAST_MODEL", "gpt-4o-mini"),
+    "standard": os.getenv("NORTHSTAR_STANDARD_MODEL", "gpt-4o"),
+}
+
+# Route -> tiers (or explicit model names), in fallback order
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "triage": ["fast", "standard"],
+    "casual_chat": ["fast", "standard"],
+    "notification": ["fast", "standard"],   # Slack posts that only copy text
+    "repo_analysis": ["standard"],
+    "analytics": ["standard", "fast"],
+    "code_change": ["standard"],
+    "proposal": ["standard"],
+    "execute": ["standard"],
+    "initialize": ["standard", "fast"],
+    "debug": ["fast"],
+    "summarize": ["fast", "standard"],     # conversation memory summaries
+}
+
+DEFAULT_ROUTE = "standard"
+
+# USD per 1M tokens (input, output). Unknown models are tracked at zero cost.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost in USD of a call, 0.0 for models without a known price."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """Resolves a route name to the ordered list of models to try."""
+
+    def __init__(self, routes: Optional[Dict[str, List[str]]] = None, tiers: Optional[Dict[str, str]] = None):
+        self.tiers = dict(tiers or MODEL_TIERS)
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """Default routes with overrides from NORTHSTAR_MODEL_ROUTES."""
+        overrides = {}
+        raw = os.getenv("NORTHSTAR_MODEL_ROUTES")
+        if raw:
+            try:
+                overrides = {route: list(models) for route, models in json.loads(raw).items()}
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.error(f"Ignoring invalid NORTHSTAR_MODEL_ROUTES: {e}")
+        return cls(overrides)
+
+    def models_for(self, route: Optional[str]) -> List[str]:
+        """
+        Models for a route, tier names resolved and duplicates removed.
+
+        Unknown routes use the standard tier.
+        """
+        entries = self.routes.get(route) or [DEFAULT_ROUTE]
+        models = []
+        for entry in entries:
+            model = self.tiers.get(entry, entry)
+            if model not in models:
+                models.append(model)
+        return models
+
+    def table(self) -> Dict[str, List[str]]:
+        """The resolved routing table (for debugging endpoints)."""
+        return {route: self.models_for(route) for route in sorted(self.routes)}
@@ -0,0 +1,245 @@
+"""Multi-file change sets: one update block per file, merged concurrently.
+
+A proposal's technical_plan can name several files. Its update_block then
+holds one section per file, each introduced by a header line:
+
+    === src/components/Button.jsx ===
+    ...
+    === src/styles/theme.css ===
+    ...
+
+git headers ("diff --git a/x b/x", "+++ b/x") and "// File: x" comments are
+recognised as well. split_update_block() maps the sections onto the planned
+files - a section for any other file, or for a path that is absolute or
+climbs out of the repository ("../"), rejects the whole block - and
+merge_change_set() reads and merges every file at once (locally or
+via Morph, see fast_apply.py), so a change touching several files takes about
+as long as its slowest file. The caller commits the result as one commit.
+
+Configuration:
+    NORTHSTAR_CHANGE_SET_WORKERS - files read and merged at once (default 8)
+"""
+
+import logging
+import os
+import posixpath
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .fast_apply import MergeResult, apply_update
+from .utils import unified_diff
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WORKERS = int(os.getenv("NORTHSTAR_CHANGE_SET_WORKERS", "8"))
+
+_FILE_HEADERS = [
+    re.compile(r"^\s*===\s*(?P<path>[^=\s][^=]*?)\s*===\s*$"),
+    re.compile(r"^\s*diff --git a/(?P<path>\S+) b/\S+\s*$"),
+    re.compile(r"^\s*(?://|#|<!--|/\*)\s*[Ff]ile:\s*(?P<path>\S+?)\s*(?:-->|\*/)?\s*$"),
+]
+_OLD_FILE_HEADER = re.compile(r"^\s*--- (?:a/)?\S+\s*$")
+_NEW_FILE_HEADER = re.compile(r"^\s*\+\+\+ (?:b/)?(?P<path>\S+)\s*$")
+_INDEX_LINE = re.compile(r"^\s*index [0-9a-f]+\.\.[0-9a-f]+")
+
+# Joins two sections for the same file (recognised as an elision by fast_apply and Morph)
+SECTION_SEPARATOR = "... existing code ..."
+
+
+def _header_path(line: str, previous: str) -> Optional[str]:
+    # "+++ path" only counts after a "--- path" line (otherwise it could be an added "++" line)
+    match = _NEW_FILE_HEADER.match(line)
+    if match and _OLD_FILE_HEADER.match(previous):
+        return None if match.group("path") == "/dev/null" else match.group("path")
+    for pattern in _FILE_HEADERS:
+        match = pattern.match(line)
+        if match and match.group("path") != "/dev/null":
+            return match.group("path").strip()
+    return None
+
+
+class UnsafePath(ValueError):
+    """A change set names a file outside the repository or outside the plan."""
+
+
+def safe_relative_path(path: str) -> str:
+    """
+    Normalise a repository-relative path.
+
+    Raises:
+        UnsafePath: The path is empty, absolute, contains ".." or points into .git
+    """
+    path = path.strip().replace("\\", "/").removeprefix("./")
+    parts = path.split("/")
+    if (
+        not path or path.startswith("/") or re.match(r"^[A-Za-z]:", path)
+        or ".." in parts or parts[0] == ".git"
+    ):
+        raise UnsafePath(f"unsafe file path: {path!r}")
+    return posixpath.normpath(path)
+
+
+def resolve_in_repo(root: Path, path: str) -> Path:
+    """
+    Location of a repository-relative path inside a checkout.
+
+    Raises:
+        UnsafePath: The path (after following symlinks) is outside root
+    """
+    root = root.resolve()
+    full_path = (root / safe_relative_path(path)).resolve()
+    if not full_path.is_relative_to(root):
+        raise UnsafePath(f"{path!r} resolves outside the repository")
+    return full_path
+
+
+def _resolve(path: str, planned: List[str]) -> str:
+    """
+    Map a header path onto a planned file (tolerating ./ prefixes and partial paths).
+
+    Raises:
+        UnsafePath: The path is unsafe or not one of the planned files
+    """
+    path = safe_relative_path(path)
+    if path in planned:
+        return path
+    matches = [p for p in planned if p.endswith("/" + path) or path.endswith("/" + p)]
+    if len(matches) == 1:
+        return matches[0]
+    raise UnsafePath(f"the update block changes {path}, which is not one of the planned files ({', '.join(planned)})")
+
+
+def split_update_block(update_block: str, file_paths: List[str]) -> Dict[str, str]:
+    """
+    Split an update block into one block per file.
+
+    Args:
+        update_block: Fast Apply snippet or diff, optionally with per-file headers
+        file_paths: Files from the technical plan (first = default target)
+
+    Returns:
+        {path: update block} in order of appearance. A block without file
+        headers belongs entirely to the first planned file.
+
+    Raises:
+        UnsafePath: A planned or header path is unsafe, or a header names a
+            file that is not planned
+    """
+    file_paths = [safe_relative_path(path) for path in file_paths]
+    lines = update_block.split("\n")
+    sections: Dict[str, List[str]] = {}
+    current: Optional[str] = None
+    preamble: List[str] = []
+
+    for i, line in enumerate(lines):
+        path = _header_path(line, lines[i - 1] if i else "")
+        if path is not None:
+            path = _resolve(path, file_paths)
+            if path != current:
+                if path in sections:
+                    sections[path].append(SECTION_SEPARATOR)
+                else:
+                    sections[path] = []
+                current = path
+            continue
+        previous = lines[i - 1] if i else ""
+        next_line = lines[i + 1] if i + 1 < len(lines) else ""
+        if (
+            _INDEX_LINE.match(line)
+            or (_OLD_FILE_HEADER.match(line) and _NEW_FILE_HEADER.match(next_line))
+            or (_NEW_FILE_HEADER.match(line) and _OLD_FILE_HEADER.match(previous))
+        ):
+            continue
+        (sections[current] if current is not None else preamble).append(line)
+
+    if not sections:
+        return {file_paths[0]: update_block} if file_paths else {}
+
+    if "\n".join(preamble).strip():
+        first = next(iter(sections))
+        sections[first] = preamble + sections[first]
+    return {path: "\n".join(body).strip("\n") for path, body in sections.items() if "\n".join(body).strip()}
+
+
+def new_file_content(update_block: str) -> str:
+    """Content for a file that doesn't exist yet (an all-"+" diff loses its markers)."""
+    lines = [line for line in update_block.split("\n") if not line.startswith("@@")]
+    code = [line for line in lines if line.strip()]
+    if code and all(line.startswith("+") for line in code):
+        lines = [line[1:] for line in lines]
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+
+class FileChange:
+    """One file of a change set: its update block and, after merging, the result."""
+
+    def __init__(self, path: str, update_block: str):
+        self.path = path
+        self.update_block = update_block
+        self.original: Optional[str] = None
+        self.merged: Optional[str] = None
+        self.merge: Optional[MergeResult] = None
+        self.diff = ""
+        self.error: Optional[str] = None
+
+    @property
+    def changed(self) -> bool:
+        return self.merged is not None and self.merged != self.original
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "new_file": self.original is None and self.merged is not None,
+            "diff_lines": len(self.diff.splitlines()),
+            "merge": self.merge.to_dict() if self.merge else None,
+            "error": self.error
+        }
+
+
+def merge_change_set(
+    instruction: str,
+    blocks: Dict[str, str],
+    read_file: Callable[[str], Optional[str]],
+    max_workers: int = DEFAULT_WORKERS
+) -> List[FileChange]:
+    """
+    Read and merge every file of a change set concurrently.
+
+    Args:
+        instruction: Natural language description of the change
+        blocks: {path: update block} from split_update_block()
+        read_file: Returns a file's current content, or None if it doesn't exist
+            (called from worker threads)
+        max_workers: Files processed at once
+
+    Returns:
+        One FileChange per block, in the same order; failures are recorded in
+        FileChange.error rather than raised, so the caller can reject the set as a whole
+    """
+    changes = [FileChange(path, block) for path, block in blocks.items()]
+
+    def merge_one(change: FileChange) -> None:
+        try:
+            change.original = read_file(change.path)
+            if change.original is None:
+                change.merged = new_file_content(change.update_block)
+            else:
+                change.merge = apply_update(instruction, change.original, change.update_block)
+                change.merged = change.merge.code
+            change.diff = unified_diff(change.original or "", change.merged, change.path)
+        except Exception as e:
+            change.error = str(e)
+            logger.warning(f"Could not merge change for {change.path}: {e}")
+
+    if changes:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(changes)))) as pool:
+            list(pool.map(merge_one, changes))
+    return changes
+
+
+def combined_diff(changes: List[FileChange]) -> str:
+    """Unified diff of every changed file, in change set order."""
+    return "\n".join(change.diff for change in changes if change.diff)
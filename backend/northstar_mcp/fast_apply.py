@@ -0,0 +1,533 @@
+"""Local Fast Apply: merge update blocks without a Morph round trip.
+
+Update blocks come in two shapes:
+
+- Fast Apply snippets: changed code with a few unchanged lines around it, and
+  unchanged regions elided by "// ... existing code ..." markers (any comment
+  syntax)
+- +/- diffs: unified diff hunks, or the looser "- old line" / "+ new line"
+  blocks models write, optionally separated by the same markers
+
+Each chunk of a snippet is anchored by its first and last lines, which must
+already exist in the file; the region between the anchors is replaced by the
+chunk. A chunk without an end anchor replaces the rest of the file when
+nothing follows it, and is otherwise only an insertion when the next line of
+the file closes the block it is nested in. Lines are matched by a normalised
+hash (whitespace collapsed, then also ignoring trailing ; and ,), so
+re-indented or reformatted context still anchors. Diff hunks are located by their context and removed lines.
+
+Every local merge gets a confidence score. Anchors that are missing or match
+more than one place raise MergeAmbiguous, and weak anchors lower the score;
+apply_update() sends those merges to Morph instead.
+
+Configuration:
+    NORTHSTAR_LOCAL_FAST_APPLY          - "false" to always use Morph
+    NORTHSTAR_FAST_APPLY_MIN_CONFIDENCE - local merges scoring lower go to Morph (default 0.8)
+"""
+
+import difflib
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .morph_client import merge_code
+
+logger = logging.getLogger(__name__)
+
+
+LOCAL_ENABLED = os.getenv("NORTHSTAR_LOCAL_FAST_APPLY", "true").lower() == "true"
+MIN_LOCAL_CONFIDENCE = float(os.getenv("NORTHSTAR_FAST_APPLY_MIN_CONFIDENCE", "0.8"))
+
+# "// ... existing code ...", "# ... rest of file ...", "<!-- ... -->", "{/* ... existing code ... */}", "..."
+_MARKER = re.compile(
+    r"^\s*(?:(?://|#|--|;|/\*|\{/\*|<!--|\*)\s*)?\.\.\.\s*"
+    r"(?:(?:existing|rest of|remaining|unchanged|keep|other|previous)\b[^\n]*)?"
+    r"(?:\*/\}?|-->)?\s*$",
+    re.IGNORECASE
+)
+_HUNK_HEADER = re.compile(r"^@@ .* @@")
+_OPEN_TAG = re.compile(r"<[A-Za-z][^<>]*(?<!/)>")
+_CLOSE_TAG = re.compile(r"</[A-Za-z]")
+
+# New lines after an anchor this similar to the next line of the file may be an edit of it
+EDIT_SIMILARITY = 0.6
+
+# Score multipliers for anchors that are correct but less certain
+PENALTY_LOOSE_MATCH = 0.9       # anchor only matched after dropping ; and , differences
+PENALTY_FILE_EDGE = 0.85        # chunk runs to the start/end of the file instead of an anchor
+PENALTY_NEAREST_TAIL = 0.85     # several possible end anchors; the nearest one was used
+PENALTY_WEAK_TAIL = 0.9         # the end anchor is a closing brace/tag, chosen by bracket balance
+PENALTY_INSERTION = 0.9         # new lines nested before the end of a block, with no end anchor: inserted
+PENALTY_WEAK_HEAD = 0.75        # the start anchor is only closing braces/tags
+PENALTY_LARGE_REGION = 0.6      # the replaced region is far larger than the chunk
+
+
+class MergeAmbiguous(Exception):
+    """The update block can't be placed in the file with certainty."""
+
+
+class MergeResult:
+    """Merged file contents and how they were produced."""
+
+    def __init__(self, code: str, method: str, confidence: Optional[float], reason: str = "", duration_ms: float = 0.0):
+        """
+        Args:
+            code: Merged file contents
+            method: "local" or "morph"
+            confidence: Local merge score in [0, 1] (None for Morph merges)
+            reason: Why Morph was used, if it was
+            duration_ms: Time spent merging
+        """
+        self.code = code
+        self.method = method
+        self.confidence = confidence
+        self.reason = reason
+        self.duration_ms = duration_ms
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "method": self.method,
+            "confidence": round(self.confidence, 3) if self.confidence is not None else None,
+            "reason": self.reason,
+            "duration_ms": round(self.duration_ms, 2)
+        }
+
+
+def _strict_key(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _loose_key(line: str) -> str:
+    return re.sub(r"\s+", "", line).rstrip(";,")
+
+
+def _indent(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _is_weak(line: str) -> bool:
+    """Lines like "}", ");" or "</div>" that occur all over a file."""
+    return len(re.sub(r"[\W_]", "", line)) <= 3
+
+
+class _File:
+    """Original lines with a hash index per normalisation level."""
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+        self.keys = {
+            "strict": [_strict_key(line) for line in lines],
+            "loose": [_loose_key(line) for line in lines]
+        }
+        self.index: Dict[str, Dict[str, List[int]]] = {}
+        for level, keys in self.keys.items():
+            positions: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                positions.setdefault(key, []).append(i)
+            self.index[level] = positions
+
+    def matches(self, level: str, position: int, key: str) -> bool:
+        return 0 <= position < len(self.lines) and self.keys[level][position] == key
+
+
+def _key_fn(level: str):
+    return _strict_key if level == "strict" else _loose_key
+
+
+def _find_head(file: _File, chunk: List[str], lo: int) -> Tuple[List[int], int, str]:
+    """
+    Positions where the chunk's first lines start, at or after `lo`.
+
+    Returns:
+        (candidates, matched_lines, level); candidates is empty if the first line isn't found
+    """
+    for level in ("strict", "loose"):
+        keys = [_key_fn(level)(line) for line in chunk]
+        candidates = [p for p in file.index[level].get(keys[0], ()) if p >= lo]
+        if not candidates:
+            continue
+        length = 1
+        # Extend the anchor line by line until it is unique (or the chunk diverges)
+        while len(candidates) > 1 and length < len(keys):
+            narrowed = [p for p in candidates if file.matches(level, p + length, keys[length])]
+            if not narrowed:
+                break
+            candidates, length = narrowed, length + 1
+        return candidates, length, level
+    return [], 0, "strict"
+
+
+def _extent(file: _File, chunk: List[str], start: int, level: str) -> int:
+    """Chunk lines matching the file consecutively from `start`."""
+    key = _key_fn(level)
+    n = 0
+    while n < len(chunk) and file.matches(level, start + n, key(chunk[n])):
+        n += 1
+    return n
+
+
+def _extent_back(file: _File, chunk: List[str], end: int, level: str, limit: int) -> int:
+    """Chunk lines matching the file consecutively backwards from line `end` - 1 (at most `limit`)."""
+    key = _key_fn(level)
+    n = 0
+    while n < limit and file.matches(level, end - 1 - n, key(chunk[-1 - n])):
+        n += 1
+    return n
+
+
+def _find_tail(file: _File, chunk: List[str], lo: int, head: int) -> Tuple[List[int], int, str]:
+    """
+    Positions (last line index) where the chunk's last lines end, at or after `lo`.
+
+    Returns:
+        (candidates, matched_lines, level), nearest candidate first
+    """
+    for level in ("strict", "loose"):
+        keys = [_key_fn(level)(line) for line in chunk]
+        candidates = [q for q in file.index[level].get(keys[-1], ()) if q >= lo]
+        if not candidates:
+            continue
+        length = 1
+        while len(candidates) > 1 and length < len(keys) - 1:
+            narrowed = [q for q in candidates
+                        if q - length > head and file.matches(level, q - length, keys[-1 - length])]
+            if not narrowed:
+                break
+            candidates, length = narrowed, length + 1
+        return sorted(candidates), length, level
+    return [], 0, "strict"
+
+
+def _trim_blank(lines: List[str]) -> List[str]:
+    start, end = 0, len(lines)
+    while start < end and not lines[start].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return lines[start:end]
+
+
+def _split_segments(update_lines: List[str]) -> List[Tuple[bool, List[str]]]:
+    """[(is_marker, lines)] with consecutive code lines grouped."""
+    segments: List[Tuple[bool, List[str]]] = []
+    for line in update_lines:
+        is_marker = bool(_MARKER.match(line)) and bool(line.strip())
+        if segments and segments[-1][0] == is_marker and not is_marker:
+            segments[-1][1].append(line)
+        else:
+            segments.append((is_marker, [line]))
+    return segments
+
+
+def _balance(lines: List[str]) -> int:
+    """Net brackets and markup tags opened by some lines (closers count negative)."""
+    total = 0
+    for line in lines:
+        total += sum(line.count(c) for c in "{[(") - sum(line.count(c) for c in "}])")
+        total += len(_OPEN_TAG.findall(line)) - len(_CLOSE_TAG.findall(line))
+    return total
+
+
+def _similar(a: str, b: str) -> bool:
+    return difflib.SequenceMatcher(None, _strict_key(a), _strict_key(b)).ratio() >= EDIT_SIMILARITY
+
+
+class _Placement:
+    """Region [start, end) of the file replaced by a chunk, and the anchor lines at either side."""
+
+    def __init__(self, start: int, end: int, head: int, tail: int, confidence: float):
+        self.start = start
+        self.end = end
+        self.head = head
+        self.tail = tail
+        self.confidence = confidence
+
+
+def _place_chunk(
+    file: _File,
+    chunk: List[str],
+    cursor: int,
+    open_start: bool,
+    open_end: bool
+) -> _Placement:
+    """
+    Find the region of the file that a snippet chunk replaces.
+
+    Args:
+        file: Original file
+        chunk: Chunk lines (blank edges trimmed)
+        cursor: First line the chunk may touch (end of the previous chunk)
+        open_start: No marker before the chunk and it's the first one (it may start the file)
+        open_end: No marker after the chunk and it's the last one (it may end the file)
+
+    Raises:
+        MergeAmbiguous: The chunk can't be placed with certainty
+    """
+    confidence = 1.0
+    candidates, _, head_level = _find_head(file, chunk, cursor)
+    if len(candidates) > 1:
+        raise MergeAmbiguous(f"first line of a chunk matches {len(candidates)} places: {chunk[0].strip()[:60]!r}")
+    if candidates:
+        start = candidates[0]
+        head = _extent(file, chunk, start, head_level)
+        if head_level == "loose":
+            confidence *= PENALTY_LOOSE_MATCH
+        if all(_is_weak(line) for line in chunk[:head]):
+            confidence *= PENALTY_WEAK_HEAD
+    elif open_start:
+        start, head = cursor, 0
+        confidence *= PENALTY_FILE_EDGE
+    else:
+        raise MergeAmbiguous(f"first line of a chunk is not in the file: {chunk[0].strip()[:60]!r}")
+
+    if head == len(chunk):
+        return _Placement(start, start + head, head, 0, confidence)  # unchanged context only
+
+    rest = chunk[head:]
+    tails, tail, tail_level = _find_tail(file, chunk, start + head, start)
+    weak_tail = bool(tails) and all(_is_weak(line) for line in chunk[-tail:])
+    if tail_level == "loose":
+        confidence *= PENALTY_LOOSE_MATCH
+
+    if (not tails or weak_tail) and head and not open_end and _balance(rest) == 0:
+        # Self-contained new lines after the anchor ("}" closing a new function, not an old one)
+        # are an insertion only if the next line of the file is clearly not part of the edit:
+        # it closes the block the new lines are nested in (or there is none)
+        following = next((line for line in file.lines[start + head:] if line.strip()), None)
+        if following is not None:
+            new_lines = _reindent(rest, _indent(chunk[0]), _indent(file.lines[start]))
+            nested = all(len(_indent(line)) > len(_indent(following)) for line in new_lines if line.strip())
+            if not nested or _similar(rest[0], following):
+                raise MergeAmbiguous(f"chunk could insert or replace near {following.strip()[:60]!r}")
+        return _Placement(start, start + head, head, 0, confidence * PENALTY_INSERTION)
+
+    if weak_tail:
+        # A closing brace/tag: use the one that closes what the chunk opened
+        wanted = _balance(chunk)
+        balanced = [q for q in tails if _balance(file.lines[start:q + 1]) == wanted]
+        if not balanced:
+            raise MergeAmbiguous(f"no closing line in the file matches the chunk's {chunk[-1].strip()!r}")
+        tails = balanced
+        confidence *= PENALTY_WEAK_TAIL
+    elif len(tails) > 1:
+        confidence *= PENALTY_NEAREST_TAIL
+
+    if tails:
+        end = tails[0] + 1
+        tail = _extent_back(file, chunk, end, tail_level, min(len(chunk) - head, end - start - head))
+    elif open_end:
+        end, tail = len(file.lines), 0
+        confidence *= PENALTY_FILE_EDGE
+    else:
+        raise MergeAmbiguous(f"last line of a chunk is not in the file: {chunk[-1].strip()[:60]!r}")
+
+    if end - start > 2 * len(chunk) + 10:
+        confidence *= PENALTY_LARGE_REGION
+    return _Placement(start, end, head, tail, confidence)
+
+
+def _reindent(lines: List[str], from_indent: str, to_indent: str) -> List[str]:
+    """Shift lines written at one base indentation to the file's."""
+    if from_indent == to_indent:
+        return lines
+    shifted = []
+    for line in lines:
+        if line.strip() and line.startswith(from_indent):
+            line = to_indent + line[len(from_indent):]
+        shifted.append(line)
+    return shifted
+
+
+def _merge_snippet(file: _File, segments: List[Tuple[bool, List[str]]]) -> Tuple[List[str], float]:
+    code_indexes = [i for i, (is_marker, lines) in enumerate(segments) if not is_marker and _trim_blank(lines)]
+    if not code_indexes:
+        raise MergeAmbiguous("update block has no code")
+
+    output: List[str] = []
+    cursor = 0
+    confidence = 1.0
+    for n, i in enumerate(code_indexes):
+        chunk = _trim_blank(segments[i][1])
+        open_start = n == 0 and i == 0
+        open_end = n == len(code_indexes) - 1 and i == len(segments) - 1
+        placement = _place_chunk(file, chunk, cursor, open_start, open_end)
+        start, end, head, tail = placement.start, placement.end, placement.head, placement.tail
+
+        # Anchor lines are kept as they are in the file; new lines follow the file's indentation
+        if head:
+            from_indent, to_indent = _indent(chunk[0]), _indent(file.lines[start])
+        elif tail:
+            from_indent, to_indent = _indent(chunk[-1]), _indent(file.lines[end - 1])
+        else:
+            from_indent = to_indent = ""
+        output.extend(file.lines[cursor:start + head])
+        output.extend(_reindent(chunk[head:len(chunk) - tail], from_indent, to_indent))
+        output.extend(file.lines[end - tail:end])
+        cursor = end
+        confidence = min(confidence, placement.confidence)
+    output.extend(file.lines[cursor:])
+    return output, confidence
+
+
+def _is_diff(update_lines: List[str]) -> bool:
+    """A unified diff, or a block whose every code line is a +/-/context line with at least one +/-."""
+    if any(_HUNK_HEADER.match(line) for line in update_lines):
+        return True
+    code = [line for line in update_lines if line.strip() and not _MARKER.match(line)]
+    if not code or not any(line[0] in "+-" for line in code):
+        return False
+    return all(line[0] in "+- " for line in code)
+
+
+def _as_loose_diff(file: _File, update_lines: List[str]) -> Optional[List[str]]:
+    """
+    A "- old" / "+ new" block whose context lines carry no leading space, as a diff.
+
+    Only when every removed line exists in the file and no +/- line is itself a
+    line of the file (YAML or Markdown lists start with "- " too).
+    """
+    marked = [line for line in update_lines if line[:1] in ("+", "-") and not _MARKER.match(line)]
+    if not marked:
+        return None
+    for line in marked:
+        if _loose_key(line) in file.index["loose"]:
+            return None
+        if line[0] == "-" and line[1:].strip() and _loose_key(line[1:]) not in file.index["loose"]:
+            return None
+    return [
+        line if not line.strip() or line[:1] in ("+", "-", " ") or _MARKER.match(line) else " " + line
+        for line in update_lines
+    ]
+
+
+def _diff_hunks(update_lines: List[str]) -> List[List[str]]:
+    hunks: List[List[str]] = [[]]
+    for line in update_lines:
+        if line.startswith(("--- ", "+++ ")) and not hunks[-1]:
+            continue  # file headers
+        if _HUNK_HEADER.match(line) or _MARKER.match(line):
+            if hunks[-1]:
+                hunks.append([])
+            continue
+        hunks[-1].append(line if line else " ")
+    return [hunk for hunk in hunks if any(line[0] in "+-" for line in hunk)]
+
+
+def _merge_diff(file: _File, hunks: List[List[str]]) -> Tuple[List[str], float]:
+    output: List[str] = []
+    cursor = 0
+    confidence = 1.0
+    for hunk in hunks:
+        old = [line[1:] for line in hunk if line[0] in " -"]
+        if not [line for line in old if line.strip()]:
+            raise MergeAmbiguous("diff hunk has no context or removed lines to anchor it")
+
+        found, level = [], "strict"
+        for level in ("strict", "loose"):
+            key = _key_fn(level)
+            old_keys = [key(line) for line in old]
+            found = [p for p in file.index[level].get(old_keys[0], ()) if p >= cursor
+                     and all(file.matches(level, p + k, old_keys[k]) for k in range(len(old_keys)))]
+            if found:
+                break
+        if not found:
+            raise MergeAmbiguous(f"diff hunk doesn't match the file near {old[0].strip()[:60]!r}")
+        if len(found) > 1:
+            raise MergeAmbiguous(f"diff hunk matches {len(found)} places near {old[0].strip()[:60]!r}")
+        if level == "loose":
+            confidence *= PENALTY_LOOSE_MATCH
+
+        start = found[0]
+        # Models often write "- old" / "+ new" with the indentation shifted; follow the file's
+        written = next((line for line in old if line.strip()), "")
+        actual = file.lines[start + old.index(written)]
+        from_indent, to_indent = _indent(written), _indent(actual)
+
+        output.extend(file.lines[cursor:start])
+        position = start
+        for line in hunk:
+            marker, text = line[0], line[1:]
+            if marker == "+":
+                if from_indent != to_indent and text.startswith(from_indent):
+                    text = to_indent + text[len(from_indent):]
+                output.append(text)
+            else:
+                if marker == " ":
+                    output.append(file.lines[position])
+                position += 1
+        cursor = position
+    output.extend(file.lines[cursor:])
+    return output, confidence
+
+
+def apply_locally(initial_code: str, update_block: str) -> MergeResult:
+    """
+    Merge an update block into a file without calling Morph.
+
+    Args:
+        initial_code: Current file contents
+        update_block: Fast Apply snippet or +/- diff
+
+    Returns:
+        MergeResult with method "local" and its confidence
+
+    Raises:
+        MergeAmbiguous: The block can't be anchored in the file
+    """
+    started = time.perf_counter()
+    newline = "\r\n" if "\r\n" in initial_code else "\n"
+    file = _File(initial_code.splitlines())
+    update_lines = update_block.replace("\r\n", "\n").split("\n")
+
+    loose_diff = None if _is_diff(update_lines) else _as_loose_diff(file, update_lines)
+    if _is_diff(update_lines):
+        lines, confidence = _merge_diff(file, _diff_hunks(update_lines))
+    elif loose_diff is not None:
+        lines, confidence = _merge_diff(file, _diff_hunks(loose_diff))
+    else:
+        lines, confidence = _merge_snippet(file, _split_segments(update_lines))
+
+    code = newline.join(lines)
+    if initial_code.endswith(("\n", "\r")) or not initial_code:
+        code += newline
+    return MergeResult(code, "local", confidence, duration_ms=(time.perf_counter() - started) * 1000)
+
+
+def apply_update(
+    instruction: str,
+    initial_code: str,
+    update_block: str,
+    min_confidence: float = MIN_LOCAL_CONFIDENCE
+) -> MergeResult:
+    """
+    Merge an update block locally, falling back to Morph when the local merge is uncertain.
+
+    Args:
+        instruction: Natural language description of the change (used by Morph)
+        initial_code: Current file contents
+        update_block: Fast Apply snippet or +/- diff
+        min_confidence: Local merges scoring lower are redone by Morph
+
+    Returns:
+        MergeResult ("local" with its confidence, or "morph")
+
+    Raises:
+        MorphAPIError: The merge needed Morph and the Morph call failed
+    """
+    reason = "local merge disabled"
+    if LOCAL_ENABLED:
+        try:
+            result = apply_locally(initial_code, update_block)
+            if result.confidence >= min_confidence:
+                logger.info(f"Merged update block locally (confidence {result.confidence:.2f}, {result.duration_ms:.1f}ms)")
+                return result
+            reason = f"low local confidence ({result.confidence:.2f})"
+        except MergeAmbiguous as e:
+            reason = str(e)
+
+    logger.info(f"Merging update block with Morph: {reason}")
+    started = time.perf_counter()
+    merged = merge_code(instruction, initial_code, update_block)
+    return MergeResult(merged, "morph", None, reason, (time.perf_counter() - started) * 1000)
@@ -0,0 +1,274 @@
+"""Conditional-request (ETag) cache for GitHub GET requests.
+
+Context fetches request the same directory listings, file contents and
+commit lists for every proposal. GitHub answers a request carrying
+If-None-Match / If-Modified-Since with 304 Not Modified when nothing
+changed: no body, and no rate-limit quota used.
+
+Pooled clients (github_pool.py) send their GETs through
+ConditionalCacheAdapter. A 200 response with an ETag or Last-Modified is
+stored on disk; the next GET for the same URL (and token and Accept header)
+revalidates it, and a 304 is turned back into the stored 200 response with
+the fresh headers (rate-limit figures included), so PyGithub never notices.
+Entries are evicted least recently used first once the cache exceeds its
+size cap.
+
+Configuration:
+    NORTHSTAR_GITHUB_CACHE        - "false" disables the cache (default true)
+    NORTHSTAR_GITHUB_CACHE_MAX_MB - disk space used by cached bodies (default 256)
+    NORTHSTAR_CACHE_DIR           - cache location (github/ below it)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from github import Github
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_ENABLED = os.getenv("NORTHSTAR_GITHUB_CACHE", "true").lower() != "false"
+CACHE_MAX_BYTES = int(float(os.getenv("NORTHSTAR_GITHUB_CACHE_MAX_MB", "256")) * 1024 * 1024)
+CACHE_DIR = Path(os.getenv("NORTHSTAR_CACHE_DIR", "~/.cache/northstar")).expanduser() / "github"
+
+# Headers describing the stored (already decoded) body rather than a response in transit
+_TRANSPORT_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive", "set-cookie"}
+
+
+def cache_key(request: requests.PreparedRequest) -> str:
+    """Key of a GET: URL, Accept header and token (hashed; tokens can see different content)."""
+    headers = request.headers
+    parts = [request.url or "", headers.get("Accept", ""), headers.get("Authorization", "")]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class ConditionalCache:
+    """Response bodies and validators on disk, one file per key, LRU-evicted under a size cap."""
+
+    def __init__(self, directory: Path, max_bytes: int = CACHE_MAX_BYTES):
+        """
+        Args:
+            directory: Where entries are stored
+            max_bytes: Total size of entries kept; least recently used ones are removed beyond it
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # A single entry may use at most an eighth of the cache
+        self.max_entry_bytes = max(1, max_bytes // 8)
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self.counts = {"lookups": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        # Called with the lock held; entries from earlier runs, oldest use first
+        if self._index is None:
+            found = []
+            if self.directory.is_dir():
+                for path in self.directory.glob("??/*"):
+                    if path.suffix == ".tmp":
+                        continue
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path.name, stat.st_size))
+            found.sort()
+            self._index = OrderedDict((name, size) for _, name, size in found)
+            self._size = sum(self._index.values())
+        return self._index
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """
+        Returns:
+            (metadata with etag, last_modified and headers, body), or None
+        """
+        with self._lock:
+            index = self._load_index()
+            self.counts["lookups"] += 1
+            if key not in index:
+                return None
+            index.move_to_end(key)
+        path = self._path(key)
+        try:
+            raw, _, body = path.read_bytes().partition(b"\n")
+            meta = json.loads(raw)
+            os.utime(path)
+        except (OSError, ValueError):
+            self._forget(key)
+            return None
+        return meta, body
+
+    def put(self, key: str, meta: Dict[str, Any], body: bytes) -> None:
+        data = json.dumps(meta).encode("utf-8") + b"\n" + body
+        if len(data) > self.max_entry_bytes:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except OSError as e:
+            logger.warning(f"Could not write GitHub cache entry: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            index = self._load_index()
+            self._size += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            self.counts["stored"] += 1
+            while self._size > self.max_bytes and len(index) > 1:
+                old, size = index.popitem(last=False)
+                self._size -= size
+                self.counts["evicted"] += 1
+                evicted.append(old)
+        for old in evicted:
+            try:
+                self._path(old).unlink()
+            except OSError:
+                pass
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            index = self._load_index()
+            self._size -= index.pop(key, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            return {
+                "directory": str(self.directory),
+                "entries": len(index),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                **self.counts
+            }
+
+
+class ConditionalCacheAdapter(HTTPAdapter):
+    """HTTPAdapter that revalidates cached GET responses and serves 304s from the cache."""
+
+    def __init__(self, cache: ConditionalCache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, **kwargs) -> requests.Response:
+        conditional = "If-None-Match" in request.headers or "If-Modified-Since" in request.headers
+        if request.method != "GET" or stream or conditional:
+            # Downloads and PyGithub's own conditional requests pass through
+            return super().send(request, stream=stream, **kwargs)
+
+        key = cache_key(request)
+        cached = self.cache.get(key)
+        if cached is not None:
+            meta, body = cached
+            if meta.get("etag"):
+                request.headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request.headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.counts["revalidated"] += 1
+            return self._from_cache(response, meta, body)
+        if response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                headers = {k: v for k, v in response.headers.items() if k.lower() not in _TRANSPORT_HEADERS}
+                meta = {"url": request.url, "etag": etag, "last_modified": last_modified, "headers": headers}
+                self.cache.put(key, meta, response.content)
+        return response
+
+    @staticmethod
+    def _from_cache(response: requests.Response, meta: Dict[str, Any], body: bytes) -> requests.Response:
+        """Turn a 304 into the cached 200, keeping the 304's fresh headers (rate limit, date)."""
+        response.content  # release the connection
+        headers = CaseInsensitiveDict(meta.get("headers") or {})
+        for name, value in response.headers.items():
+            if name.lower() not in _TRANSPORT_HEADERS:
+                headers[name] = value
+        headers["Content-Length"] = str(len(body))
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = headers
+        response._content = body
+        response.encoding = get_encoding_from_headers(headers)
+        return response
+
+
+class _CachingConnectionMixin:
+    """PyGithub connection whose session sends requests through the conditional cache."""
+
+    cache: ConditionalCache
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.adapter = ConditionalCacheAdapter(
+            self.cache,
+            max_retries=self.retry,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size
+        )
+        self.session.mount(f"{self.protocol}://", self.adapter)
+
+
+_cache: Optional[ConditionalCache] = None
+_connection_classes: Dict[type, type] = {}
+_lock = threading.Lock()
+
+
+def get_github_cache() -> Optional[ConditionalCache]:
+    """Process-wide cache (None when NORTHSTAR_GITHUB_CACHE=false)."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _lock:
+        if _cache is None:
+            _cache = ConditionalCache(CACHE_DIR)
+        return _cache
+
+
+def install_conditional_cache(g: Github) -> bool:
+    """
+    Route a client's requests through the conditional cache.
+
+    PyGithub has no public transport hook (injectConnectionClasses is global
+    and turns off keep-alive), so the connection class of this client's
+    requester is swapped for a caching subclass.
+
+    Returns:
+        True if installed; False when disabled or PyGithub's internals changed
+    """
+    cache = get_github_cache()
+    if cache is None:
+        return False
+    requester = g.requester
+    base = getattr(requester, "_Requester__connectionClass", None)
+    if base not in (HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass):
+        logger.warning("Unsupported PyGithub connection class; GitHub responses won't be cached")
+        return False
+    with _lock:
+        cls = _connection_classes.get(base)
+        if cls is None:
+            cls = type(f"Caching{base.__name__}", (_CachingConnectionMixin, base), {"cache": cache})
+            _connection_classes[base] = cls
+    requester._Requester__connectionClass = cls
+    return True
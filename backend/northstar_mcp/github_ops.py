@@ -1,7 +1,9 @@
 """GitHub operations for creating pull requests."""
 
 import os
-from github import Github, GithubException
+from github import GithubException
+
+from .github_pool import WRITE, github_client
 
 
 def open_pr(
@@ -36,24 +38,24 @@ def open_pr(
         )
 
     try:
-        g = Github(github_token)
-        repo = g.get_repo(repo_fullname)
+        with github_client(WRITE, github_token) as g:
+            repo = g.get_repo(repo_fullname)
 
-        # Check if PR already exists for this branch
-        existing_prs = repo.get_pulls(state="open", head=f"{repo.owner.login}:{head_branch}")
+            # Check if PR already exists for this branch
+            existing_prs = repo.get_pulls(state="open", head=f"{repo.owner.login}:{head_branch}")
 
-        for pr in existing_prs:
-            return pr.html_url
+            for pr in existing_prs:
+                return pr.html_url
 
-        # Create new PR
-        pr = repo.create_pull(
-            title=title,
-            body=body,
-            base=base_branch,
-            head=head_branch
-        )
+            # Create new PR
+            pr = repo.create_pull(
+                title=title,
+                body=body,
+                base=base_branch,
+                head=head_branch
+            )
 
-        return pr.html_url
+            return pr.html_url
 
     except GithubException as e:
         error_msg = f"GitHub API error: {e.data.get('message', str(e))}"
@@ -0,0 +1,350 @@
+"""Process-wide GitHub clients with rate-limit-aware scheduling.
+
+Building Github(token) per call means a new connection (and TLS handshake)
+for every PR, context fetch and open_pr, and nobody watching the hourly
+budget. Instead every caller borrows a client from one pool per token:
+
+    with github_client(BACKGROUND) as g:
+        repo = g.get_repo("owner/repo")
+        ...
+
+A borrowed client is used by one thread at a time (PyGithub's keep-alive
+connection is not safe to share between threads) and goes back to the pool
+afterwards, connection still open. Worker threads borrow their own client.
+GET responses are revalidated with ETags (github_cache.py), so repeated
+reads of unchanged listings and files come back as 304s that cost no quota.
+
+Every request is admitted by a scheduler before it is sent. PyGithub records
+X-RateLimit-Remaining/-Reset from each response; the scheduler keeps the
+lowest figure seen across clients for the current window and holds requests
+back by priority (set with github_priority() or github_client(priority)):
+
+- WRITE (branches, commits, PRs): always sent
+- INTERACTIVE (default, reads a user waits on): held once the budget drops
+  to the interactive reserve
+- BACKGROUND (context crawls): held once the budget drops to the background
+  reserve, leaving the rest for user-visible work
+
+A held request waits for the window to reset if that is only a few seconds
+away (never on the event loop thread), otherwise it fails with
+GitHubBudgetExhausted so crawls degrade to partial context instead of
+spending the budget PR creation needs.
+
+Configuration:
+    GITHUB_TOKEN                                - token used by github_client()
+    GITHUB_API_URL                              - API root (default https://api.github.com)
+    NORTHSTAR_GITHUB_POOL_SIZE                  - idle clients kept per token (default 8)
+    NORTHSTAR_GITHUB_BACKGROUND_RESERVE         - remaining requests below which background reads are held (default 500)
+    NORTHSTAR_GITHUB_INTERACTIVE_RESERVE        - remaining requests below which interactive reads are held (default 100)
+    NORTHSTAR_GITHUB_BACKGROUND_MAX_WAIT_SECONDS  - longest a held background read waits for the reset (default 5)
+    NORTHSTAR_GITHUB_INTERACTIVE_MAX_WAIT_SECONDS - longest a held interactive read waits for the reset (default 30)
+    NORTHSTAR_GITHUB_WRITE_SPACING_SECONDS      - minimum gap between writes on one client (default 0.25)
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from github import Auth, Github
+
+from .github_cache import get_github_cache, install_conditional_cache
+
+logger = logging.getLogger(__name__)
+
+
+WRITE = "write"
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (WRITE, INTERACTIVE, BACKGROUND)
+
+DEFAULT_API_URL = "https://api.github.com"
+DEFAULT_POOL_SIZE = int(os.getenv("NORTHSTAR_GITHUB_POOL_SIZE", "8"))
+DEFAULT_RESERVES = {
+    WRITE: 0,
+    INTERACTIVE: int(os.getenv("NORTHSTAR_GITHUB_INTERACTIVE_RESERVE", "100")),
+    BACKGROUND: int(os.getenv("NORTHSTAR_GITHUB_BACKGROUND_RESERVE", "500")),
+}
+DEFAULT_MAX_WAITS = {
+    WRITE: 0.0,
+    INTERACTIVE: float(os.getenv("NORTHSTAR_GITHUB_INTERACTIVE_MAX_WAIT_SECONDS", "30")),
+    BACKGROUND: float(os.getenv("NORTHSTAR_GITHUB_BACKGROUND_MAX_WAIT_SECONDS", "5")),
+}
+WRITE_SPACING = float(os.getenv("NORTHSTAR_GITHUB_WRITE_SPACING_SECONDS", "0.25"))
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("northstar_github_priority", default=INTERACTIVE)
+
+
+class GitHubBudgetExhausted(Exception):
+    """The rate-limit budget left is reserved for higher-priority requests."""
+
+
+@contextlib.contextmanager
+def github_priority(priority: str) -> Iterator[None]:
+    """Run GitHub requests made inside the block (in this context) at the given priority."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"unknown GitHub priority: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class RateLimitScheduler:
+    """Admits GitHub requests against the remaining rate-limit budget, by priority."""
+
+    def __init__(
+        self,
+        reserves: Optional[Dict[str, int]] = None,
+        max_waits: Optional[Dict[str, float]] = None
+    ):
+        """
+        Args:
+            reserves: priority -> remaining requests at or below which it is held
+            max_waits: priority -> seconds a held request may wait for the reset
+        """
+        self.reserves = {**DEFAULT_RESERVES, **(reserves or {})}
+        self.max_waits = {**DEFAULT_MAX_WAITS, **(max_waits or {})}
+        self.remaining: Optional[int] = None
+        self.limit: Optional[int] = None
+        self.reset_at = 0.0
+        # Requests sent since the last observation (not yet reflected in remaining)
+        self._in_window = 0
+        self._cond = threading.Condition()
+        self.counts = {p: {"admitted": 0, "waited": 0, "rejected": 0} for p in PRIORITIES}
+
+    def observe(self, remaining: int, limit: int, reset_at: float) -> None:
+        """
+        Record the rate-limit headers of a response.
+
+        Within one window the lowest remaining count wins (clients report
+        responses out of order); a later reset time starts a new window.
+        """
+        if remaining < 0 or limit <= 0:
+            return
+        with self._cond:
+            if self.remaining is None or reset_at > self.reset_at:
+                pass
+            elif reset_at == self.reset_at and remaining < self.remaining:
+                pass
+            else:
+                return
+            self.remaining, self.limit, self.reset_at = remaining, limit, float(reset_at)
+            self._in_window = 0
+            self._cond.notify_all()
+
+    def estimated_remaining(self) -> Optional[int]:
+        if self.remaining is None:
+            return None
+        if self.reset_at and time.time() >= self.reset_at:
+            # The window has reset since the last response
+            return self.limit
+        return self.remaining - self._in_window
+
+    def admit(self, priority: Optional[str] = None) -> None:
+        """
+        Block until a request at this priority may be sent.
+
+        Raises:
+            GitHubBudgetExhausted: The budget is held for higher priorities and
+                the window doesn't reset within this priority's maximum wait
+        """
+        priority = priority or current_priority()
+        waited = False
+        with self._cond:
+            while True:
+                remaining = self.estimated_remaining()
+                if remaining is None or remaining > self.reserves[priority] or priority == WRITE:
+                    self._in_window += 1
+                    self.counts[priority]["admitted"] += 1
+                    return
+
+                until_reset = self.reset_at - time.time()
+                max_wait = 0.0 if _on_event_loop() else self.max_waits[priority]
+                if until_reset > max_wait:
+                    self.counts[priority]["rejected"] += 1
+                    raise GitHubBudgetExhausted(
+                        f"GitHub rate limit nearly used up ({remaining}/{self.limit} left); "
+                        f"the rest is reserved for higher-priority requests until "
+                        f"{time.strftime('%H:%M:%S', time.localtime(self.reset_at))}"
+                    )
+                if not waited:
+                    waited = True
+                    self.counts[priority]["waited"] += 1
+                    logger.info(f"Holding {priority} GitHub request for {until_reset:.1f}s until the rate limit resets")
+                self._cond.wait(max(until_reset, 0.05))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "remaining": self.estimated_remaining(),
+                "limit": self.limit,
+                "reset_in_seconds": max(0.0, round(self.reset_at - time.time(), 1)) if self.reset_at else None,
+                "reserves": dict(self.reserves),
+                "requests": {p: dict(c) for p, c in self.counts.items()}
+            }
+
+
+class _ScheduledToken(Auth.Token, Auth.WithRequester["_ScheduledToken"]):
+    """Token auth that passes every request through the scheduler (PyGithub calls authentication() per request)."""
+
+    def __init__(self, token: str, scheduler: RateLimitScheduler):
+        Auth.Token.__init__(self, token)
+        Auth.WithRequester.__init__(self)
+        self.scheduler = scheduler
+
+    def authentication(self, headers: dict) -> None:
+        requester = self.requester
+        if requester is not None:
+            remaining, limit = requester.rate_limiting
+            self.scheduler.observe(remaining, limit, requester.rate_limiting_resettime)
+        self.scheduler.admit()
+        super().authentication(headers)
+
+
+class GitHubPool:
+    """Reusable keep-alive Github clients for one token, sharing one scheduler."""
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = DEFAULT_API_URL,
+        size: int = DEFAULT_POOL_SIZE,
+        scheduler: Optional[RateLimitScheduler] = None
+    ):
+        """
+        Args:
+            token: GitHub token
+            base_url: API root (GitHub Enterprise or a local stand-in)
+            size: Idle clients kept for reuse (more are created when all are busy)
+            scheduler: Shared rate-limit scheduler (one per token)
+        """
+        self.token = token
+        self.base_url = base_url
+        self.size = max(1, size)
+        self.scheduler = scheduler or RateLimitScheduler()
+        self._idle: List[Github] = []
+        self._lock = threading.Lock()
+        self.counts = {"created": 0, "reused": 0, "discarded": 0, "in_use": 0}
+
+    def _create(self) -> Github:
+        self.counts["created"] += 1
+        g = Github(
+            auth=_ScheduledToken(self.token, self.scheduler),
+            base_url=self.base_url,
+            # Reads are paced by the rate-limit scheduler rather than a fixed gap
+            seconds_between_requests=None,
+            seconds_between_writes=WRITE_SPACING or None
+        )
+        install_conditional_cache(g)
+        return g
+
+    @contextlib.contextmanager
+    def client(self, priority: Optional[str] = None) -> Iterator[Github]:
+        """
+        Borrow a client for the duration of the block (never blocks: a new
+        client is created when none is idle).
+
+        Args:
+            priority: Priority for the requests made inside the block
+                (default: the surrounding github_priority(), else INTERACTIVE)
+        """
+        with self._lock:
+            if self._idle:
+                g = self._idle.pop()
+                self.counts["reused"] += 1
+            else:
+                g = None
+            self.counts["in_use"] += 1
+        if g is None:
+            g = self._create()
+        try:
+            with github_priority(priority) if priority else contextlib.nullcontext():
+                yield g
+        finally:
+            with self._lock:
+                self.counts["in_use"] -= 1
+                keep = len(self._idle) < self.size
+                if keep:
+                    self._idle.append(g)
+                else:
+                    self.counts["discarded"] += 1
+            if not keep:
+                g.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "size": self.size,
+            "idle": len(self._idle),
+            **self.counts,
+            "rate_limit": self.scheduler.stats()
+        }
+
+
+_pools: Dict[Tuple[str, str], GitHubPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_github_pool(token: Optional[str] = None, base_url: Optional[str] = None) -> Optional[GitHubPool]:
+    """
+    Process-wide pool for a token and API root.
+
+    Args:
+        token: GitHub token (default: GITHUB_TOKEN)
+        base_url: API root (default: GITHUB_API_URL, else api.github.com)
+
+    Returns:
+        The pool, or None when no token is configured
+    """
+    token = token or os.getenv("GITHUB_TOKEN")
+    if not token:
+        return None
+    base_url = base_url or os.getenv("GITHUB_API_URL") or DEFAULT_API_URL
+    with _pools_lock:
+        pool = _pools.get((token, base_url))
+        if pool is None:
+            pool = _pools[(token, base_url)] = GitHubPool(token, base_url)
+        return pool
+
+
+def github_client(
+    priority: Optional[str] = None,
+    token: Optional[str] = None,
+    base_url: Optional[str] = None
+) -> "contextlib.AbstractContextManager[Github]":
+    """
+    Borrow a client from the process-wide pool (see GitHubPool.client).
+
+    Raises:
+        ValueError: No GitHub token is configured
+    """
+    pool = get_github_pool(token, base_url)
+    if pool is None:
+        raise ValueError("GITHUB_TOKEN not set")
+    return pool.client(priority)
+
+
+def github_stats() -> Dict[str, Any]:
+    """Stats of every pool created in this process (tokens are not included) and of the response cache."""
+    cache = get_github_cache()
+    with _pools_lock:
+        pools = [pool.stats() for pool in _pools.values()]
+    return {"pools": pools, "cache": cache.stats() if cache else None}
@@ -1,8 +1,77 @@
-"""Morph API client for Fast Apply code merging."""
+"""Morph API client for Fast Apply code merging.
 
+One MorphClient is shared by every caller (see get_morph_client()):
+- a keep-alive requests.Session, so merges reuse pooled connections instead
+  of a new TLS handshake per call
+- retries with full-jitter exponential backoff on timeouts, connection
+  errors, 429 and 5xx (Retry-After is honoured)
+- a circuit breaker: after several consecutive failed attempts calls fail
+  fast with MorphCircuitOpen for a cooldown, then one trial call is let through
+- inside a backend request, each attempt's timeout is cut to the time left
+  before the request's deadline (deadlines.py), and no retry starts once
+  the deadline has passed
+- a result cache keyed by hash(instruction, initial_code, update_block), in
+  memory and on disk under the cache directory, so re-running or retrying an
+  experiment never pays for the same merge twice
+
+merge_code() (sync) and merge_code_async() (runs on a worker thread) are the
+entry points.
+
+Configuration:
+    MORPH_API_KEY                    - required
+    MORPH_BASE_URL                   - API base URL (default https://api.morphllm.com/v1)
+    MORPH_TIMEOUT_SECONDS            - read timeout per attempt (default 30)
+    MORPH_MAX_RETRIES                - retries after the first attempt (default 3)
+    MORPH_CIRCUIT_FAILURES           - consecutive failed attempts that open the circuit (default 5)
+    MORPH_CIRCUIT_COOLDOWN_SECONDS   - how long an open circuit fails fast (default 30)
+    MORPH_CACHE_MAX_ENTRIES          - merges kept in memory (default 256)
+    MORPH_DISK_CACHE                 - "false" to keep the cache in memory only
+    MORPH_DISK_CACHE_MAX_MB          - disk space used by cached merges (default 64)
+    NORTHSTAR_CACHE_DIR              - disk cache location (morph/ below it)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+
+try:
+    # Running inside the backend: attempts follow the request's deadline
+    from deadlines import current_deadline, deadline_timeout
+except ImportError:  # standalone MCP server, no request deadlines
+    def current_deadline():
+        return None
+
+    def deadline_timeout(default: float, minimum: float = 1.0) -> float:
+        return default
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TIMEOUT = float(os.getenv("MORPH_TIMEOUT_SECONDS", "30"))
+DEFAULT_MAX_RETRIES = int(os.getenv("MORPH_MAX_RETRIES", "3"))
+DEFAULT_CIRCUIT_FAILURES = int(os.getenv("MORPH_CIRCUIT_FAILURES", "5"))
+DEFAULT_CIRCUIT_COOLDOWN = float(os.getenv("MORPH_CIRCUIT_COOLDOWN_SECONDS", "30"))
+DEFAULT_CACHE_MAX_ENTRIES = int(os.getenv("MORPH_CACHE_MAX_ENTRIES", "256"))
+DISK_CACHE_ENABLED = os.getenv("MORPH_DISK_CACHE", "true").lower() == "true"
+DISK_CACHE_MAX_BYTES = int(float(os.getenv("MORPH_DISK_CACHE_MAX_MB", "64")) * 1024 * 1024)
+CACHE_DIR = Path(os.getenv("NORTHSTAR_CACHE_DIR", "~/.cache/northstar")).expanduser() / "morph"
+
+MODEL = "morph-v3-fast"
+CONNECT_TIMEOUT = 5.0
+POOL_SIZE = 16
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10.0
 
 
 class MorphAPIError(Exception):
@@ -10,82 +79,442 @@ class MorphAPIError(Exception):
     pass
 
 
-def merge_code(instruction: str, initial_code: str, update_block: str) -> str:
+class MorphCircuitOpen(MorphAPIError):
+    """Morph failed repeatedly; calls fail fast until the cooldown ends."""
+
+
+class _RetryableError(MorphAPIError):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def cache_key(instruction: str, initial_code: str, update_block: str) -> str:
+    """Hash identifying a merge request (the model is part of the key)."""
+    payload = json.dumps([MODEL, instruction, initial_code, update_block])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt: int, error: _RetryableError) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when given."""
+    if error.retry_after is not None:
+        return min(error.retry_after, RETRY_MAX_DELAY) + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class _CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open (one trial call) after the cooldown."""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def before_attempt(self) -> None:
+        """Raise MorphCircuitOpen unless an attempt may go out now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise MorphCircuitOpen(
+                    f"Morph API circuit is open after {self.failures} consecutive failures; "
+                    f"retry in {remaining:.0f}s"
+                )
+            if self.trial_in_flight:
+                raise MorphCircuitOpen("Morph API circuit is half-open and a trial call is in flight")
+            self.trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Morph API recovered; closing circuit")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            half_open_trial = self.trial_in_flight
+            self.trial_in_flight = False
+            if half_open_trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                logger.warning(
+                    f"Morph API failed {self.failures} times in a row; "
+                    f"failing fast for {self.cooldown:.0f}s"
+                )
+
+
+class _MergeCache:
     """
-    Merge code using Morph's Fast Apply API.
+    LRU of merged code in memory, backed by one file per key on disk.
 
-    Args:
-        instruction: Natural language description of the changes
-        initial_code: Current file contents
-        update_block: Fast Apply format update with '// ... existing code ...' markers
+    The disk entries are LRU-evicted too once they exceed max_bytes (recency
+    survives restarts as the files' mtimes).
+    """
 
-    Returns:
-        Merged code as a string
+    def __init__(self, max_entries: int, directory: Optional[Path], max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_bytes = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
 
-    Raises:
-        MorphAPIError: If API call fails or returns invalid response
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _disk_index(self) -> "OrderedDict[str, int]":
+        # Called with the lock held; entries from earlier runs, oldest use first
+        if self._disk is None:
+            found = []
+            if self.directory.is_dir():
+                for path in self.directory.glob("??/*.json"):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path.stem, stat.st_size))
+            found.sort()
+            self._disk = OrderedDict((key, size) for _, key, size in found)
+            self._disk_bytes = sum(self._disk.values())
+        return self._disk
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            if self.directory is None:
+                return None
+            index = self._disk_index()
+            if key not in index:
+                return None
+            index.move_to_end(key)
+        path = self._path(key)
+        try:
+            merged = json.loads(path.read_text(encoding="utf-8"))["merged"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._disk_bytes -= self._disk_index().pop(key, 0)
+            return None
+        self._remember(key, merged)
+        return merged
+
+    def put(self, key: str, merged: str) -> None:
+        self._remember(key, merged)
+        if self.directory is None:
+            return
+        data = json.dumps({"merged": merged, "model": MODEL}).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except OSError as e:
+            logger.warning(f"Could not write Morph cache entry: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            index = self._disk_index()
+            self._disk_bytes += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            while self._disk_bytes > self.max_bytes and len(index) > 1:
+                old, size = index.popitem(last=False)
+                self._disk_bytes -= size
+                self.evicted += 1
+                evicted.append(old)
+        for old in evicted:
+            try:
+                self._path(old).unlink()
+            except OSError:
+                pass
+
+    def disk_stats(self) -> Optional[Dict[str, Any]]:
+        if self.directory is None:
+            return None
+        with self._lock:
+            index = self._disk_index()
+            return {
+                "directory": str(self.directory),
+                "entries": len(index),
+                "bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+                "evicted": self.evicted
+            }
+
+    def _remember(self, key: str, merged: str) -> None:
+        with self._lock:
+            self._entries[key] = merged
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MorphClient:
     """
-    api_key = os.getenv("MORPH_API_KEY")
-    base_url = os.getenv("MORPH_BASE_URL", "https://api.morphllm.com/v1")
+    Pooled, retrying, caching Fast Apply client.
 
-    if not api_key:
-        raise MorphAPIError(
-            "MORPH_API_KEY not found in environment. "
-            "Please set it in your .env file or environment variables."
+    Example:
+        client = get_morph_client()
+        merged = client.merge(instruction, initial_code, update_block)
+        merged = await client.merge_async(instruction, initial_code, update_block)
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        circuit_failures: int = DEFAULT_CIRCUIT_FAILURES,
+        circuit_cooldown: float = DEFAULT_CIRCUIT_COOLDOWN,
+        cache_max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+        cache_dir: Optional[Path] = CACHE_DIR if DISK_CACHE_ENABLED else None
+    ):
+        """
+        Args:
+            api_key: Morph API key (default MORPH_API_KEY, read at call time)
+            base_url: API base URL (default MORPH_BASE_URL)
+            timeout: Read timeout per attempt in seconds
+            max_retries: Retries after the first attempt
+            circuit_failures: Consecutive failed attempts that open the circuit
+            circuit_cooldown: Seconds an open circuit fails fast
+            cache_max_entries: Merges kept in memory
+            cache_dir: Disk cache directory (None for memory only)
+        """
+        self._api_key = api_key
+        self._base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = _CircuitBreaker(circuit_failures, circuit_cooldown)
+        self.cache = _MergeCache(cache_max_entries, cache_dir)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "cache_hits": 0, "api_calls": 0, "retries": 0, "failures": 0, "fast_failures": 0}
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return self._api_key or os.getenv("MORPH_API_KEY")
+
+    @property
+    def base_url(self) -> str:
+        return self._base_url or os.getenv("MORPH_BASE_URL", "https://api.morphllm.com/v1")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def merge(self, instruction: str, initial_code: str, update_block: str) -> str:
+        """
+        Merge code using Morph's Fast Apply API.
+
+        Args:
+            instruction: Natural language description of the changes
+            initial_code: Current file contents
+            update_block: Fast Apply format update with '// ... existing code ...' markers
+
+        Returns:
+            Merged code as a string
+
+        Raises:
+            MorphAPIError: If the API call fails after retries or returns an invalid response
+            MorphCircuitOpen: Morph is failing and the call was not attempted
+        """
+        self._count("calls")
+        key = cache_key(instruction, initial_code, update_block)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("cache_hits")
+            logger.info("Morph merge served from cache")
+            return cached
+
+        if not self.api_key:
+            raise MorphAPIError(
+                "MORPH_API_KEY not found in environment. "
+                "Please set it in your .env file or environment variables."
+            )
+
+        content = (
+            f"<instruction>{instruction}</instruction>\n"
+            f"<code>{initial_code}</code>\n"
+            f"<update>{update_block}</update>"
         )
+        payload = {
+            "model": MODEL,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ]
+        }
 
-    # Construct the user message content in Morph Fast Apply format
-    content = (
-        f"<instruction>{instruction}</instruction>\n"
-        f"<code>{initial_code}</code>\n"
-        f"<update>{update_block}</update>"
-    )
-
-    # Prepare API request
-    url = f"{base_url}/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "morph-v3-fast",
-        "messages": [
-            {
-                "role": "user",
-                "content": content
-            }
-        ]
-    }
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_attempt()
+            except MorphCircuitOpen:
+                self._count("fast_failures")
+                raise
+            try:
+                self._count("api_calls")
+                merged = self._post(payload)
+            except _RetryableError as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or self.breaker.state != "closed":
+                    self._count("failures")
+                    raise MorphAPIError(f"{e} (after {attempt + 1} attempts)")
+                delay = _backoff_delay(attempt, e)
+                deadline = current_deadline()
+                if deadline is not None and deadline.remaining() <= delay:
+                    self._count("failures")
+                    raise MorphAPIError(f"{e} (after {attempt + 1} attempts; the request's deadline leaves no time to retry)")
+                attempt += 1
+                self._count("retries")
+                logger.warning(f"Morph API attempt {attempt} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except MorphAPIError:
+                # The API answered, so it is healthy; the request itself is bad
+                self.breaker.record_success()
+                self._count("failures")
+                raise
+            self.breaker.record_success()
+            self.cache.put(key, merged)
+            return merged
 
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-    except requests.exceptions.Timeout:
-        raise MorphAPIError("Request to Morph API timed out after 30 seconds")
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Morph API request failed: {str(e)}"
+    async def merge_async(self, instruction: str, initial_code: str, update_block: str) -> str:
+        """merge() on a worker thread, sharing the session, breaker and cache."""
+        return await asyncio.to_thread(self.merge, instruction, initial_code, update_block)
+
+    def _post(self, payload: Dict[str, Any]) -> str:
+        """One attempt. Raises _RetryableError for transient failures, MorphAPIError otherwise."""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        timeout = deadline_timeout(self.timeout)
         try:
-            error_detail = response.json()
-            error_msg += f"\nAPI response: {error_detail}"
-        except:
-            error_msg += f"\nStatus code: {response.status_code}"
-        raise MorphAPIError(error_msg)
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
+                json=payload,
+                headers=headers,
+                timeout=(min(CONNECT_TIMEOUT, timeout), timeout)
+            )
+        except requests.exceptions.Timeout:
+            raise _RetryableError(f"Request to Morph API timed out after {timeout:.0f} seconds")
+        except requests.exceptions.RequestException as e:
+            raise _RetryableError(f"Morph API request failed: {str(e)}")
 
-    # Parse response
-    try:
-        data = response.json()
-        merged_code = data["choices"][0]["message"]["content"]
+        if response.status_code == 429 or response.status_code >= 500:
+            raise _RetryableError(
+                f"Morph API returned {response.status_code}",
+                retry_after=_retry_after(response)
+            )
+        if response.status_code >= 400:
+            error_msg = f"Morph API request failed: {response.status_code}"
+            try:
+                error_msg += f"\nAPI response: {response.json()}"
+            except ValueError:
+                error_msg += f"\nResponse: {response.text[:500]}"
+            raise MorphAPIError(error_msg)
+
+        # Parse response
+        try:
+            data = response.json()
+            merged_code = data["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise MorphAPIError(
+                f"Unexpected Morph API response format: {str(e)}\n"
+                f"Response: {response.text[:500]}"
+            )
 
         if not merged_code or not merged_code.strip():
             raise MorphAPIError(
                 "Morph API returned empty content. "
                 f"Full response: {data}"
             )
-
         return merged_code
 
-    except (KeyError, IndexError) as e:
-        raise MorphAPIError(
-            f"Unexpected Morph API response format: {str(e)}\n"
-            f"Response: {data if 'data' in locals() else 'Unable to parse'}"
-        )
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "circuit_opened": self.breaker.times_opened,
+            "cached_merges": len(self.cache),
+            "disk_cache": self.cache.disk_stats(),
+            **counts
+        }
+
+
+_client: Optional[MorphClient] = None
+_client_lock = threading.Lock()
+
+
+def get_morph_client() -> MorphClient:
+    """The process-wide MorphClient."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MorphClient()
+        return _client
+
+
+def merge_code(instruction: str, initial_code: str, update_block: str) -> str:
+    """
+    Merge code using Morph's Fast Apply API (see MorphClient.merge).
+
+    Args:
+        instruction: Natural language description of the changes
+        initial_code: Current file contents
+        update_block: Fast Apply format update with '// ... existing code ...' markers
+
+    Returns:
+        Merged code as a string
+
+    Raises:
+        MorphAPIError: If API call fails or returns invalid response
+    """
+    return get_morph_client().merge(instruction, initial_code, update_block)
+
+
+async def merge_code_async(instruction: str, initial_code: str, update_block: str) -> str:
+    """Async merge_code(), for callers on the event loop."""
+    return await get_morph_client().merge_async(instruction, initial_code, update_block)
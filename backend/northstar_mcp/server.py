@@ -7,10 +7,10 @@ from mcp.server import Server
 from mcp.types import Tool, TextContent
 import mcp.server.stdio
 
-from .morph_client import merge_code, MorphAPIError
+from .change_set import split_update_block, merge_change_set, combined_diff, resolve_in_repo
 from .git_ops import clone_repo, ensure_branch, create_commit_and_push, cleanup_repo
 from .github_ops import open_pr
-from .utils import slugify, unified_diff, format_pr_body
+from .utils import slugify, format_pr_body
 
 
 # Initialize MCP server
@@ -52,6 +52,12 @@ async def list_tools() -> list[Tool]:
                         "type": "string",
                         "description": "Path to file to modify (optional, uses env default)"
                     },
+                    "file_paths": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "All files to modify, for a change spanning several files; "
+                                       "update_block then starts each file's part with '=== path ==='"
+                    },
                     "base_branch": {
                         "type": "string",
                         "description": "Base branch to merge into (default: main)"
@@ -76,6 +82,7 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
             update_block=arguments["update_block"],
             repo=arguments.get("repo"),
             file_path=arguments.get("file_path"),
+            file_paths=arguments.get("file_paths"),
             base_branch=arguments.get("base_branch", "main")
         )
 
@@ -160,16 +167,21 @@ async def execute_code_change(
     update_block: str,
     repo: str | None = None,
     file_path: str | None = None,
+    file_paths: list[str] | None = None,
     base_branch: str = "main"
 ) -> list[TextContent]:
     """
     Execute a code change using Morph Fast Apply and create a GitHub PR.
 
+    Every file of a multi-file change is merged concurrently and the result
+    is pushed as one commit with one PR.
+
     Args:
         instruction: Natural language description of the change
         update_block: Fast Apply format code snippet
         repo: Repository name (owner/repo) - uses TARGET_REPO env if not provided
         file_path: Path to file to modify - uses TARGET_FILE env if not provided
+        file_paths: All files to modify (update_block split by "=== path ===" headers)
         base_branch: Base branch to merge into (default: main)
 
     Returns:
@@ -177,7 +189,7 @@ async def execute_code_change(
     """
     # Use env vars as defaults
     target_repo = repo or os.getenv("TARGET_REPO")
-    target_file = file_path or os.getenv("TARGET_FILE")
+    target_files = file_paths or [file_path or os.getenv("TARGET_FILE")]
 
     if not target_repo:
         return [TextContent(
@@ -185,7 +197,7 @@ async def execute_code_change(
             text="Error: TARGET_REPO not set in environment and not provided as argument"
         )]
 
-    if not target_file:
+    if not target_files[0]:
         return [TextContent(
             type="text",
             text="Error: TARGET_FILE not set in environment and not provided as argument"
@@ -196,36 +208,35 @@ async def execute_code_change(
         # Clone repository
         repo_path = clone_repo(target_repo)
 
-        # Read current file
-        file_full_path = repo_path / target_file
-        if not file_full_path.exists():
-            return [TextContent(
-                type="text",
-                text=f"Error: File {target_file} not found in repository"
-            )]
-
-        current_content = file_full_path.read_text(encoding='utf-8')
+        def read_file(path: str) -> str | None:
+            full_path = resolve_in_repo(repo_path, path)
+            return full_path.read_text(encoding='utf-8') if full_path.is_file() else None
 
-        # Call Morph API to merge code
-        try:
-            merged_content = merge_code(instruction, current_content, update_block)
-        except MorphAPIError as e:
+        # Merge every file's update block concurrently (locally when unambiguous, otherwise via Morph)
+        blocks = split_update_block(update_block, target_files)
+        changes = merge_change_set(instruction, blocks, read_file)
+        failed = [change for change in changes if change.error]
+        if failed:
             return [TextContent(
                 type="text",
-                text=f"Morph API Error: {str(e)}"
+                text="Merge Error: " + "; ".join(f"{change.path}: {change.error}" for change in failed)
             )]
 
         # Generate diff
-        diff = unified_diff(current_content, merged_content, target_file)
+        diff = combined_diff(changes)
+        modified = [change for change in changes if change.changed]
 
-        if not diff:
+        if not modified:
             return [TextContent(
                 type="text",
                 text="No changes detected - merged code is identical to original"
             )]
 
         # Write merged content
-        file_full_path.write_text(merged_content, encoding='utf-8')
+        for change in modified:
+            full_path = resolve_in_repo(repo_path, change.path)
+            full_path.parent.mkdir(parents=True, exist_ok=True)
+            full_path.write_text(change.merged, encoding='utf-8')
 
         # Git operations
         git_repo = Repo(repo_path)
@@ -238,7 +249,7 @@ async def execute_code_change(
 
         # Create PR
         pr_title = f"Northstar Experiment: {instruction}"
-        pr_body = format_pr_body(instruction, target_file, diff)
+        pr_body = format_pr_body(instruction, [change.path for change in modified], diff)
         pr_url = open_pr(target_repo, final_branch, base_branch, pr_title, pr_body)
 
         # Success
@@ -246,8 +257,9 @@ async def execute_code_change(
             "status": "success",
             "pr_url": pr_url,
             "branch": final_branch,
-            "files_modified": [target_file],
-            "diff_summary": f"{len(diff.splitlines())} lines changed"
+            "files_modified": [change.path for change in modified],
+            "diff_summary": f"{len(diff.splitlines())} lines changed",
+            "changes": [change.to_dict() for change in changes]
         }
 
         import json
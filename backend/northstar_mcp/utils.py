@@ -3,7 +3,7 @@
 import re
 import difflib
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Union
 
 
 def slugify(text: str) -> str:
@@ -47,8 +47,8 @@ def unified_diff(original: str, modified: str, filename: str = "file") -> str:
     Returns:
         Unified diff as a string
     """
-    original_lines = original.splitlines(keepends=True)
-    modified_lines = modified.splitlines(keepends=True)
+    original_lines = original.splitlines()
+    modified_lines = modified.splitlines()
 
     diff = difflib.unified_diff(
         original_lines,
@@ -58,16 +58,16 @@ def unified_diff(original: str, modified: str, filename: str = "file") -> str:
         lineterm=''
     )
 
-    return ''.join(diff)
+    return '\n'.join(diff)
 
 
-def format_pr_body(instruction: str, file_path: str, diff: str) -> str:
+def format_pr_body(instruction: str, file_path: Union[str, List[str]], diff: str) -> str:
     """
     Format the pull request body with instruction, file info, and diff.
 
     Args:
         instruction: The instruction describing the change
-        file_path: Path to the modified file
+        file_path: Path to the modified file, or the paths of several files
         diff: Unified diff of changes
 
     Returns:
@@ -82,13 +82,16 @@ def format_pr_body(instruction: str, file_path: str, diff: str) -> str:
     else:
         truncated_diff = diff
 
+    file_paths = [file_path] if isinstance(file_path, str) else file_path
+    files = f"`{file_paths[0]}`" if len(file_paths) == 1 else "\n".join(f"- `{path}`" for path in file_paths)
+
     body = f"""## Instruction
 
 {instruction}
 
-## Modified File
+## Modified File{"s" if len(file_paths) > 1 else ""}
 
-`{file_path}`
+{files}
 
 ## Changes
 
@@ -1,26 +1,161 @@
-"""Direct PR creation helper (workaround for MCP issues)."""
+"""Direct PR creation helper (workaround for MCP issues).
 
+Changes are written with the Git Data API instead of the contents API: one
+tree, one commit and one ref. File contents travel inside the tree request
+(GitHub creates their blobs); only large files get their own blobs, created
+concurrently first. The branch only appears once the commit exists, so a
+failure part way leaves nothing behind, and any number of files costs the
+same handful of round trips. The PR is opened last; if that fails the branch
+is deleted again.
+
+Clients come from the process-wide pool (northstar_mcp.github_pool) and run at
+WRITE priority, so PR creation keeps working when context crawls have used up
+most of the rate-limit budget.
+"""
+
+import contextlib
+import logging
 import os
 import time
-from github import Github
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from github import UnknownObjectException
+from github.InputGitTreeElement import InputGitTreeElement
 from dotenv import load_dotenv
 
+from metrics import time_dependency
+from northstar_mcp.change_set import split_update_block, merge_change_set, combined_diff
+from northstar_mcp.fast_apply import apply_update
+from northstar_mcp.github_pool import WRITE, get_github_pool
+from northstar_mcp.morph_client import MorphAPIError
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# GitHub Enterprise (or a local stand-in) instead of github.com
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+# Files up to this size are sent inline in the tree request; larger ones
+# are uploaded as blobs first, concurrently
+INLINE_MAX_BYTES = 256 * 1024
+MAX_BLOB_WORKERS = 8
+
+FILE_MODE = "100644"
+
+
+class NoChanges(Exception):
+    """The staged files are identical to the base branch."""
+
+
+class CommitBuilder:
+    """
+    Stages file changes and writes them as a single commit on top of a branch.
+
+    Example:
+        builder = CommitBuilder(repo, repo.get_branch("main").commit.commit)
+        builder.set_file("src/App.js", new_source)
+        builder.delete_file("src/old.css")
+        commit = builder.commit("feat: new checkout button")
+    """
+
+    def __init__(self, repo, base_commit, borrow_repo: Optional[Callable[[], ContextManager]] = None):
+        """
+        Args:
+            repo: PyGithub Repository (may be lazy)
+            base_commit: PyGithub GitCommit the commit is based on (its parent)
+            borrow_repo: Returns a context manager yielding the repository on a
+                client of its own, for uploading blobs from worker threads (a
+                PyGithub client is not shared between threads); without it
+                blobs are uploaded one at a time
+        """
+        self.repo = repo
+        self.base_commit = base_commit
+        self.borrow_repo = borrow_repo
+        self.files: Dict[str, Optional[str]] = {}
+
+    def set_file(self, path: str, content: str) -> None:
+        """Create or replace a file."""
+        self.files[path] = content
+
+    def delete_file(self, path: str) -> None:
+        """Remove a file."""
+        self.files[path] = None
+
+    def _blob_sha(self, content: str) -> str:
+        if self.borrow_repo is None:
+            return self.repo.create_git_blob(content, "utf-8").sha
+        with self.borrow_repo() as repo:
+            return repo.create_git_blob(content, "utf-8").sha
+
+    @time_dependency("github", "commit_files")
+    def commit(self, message: str):
+        """
+        Create the tree (and blobs for large files) and the commit. No ref is touched.
+
+        Args:
+            message: Commit message
+
+        Returns:
+            PyGithub GitCommit
+
+        Raises:
+            NoChanges: The resulting tree equals the base commit's tree
+        """
+        if not self.files:
+            raise NoChanges("no files staged")
+
+        large = {
+            path: content for path, content in self.files.items()
+            if content is not None and len(content.encode("utf-8")) > INLINE_MAX_BYTES
+        }
+        shas: Dict[str, str] = {}
+        if large:
+            workers = MAX_BLOB_WORKERS if self.borrow_repo else 1
+            with ThreadPoolExecutor(max_workers=min(workers, len(large))) as pool:
+                shas = dict(zip(large, pool.map(self._blob_sha, large.values())))
+
+        elements: List[InputGitTreeElement] = []
+        for path in sorted(self.files):
+            content = self.files[path]
+            if path in shas:
+                elements.append(InputGitTreeElement(path, FILE_MODE, "blob", sha=shas[path]))
+            elif content is not None:
+                elements.append(InputGitTreeElement(path, FILE_MODE, "blob", content=content))
+            else:
+                # sha=None removes the path from the base tree
+                elements.append(InputGitTreeElement(path, FILE_MODE, "blob", sha=None))
+        base_commit = self.base_commit
+        tree = self.repo.create_git_tree(elements, base_commit.tree)
+        if tree.sha == base_commit.tree.sha:
+            raise NoChanges("the changes are already on the base branch")
+        return self.repo.create_git_commit(message, tree, [base_commit])
+
+
 class PRCreator:
     """Helper class to create GitHub PRs directly."""
 
     def __init__(self):
         self.github_token = os.getenv("GITHUB_TOKEN")
-        self.g = Github(self.github_token) if self.github_token else None
+        self.pool = get_github_pool(self.github_token, GITHUB_API_URL)
+
+    @contextlib.contextmanager
+    def _repo(self, repo_fullname: str):
+        """A lazy repository on a pooled client, at WRITE priority."""
+        with self.pool.client(WRITE) as g:
+            yield g.get_repo(repo_fullname, lazy=True)
 
+    @time_dependency("github")
     def create_pr(
         self,
         repo_fullname: str,
         instruction: str,
         update_block: str,
         file_path: str,
-        base_branch: str = "main"
+        base_branch: str = "main",
+        new_content: str = None,
+        base_sha: Optional[str] = None
     ) -> dict:
         """
         Create a GitHub PR with code changes.
@@ -31,56 +166,176 @@ class PRCreator:
             update_block: Code diff or new content
             file_path: Path to file to modify
             base_branch: Base branch to merge into
+            new_content: Complete new file content (e.g. already merged by Fast Apply);
+                when omitted the update_block is merged into the file (an
+                error is returned if that fails)
+            base_sha: Commit new_content was derived from; the PR's commit is
+                based on it, so later upstream changes to the file conflict
+                instead of being reverted (default: the base branch head)
 
         Returns:
             dict with pr_url, pr_number, branch_name
         """
-        if not self.g:
+        if not self.pool:
+            raise ValueError("GITHUB_TOKEN not set")
+
+        if new_content is None:
+            try:
+                with self._repo(repo_fullname) as repo:
+                    base_sha = repo.get_branch(base_branch).commit.sha
+                    file = repo.get_contents(file_path, ref=base_sha)
+                current_content = file.decoded_content.decode('utf-8')
+                try:
+                    new_content = apply_update(instruction, current_content, update_block).code
+                except MorphAPIError as e:
+                    # Never commit the block appended to the file: that corrupts it
+                    logger.warning(f"Could not merge update block into {file_path}: {e}")
+                    return {
+                        "status": "error",
+                        "error": f"{file_path}: could not merge the update block: {e}",
+                        "pr_url": None
+                    }
+            except UnknownObjectException:
+                # File doesn't exist, create it
+                new_content = update_block
+            except Exception as e:
+                return {
+                    "status": "error",
+                    "error": str(e),
+                    "pr_url": None
+                }
+
+        return self.create_change_set_pr(
+            repo_fullname=repo_fullname,
+            instruction=instruction,
+            files={file_path: new_content},
+            base_branch=base_branch,
+            details=update_block,
+            base_sha=base_sha
+        )
+
+    @time_dependency("github")
+    def create_change_set_pr(
+        self,
+        repo_fullname: str,
+        instruction: str,
+        files: Dict[str, Optional[str]],
+        base_branch: str = "main",
+        details: str = "",
+        base_sha: Optional[str] = None
+    ) -> dict:
+        """
+        Commit any number of files atomically and open a PR for them.
+
+        Args:
+            repo_fullname: Repository in format "owner/repo"
+            instruction: Description of the change (commit message and PR title)
+            files: path -> complete new content (None deletes the file)
+            base_branch: Base branch to merge into
+            details: Update block or diff shown in the PR body
+            base_sha: Commit the contents were derived from (default: the base branch head)
+
+        Returns:
+            dict with pr_url, pr_number, branch_name, commit_sha, files
+        """
+        if not self.pool:
             raise ValueError("GITHUB_TOKEN not set")
 
         try:
-            repo = self.g.get_repo(repo_fullname)
+            with self._repo(repo_fullname) as repo:
+                if base_sha:
+                    base_commit = repo.get_git_commit(base_sha)
+                else:
+                    base_commit = repo.get_branch(base_branch).commit.commit
+                return self._open_pr(repo_fullname, repo, base_commit, instruction, files, base_branch, details)
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": str(e),
+                "pr_url": None
+            }
 
-            # Create branch name
-            timestamp = int(time.time())
-            branch_name = f"northstar/exp-{timestamp}"
+    @time_dependency("github")
+    def create_update_pr(
+        self,
+        repo_fullname: str,
+        instruction: str,
+        update_block: str,
+        file_paths: List[str],
+        base_branch: str = "main"
+    ) -> dict:
+        """
+        Merge an update block into every planned file and open one PR.
 
-            # Get base branch
-            base = repo.get_branch(base_branch)
+        The block is split per file (see northstar_mcp.change_set); every file is
+        read from the same base commit and merged concurrently, and the results
+        are committed together. If any file fails to merge, nothing is committed.
 
-            # Create new branch
-            repo.create_git_ref(
-                ref=f"refs/heads/{branch_name}",
-                sha=base.commit.sha
-            )
+        Args:
+            repo_fullname: Repository in format "owner/repo"
+            instruction: Description of the change
+            update_block: Fast Apply snippet or diff, with "=== path ===" headers for several files
+            file_paths: Files from the technical plan (the first gets a block without headers)
+            base_branch: Base branch to merge into
 
-            # Update or create file
-            try:
-                # Try to get existing file
-                file = repo.get_contents(file_path, ref=branch_name)
+        Returns:
+            dict with pr_url, pr_number, branch_name, commit_sha, files, diff and
+            per-file changes (merge method, confidence)
+        """
+        if not self.pool:
+            raise ValueError("GITHUB_TOKEN not set")
 
-                # For simplicity, just append the update_block
-                # In production, you'd parse the diff and apply it properly
-                current_content = file.decoded_content.decode('utf-8')
-                new_content = current_content + "\n" + update_block
-
-                repo.update_file(
-                    path=file_path,
-                    message=f"feat: {instruction}",
-                    content=new_content,
-                    sha=file.sha,
-                    branch=branch_name
-                )
-            except:
-                # File doesn't exist, create it
-                repo.create_file(
-                    path=file_path,
-                    message=f"feat: {instruction}",
-                    content=update_block,
-                    branch=branch_name
-                )
-
-            # Create PR
+        try:
+            with self._repo(repo_fullname) as repo:
+                base = repo.get_branch(base_branch)
+                base_sha = base.commit.sha
+
+                def read_file(path: str) -> Optional[str]:
+                    # Runs in merge_change_set's worker threads, each on a client of its own
+                    try:
+                        with self._repo(repo_fullname) as worker_repo:
+                            file = worker_repo.get_contents(path, ref=base_sha)
+                    except UnknownObjectException:
+                        return None
+                    if isinstance(file, list):
+                        raise ValueError(f"{path} is a directory")
+                    return file.decoded_content.decode('utf-8')
+
+                blocks = split_update_block(update_block, file_paths)
+                changes = merge_change_set(instruction, blocks, read_file)
+                failed = [change for change in changes if change.error]
+                if failed:
+                    raise ValueError("; ".join(f"{change.path}: {change.error}" for change in failed))
+                files = {change.path: change.merged for change in changes if change.changed}
+                if not files:
+                    raise NoChanges("the update block produced no change")
+
+                diff = combined_diff(changes)
+                result = self._open_pr(repo_fullname, repo, base.commit.commit, instruction, files, base_branch, diff)
+                return {**result, "diff": diff, "changes": [change.to_dict() for change in changes]}
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": str(e),
+                "pr_url": None
+            }
+
+    def _open_pr(self, repo_fullname: str, repo, base_commit, instruction: str, files: Dict[str, Optional[str]], base_branch: str, details: str) -> dict:
+        """Commit the files on top of base_commit, create the branch and open the PR (the branch is removed if that fails)."""
+        builder = CommitBuilder(repo, base_commit, borrow_repo=lambda: self._repo(repo_fullname))
+        for path, content in files.items():
+            if content is None:
+                builder.delete_file(path)
+            else:
+                builder.set_file(path, content)
+        commit = builder.commit(f"feat: {instruction}")
+
+        # The branch is created pointing at the finished commit
+        branch_name = f"northstar/exp-{int(time.time())}-{commit.sha[:7]}"
+        ref = repo.create_git_ref(ref=f"refs/heads/{branch_name}", sha=commit.sha)
+
+        file_list = "\n".join(f"- `{path}`" for path in sorted(files))
+        try:
             pr = repo.create_pull(
                 title=f"Northstar: {instruction}",
                 body=f"""🤖 **Northstar Experiment**
@@ -88,9 +343,12 @@ class PRCreator:
 ## Description
 {instruction}
 
+## Files
+{file_list}
+
 ## Code Changes
 ```
-{update_block[:500]}
+{_truncate(details)}
 ```
 
 ---
@@ -99,17 +357,27 @@ Generated with Northstar AI experimentation platform
                 head=branch_name,
                 base=base_branch
             )
+        except Exception:
+            # Don't leave a branch without a PR behind
+            try:
+                ref.delete()
+            except Exception as cleanup_error:
+                logger.warning(f"Could not delete branch {branch_name} after a failed PR: {cleanup_error}")
+            raise
 
-            return {
-                "pr_url": pr.html_url,
-                "pr_number": pr.number,
-                "branch_name": branch_name,
-                "status": "success"
-            }
+        return {
+            "pr_url": pr.html_url,
+            "pr_number": pr.number,
+            "branch_name": branch_name,
+            "commit_sha": commit.sha,
+            "files": sorted(files),
+            "status": "success"
+        }
 
-        except Exception as e:
-            return {
-                "status": "error",
-                "error": str(e),
-                "pr_url": None
-            }
+
+def _truncate(details: str, max_lines: int = 100) -> str:
+    """PR body excerpt of an update block or diff."""
+    lines = details.splitlines()
+    if len(lines) <= max_lines:
+        return details
+    return "\n".join(lines[:max_lines]) + f"\n\n... ({len(lines) - max_lines} more lines truncated)"
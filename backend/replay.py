@@ -0,0 +1,385 @@
+"""Record/replay of outbound calls.
+
+Every Northstar flow talks to external services, which makes it impossible
+to run or profile one offline. A Cassette sits under the clients. In record
+mode it saves each interaction to a JSON file. In replay mode it answers
+from that file, with the recorded latency (scaled) or none at all.
+
+What is intercepted:
+- metorial.run (Metorial.run): the whole tool-calling loop as one
+  interaction. The calls it makes internally are not recorded separately.
+- requests: PyGithub, CaptainClient, morph_client.merge_code, the Slack
+  Web API client.
+- httpx (sync and async): AsyncOpenAI, including streamed completions, and
+  supabase-py.
+
+Interactions are matched by a hash of the request first: method, URL and
+body, or the run arguments. A request whose body changed, e.g. a prompt
+with a timestamp in it, falls back to the next unused interaction for the
+same route, in recorded order. Anything else raises ReplayMiss.
+
+Not covered: git subprocesses (repo_mirror, clones). Replaying a flow that
+clones needs the mirror cache (NORTHSTAR_CACHE_DIR) from the recording
+machine.
+
+Request headers are never written, so tokens stay out of cassettes. Query
+parameters that look like credentials are redacted. Transport errors are
+not recorded: they propagate while recording, and the replay of such a
+request is a miss.
+
+Configuration:
+    NORTHSTAR_REPLAY_MODE           - "record" or "replay" (unset: off)
+    NORTHSTAR_CASSETTE              - cassette file (default .northstar_cache/cassettes/default.json)
+    NORTHSTAR_REPLAY_LATENCY_SCALE  - 1.0 replays original latency, 0 replays instantly (default 1.0)
+
+Example:
+    cassette = Cassette("flows/code_change.json", mode="replay", latency_scale=0)
+    with cassette.installed():
+        await run_autonomous_agent("change the signup button text", "C1", "U1")
+"""
+
+import asyncio
+import base64
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from metorial import Metorial
+from metorial_core.types import RunResult
+
+logger = logging.getLogger(__name__)
+
+
+MODES = ("record", "replay")
+DEFAULT_CASSETTE = Path(os.getenv("NORTHSTAR_CACHE_DIR", ".northstar_cache")) / "cassettes" / "default.json"
+FORMAT_VERSION = 1
+
+_SECRET_PARAMS = {"token", "access_token", "api_key", "apikey", "key", "client_secret", "signature"}
+# Body already decoded by the client; replaying these would make it decode twice
+_DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+
+# Set while a recorded interaction runs, so the calls it makes aren't recorded separately
+_inside_interaction: contextvars.ContextVar[bool] = contextvars.ContextVar("northstar_replay_inside", default=False)
+
+
+class ReplayMiss(Exception):
+    """No recorded interaction matches a request made during replay."""
+
+
+def _redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, "REDACTED" if k.lower() in _SECRET_PARAMS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    netloc = parts.hostname or ""
+    if parts.port:
+        netloc += f":{parts.port}"
+    return urlunsplit((parts.scheme, netloc, parts.path, urlencode(query), ""))
+
+
+def _route(method: str, url: str) -> str:
+    parts = urlsplit(url)
+    return f"{method.upper()} {parts.hostname}{parts.path}"
+
+
+def _digest(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _body_digest(body) -> str:
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, bytes):
+        return _digest(body)  # generators/streams: best effort
+    return hashlib.sha256(body).hexdigest()
+
+
+def _encode_body(content: bytes) -> Dict[str, str]:
+    try:
+        return {"encoding": "text", "body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"encoding": "base64", "body": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(response: Dict[str, Any]) -> bytes:
+    if response.get("encoding") == "base64":
+        return base64.b64decode(response["body"])
+    return response.get("body", "").encode("utf-8")
+
+
+def _response_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _DROPPED_RESPONSE_HEADERS}
+
+
+class Cassette:
+    """Interactions recorded to, or replayed from, one JSON file."""
+
+    def __init__(self, path, mode: str, latency_scale: float = 1.0):
+        """
+        Args:
+            path: Cassette file
+            mode: "record" (start a new cassette) or "replay"
+            latency_scale: Multiplier for recorded latencies on replay (0 = instant)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown replay mode {mode!r} (expected one of {MODES})")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.interactions: List[Dict[str, Any]] = []
+        self._used: set = set()
+        self._lock = threading.Lock()
+        self._originals: Dict[str, Any] = {}
+        self.misses = 0
+        if mode == "replay":
+            self.load()
+
+    # -- storage ---------------------------------------------------------
+
+    def load(self) -> None:
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported cassette version {data.get('version')} in {self.path}")
+        self.interactions = data["interactions"]
+        logger.info(f"Loaded {len(self.interactions)} interaction(s) from {self.path}")
+
+    def save(self) -> None:
+        """Write the cassette atomically (called after every recorded interaction)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": FORMAT_VERSION, "interactions": self.interactions}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _record(self, service: str, route: str, key: str, request: Dict[str, Any],
+                response: Dict[str, Any], latency: float) -> None:
+        with self._lock:
+            self.interactions.append({
+                "service": service,
+                "route": route,
+                "key": key,
+                "latency": round(latency, 4),
+                "request": request,
+                "response": response
+            })
+            self.save()
+
+    def _match(self, service: str, route: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            for exact in (True, False):
+                for index, interaction in enumerate(self.interactions):
+                    if index in self._used or interaction["service"] != service or interaction["route"] != route:
+                        continue
+                    if exact and interaction["key"] != key:
+                        continue
+                    self._used.add(index)
+                    return interaction
+            self.misses += 1
+        raise ReplayMiss(f"No recorded {service} interaction for {route} in {self.path}")
+
+    def _delay(self, interaction: Dict[str, Any]) -> float:
+        return interaction["latency"] * self.latency_scale
+
+    # -- interception ----------------------------------------------------
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Intercept outbound calls for the duration of the block."""
+        self.install()
+        try:
+            yield self
+        finally:
+            self.uninstall()
+
+    def install(self) -> None:
+        """Patch the intercepted clients (process-wide)."""
+        if self._originals:
+            return
+        self._originals = {
+            "metorial": Metorial.run,
+            "requests": requests.Session.send,
+            "httpx": httpx.Client.send,
+            "httpx_async": httpx.AsyncClient.send,
+        }
+        Metorial.run = self._wrap_metorial(Metorial.run)
+        requests.Session.send = self._wrap_requests(requests.Session.send)
+        httpx.Client.send = self._wrap_httpx(httpx.Client.send)
+        httpx.AsyncClient.send = self._wrap_httpx_async(httpx.AsyncClient.send)
+        logger.info(f"Outbound calls are being {self.mode}ed ({self.path})")
+
+    def uninstall(self) -> None:
+        if not self._originals:
+            return
+        Metorial.run = self._originals["metorial"]
+        requests.Session.send = self._originals["requests"]
+        httpx.Client.send = self._originals["httpx"]
+        httpx.AsyncClient.send = self._originals["httpx_async"]
+        self._originals = {}
+
+    def _wrap_metorial(self, original):
+        cassette = self
+
+        async def run(metorial_self, *, message, server_deployments, client, model, max_steps=10, **kwargs):
+            if _inside_interaction.get():
+                return await original(metorial_self, message=message, server_deployments=server_deployments,
+                                      client=client, model=model, max_steps=max_steps, **kwargs)
+            key = _digest(message, server_deployments, model, max_steps, kwargs)
+            route = f"run {model}"
+            if cassette.mode == "replay":
+                interaction = cassette._match("metorial", route, key)
+                await asyncio.sleep(cassette._delay(interaction))
+                return RunResult(interaction["response"]["text"], interaction["response"]["steps"])
+
+            token = _inside_interaction.set(True)
+            started = time.monotonic()
+            try:
+                result = await original(metorial_self, message=message, server_deployments=server_deployments,
+                                        client=client, model=model, max_steps=max_steps, **kwargs)
+            finally:
+                _inside_interaction.reset(token)
+            cassette._record(
+                "metorial", route, key,
+                {"message": message[:2000], "server_deployments": server_deployments, "max_steps": max_steps},
+                {"text": result.text, "steps": result.steps},
+                time.monotonic() - started
+            )
+            return result
+
+        return run
+
+    def _wrap_requests(self, original):
+        cassette = self
+
+        def send(session, request: requests.PreparedRequest, **kwargs):
+            if _inside_interaction.get():
+                return original(session, request, **kwargs)
+            route = _route(request.method, request.url)
+            key = _digest(request.method, _redact_url(request.url), _body_digest(request.body))
+            if cassette.mode == "replay":
+                interaction = cassette._match("http", route, key)
+                time.sleep(cassette._delay(interaction))
+                recorded = interaction["response"]
+                response = requests.Response()
+                response.status_code = recorded["status"]
+                response.headers = requests.structures.CaseInsensitiveDict(recorded["headers"])
+                response._content = _decode_body(recorded)
+                response.url = request.url
+                response.request = request
+                response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+                return response
+
+            started = time.monotonic()
+            response = original(session, request, **kwargs)
+            cassette._record(
+                "http", route, key,
+                {"method": request.method, "url": _redact_url(request.url)},
+                {"status": response.status_code, "headers": _response_headers(response.headers), **_encode_body(response.content)},
+                time.monotonic() - started
+            )
+            return response
+
+        return send
+
+    def _httpx_key(self, request: httpx.Request):
+        try:
+            body = request.content
+        except httpx.RequestNotRead:
+            body = None
+        url = str(request.url)
+        return _route(request.method, url), _digest(request.method, _redact_url(url), _body_digest(body))
+
+    @staticmethod
+    def _httpx_response(request: httpx.Request, recorded: Dict[str, Any]) -> httpx.Response:
+        return httpx.Response(
+            recorded["status"], headers=recorded["headers"], content=_decode_body(recorded), request=request
+        )
+
+    def _httpx_record(self, route: str, key: str, request: httpx.Request, response: httpx.Response, started: float):
+        self._record(
+            "http", route, key,
+            {"method": request.method, "url": _redact_url(str(request.url))},
+            {"status": response.status_code, "headers": _response_headers(response.headers), **_encode_body(response.content)},
+            time.monotonic() - started
+        )
+
+    def _wrap_httpx(self, original):
+        cassette = self
+
+        def send(client, request: httpx.Request, **kwargs):
+            if _inside_interaction.get():
+                return original(client, request, **kwargs)
+            route, key = cassette._httpx_key(request)
+            if cassette.mode == "replay":
+                interaction = cassette._match("http", route, key)
+                time.sleep(cassette._delay(interaction))
+                return cassette._httpx_response(request, interaction["response"])
+
+            started = time.monotonic()
+            response = original(client, request, **kwargs)
+            response.read()  # streamed bodies are read in full so they can be saved
+            cassette._httpx_record(route, key, request, response, started)
+            return response
+
+        return send
+
+    def _wrap_httpx_async(self, original):
+        cassette = self
+
+        async def send(client, request: httpx.Request, **kwargs):
+            if _inside_interaction.get():
+                return await original(client, request, **kwargs)
+            route, key = cassette._httpx_key(request)
+            if cassette.mode == "replay":
+                interaction = cassette._match("http", route, key)
+                await asyncio.sleep(cassette._delay(interaction))
+                return cassette._httpx_response(request, interaction["response"])
+
+            started = time.monotonic()
+            response = await original(client, request, **kwargs)
+            await response.aread()  # streamed completions arrive at once while recording
+            cassette._httpx_record(route, key, request, response, started)
+            return response
+
+        return send
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": str(self.path),
+                "mode": self.mode,
+                "interactions": len(self.interactions),
+                "replayed": len(self._used),
+                "misses": self.misses,
+                "latency_scale": self.latency_scale
+            }
+
+
+def install_from_env() -> Optional[Cassette]:
+    """
+    Install a cassette if NORTHSTAR_REPLAY_MODE is set.
+
+    Returns:
+        The installed Cassette, or None when record/replay is off
+    """
+    mode = os.getenv("NORTHSTAR_REPLAY_MODE", "").strip().lower()
+    if not mode or mode == "off":
+        return None
+    cassette = Cassette(
+        os.getenv("NORTHSTAR_CASSETTE", str(DEFAULT_CASSETTE)),
+        mode,
+        latency_scale=float(os.getenv("NORTHSTAR_REPLAY_LATENCY_SCALE", "1.0"))
+    )
+    cassette.install()
+    return cassette
@@ -1,89 +1,493 @@
 """Repository indexing utilities for Captain knowledge base."""
 
+import logging
 import os
+import re
+import subprocess
 import tempfile
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple, Iterable, Iterator
 from git import Repo
 import base64
 
-
+from metrics import time_dependency
+
+logger = logging.getLogger(__name__)
+
+
+# Directories never worth walking into
+IGNORE_DIRS = {
+    '.git', 'node_modules', 'venv', '.venv', '__pycache__', 'dist', 'build',
+    '.next', '.nuxt', 'coverage', '.pytest_cache', '.mypy_cache'
+}
+
+IGNORE_FILES = {
+    '.DS_Store', 'Thumbs.db', 'package-lock.json', 'yarn.lock',
+    'pnpm-lock.yaml', '.gitignore'
+}
+
+# Supported extensions (from Captain docs)
+INDEXABLE_EXTENSIONS = {
+    # Documents
+    '.pdf', '.docx', '.txt', '.md',
+    # Spreadsheets
+    '.xlsx', '.xls', '.csv', '.json',
+    # Presentations
+    '.pptx', '.ppt',
+    # Images (with OCR)
+    '.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff',
+    # Code
+    '.py', '.ts', '.js', '.html', '.css', '.php', '.java',
+    '.tsx', '.jsx', '.vue', '.svelte', '.go', '.rs', '.rb',
+    '.c', '.cpp', '.h', '.hpp', '.sh', '.bash', '.yaml', '.yml',
+    '.toml', '.xml', '.sql', '.graphql', '.proto'
+}
+
+# Extensions that are binary by design - Captain handles these itself,
+# so they are never sniffed for binary content
+DOCUMENT_EXTENSIONS = {
+    '.pdf', '.docx', '.xlsx', '.xls', '.pptx', '.ppt',
+    '.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'
+}
+
+LANGUAGE_EXTENSIONS = {
+    '.py': 'Python',
+    '.js': 'JavaScript',
+    '.ts': 'TypeScript',
+    '.tsx': 'TypeScript',
+    '.jsx': 'JavaScript',
+    '.java': 'Java',
+    '.go': 'Go',
+    '.rs': 'Rust',
+    '.rb': 'Ruby',
+    '.php': 'PHP',
+    '.html': 'HTML',
+    '.css': 'CSS',
+    '.vue': 'Vue',
+    '.svelte': 'Svelte'
+}
+
+MAX_INDEXABLE_FILE_SIZE = 1_000_000  # Skip files >1MB
+BINARY_SNIFF_BYTES = 8192
+BULK_READ_WORKERS = 16
+
+
+@time_dependency("git", "clone")
 def clone_repository(repo_url: str, target_dir: Path) -> None:
     """Clone a GitHub repository to a local directory."""
     Repo.clone_from(repo_url, target_dir)
 
 
-def get_indexable_files(repo_dir: Path) -> List[Path]:
+def _gitignore_pattern_to_regex(pattern: str) -> str:
+    """Translate a single gitignore glob into a regular expression."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += '/.*'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif char == '*':
+            regex += '[^/]*'
+            i += 1
+        elif char == '?':
+            regex += '[^/]'
+            i += 1
+        elif char == '[':
+            close = pattern.find(']', i + 1)
+            if close == -1:
+                regex += re.escape(char)
+                i += 1
+            else:
+                body = pattern[i + 1:close]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += f'[{body}]'
+                i = close + 1
+        else:
+            regex += re.escape(char)
+            i += 1
+    return regex
+
+
+def parse_gitignore(gitignore_path: Path, base: str = '') -> List[Tuple[str, Any, bool, bool]]:
     """
-    Get all files that should be indexed from the repository.
+    Parse a .gitignore file into match rules.
 
-    Filters out:
-    - .git directory
-    - node_modules
-    - venv, __pycache__
-    - Binary files
-    - Large files (>1MB)
+    Args:
+        gitignore_path: Path to the .gitignore file
+        base: Directory containing the file, relative to the repo root ('' for root)
+
+    Returns:
+        List of (base, compiled_regex, negate, dir_only) rules in file order
     """
-    ignore_dirs = {
-        '.git', 'node_modules', 'venv', '__pycache__', 'dist', 'build',
-        '.next', '.nuxt', 'coverage', '.pytest_cache', '.mypy_cache'
-    }
+    rules = []
+    try:
+        lines = gitignore_path.read_text(encoding='utf-8', errors='ignore').splitlines()
+    except OSError:
+        return rules
+
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        if line.startswith('\\'):
+            line = line[1:]
+
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+
+        # A slash anywhere but the end anchors the pattern to the .gitignore's directory
+        anchored = '/' in line
+        line = line.lstrip('/')
+        regex = _gitignore_pattern_to_regex(line)
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+
+        rules.append((base, re.compile(regex), negate, dir_only))
+
+    return rules
+
+
+def is_gitignored(rel_path: str, is_dir: bool, rules: List[Tuple[str, Any, bool, bool]]) -> bool:
+    """Check a repo-relative path against gitignore rules (last matching rule wins)."""
+    ignored = False
+    for base, regex, negate, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        if base:
+            if not rel_path.startswith(base + '/'):
+                continue
+            candidate = rel_path[len(base) + 1:]
+        else:
+            candidate = rel_path
+        if regex.fullmatch(candidate):
+            ignored = not negate
+    return ignored
 
-    ignore_files = {
-        '.DS_Store', 'Thumbs.db', 'package-lock.json', 'yarn.lock',
-        'pnpm-lock.yaml', '.gitignore'
-    }
 
-    # Supported extensions (from Captain docs)
-    indexable_extensions = {
-        # Documents
-        '.pdf', '.docx', '.txt', '.md',
-        # Spreadsheets
-        '.xlsx', '.xls', '.csv', '.json',
-        # Presentations
-        '.pptx', '.ppt',
-        # Images (with OCR)
-        '.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff',
-        # Code
-        '.py', '.ts', '.js', '.html', '.css', '.php', '.java',
-        '.tsx', '.jsx', '.vue', '.svelte', '.go', '.rs', '.rb',
-        '.c', '.cpp', '.h', '.hpp', '.sh', '.bash', '.yaml', '.yml',
-        '.toml', '.xml', '.sql', '.graphql', '.proto'
-    }
+def list_git_files(repo_dir: Path) -> Optional[Set[str]]:
+    """
+    List tracked and untracked-but-not-ignored files using `git ls-files -z`.
 
-    files_to_index = []
+    Returns:
+        Set of repo-relative POSIX paths, or None if repo_dir is not a git checkout
+    """
+    if not (repo_dir / '.git').exists():
+        return None
+
+    try:
+        result = subprocess.run(
+            ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard'],
+            cwd=repo_dir,
+            capture_output=True,
+            timeout=60,
+            check=True
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    return {p for p in result.stdout.decode('utf-8', errors='surrogateescape').split('\0') if p}
+
+
+def looks_binary(data: bytes) -> bool:
+    """NUL bytes among the first bytes of a file, the same heuristic git uses."""
+    return b'\0' in data[:BINARY_SNIFF_BYTES]
+
+
+def is_binary_file(file_path: str) -> bool:
+    """Sniff the first bytes of a file on disk with looks_binary()."""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return True
+    try:
+        return looks_binary(os.read(fd, BINARY_SNIFF_BYTES))
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+
+
+def scan_repository(
+    repo_dir: Path,
+    respect_gitignore: bool = True,
+    sniff_binary: bool = True
+) -> Dict[str, Any]:
+    """
+    Walk a checkout once and collect both indexable files and structure stats.
+
+    Uses os.scandir so file sizes come from cached DirEntry.stat() results.
+    When the directory is a git checkout, `git ls-files` decides which files
+    belong to the repo; otherwise .gitignore files are parsed as the walk
+    descends.
+
+    Args:
+        repo_dir: Root of the checked-out repository
+        respect_gitignore: Skip files git would ignore
+        sniff_binary: Drop text-extension files whose first bytes contain NULs.
+            Pass False when the files are read with iter_files_bulk(), which
+            checks the buffer it reads instead of opening each file twice
+
+    Returns:
+        Dict with:
+        - indexable_files: List[Path] of files worth indexing
+        - file_sizes: {Path: size in bytes} for every indexable file
+        - structure: same shape as analyze_repository_structure()
+    """
+    repo_dir = Path(repo_dir)
+
+    tracked_files = list_git_files(repo_dir) if respect_gitignore else None
+    tracked_dirs = None
+    if tracked_files is not None:
+        tracked_dirs = set()
+        for rel in tracked_files:
+            parent = rel.rpartition('/')[0]
+            while parent and parent not in tracked_dirs:
+                tracked_dirs.add(parent)
+                parent = parent.rpartition('/')[0]
+
+    gitignore_rules = []
+    if respect_gitignore and tracked_files is None:
+        gitignore_rules = parse_gitignore(repo_dir / '.gitignore')
+
+    indexable_files = []
+    file_sizes = {}
+    directories = []
+    file_counts_by_type = {}
+    languages_detected = set()
+    total_files = 0
+
+    # Stack of (absolute dir path, repo-relative POSIX path)
+    stack = [(str(repo_dir), '')]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        if rel_dir:
+            directories.append(rel_dir)
+            if respect_gitignore and tracked_files is None:
+                nested = os.path.join(dir_path, '.gitignore')
+                if os.path.isfile(nested):
+                    gitignore_rules = gitignore_rules + parse_gitignore(Path(nested), rel_dir)
+
+        try:
+            with os.scandir(dir_path) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
 
-    for root, dirs, files in os.walk(repo_dir):
-        # Remove ignored directories from search
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
 
-        for file in files:
-            if file in ignore_files:
+            if is_dir:
+                if name in IGNORE_DIRS:
+                    continue
+                if tracked_dirs is not None:
+                    if rel_path not in tracked_dirs:
+                        continue
+                elif gitignore_rules and is_gitignored(rel_path, True, gitignore_rules):
+                    continue
+                subdirs.append((entry.path, rel_path))
                 continue
 
-            file_path = Path(root) / file
+            if tracked_files is not None:
+                if rel_path not in tracked_files:
+                    continue
+            elif gitignore_rules and is_gitignored(rel_path, False, gitignore_rules):
+                continue
+
+            total_files += 1
+            ext = os.path.splitext(name)[1].lower()
+            file_counts_by_type[ext] = file_counts_by_type.get(ext, 0) + 1
+            if ext in LANGUAGE_EXTENSIONS:
+                languages_detected.add(LANGUAGE_EXTENSIONS[ext])
 
-            # Check extension
-            if file_path.suffix.lower() not in indexable_extensions:
+            if name in IGNORE_FILES or ext not in INDEXABLE_EXTENSIONS:
                 continue
 
-            # Check file size (skip >1MB)
             try:
-                if file_path.stat().st_size > 1_000_000:
+                if not entry.is_file():
                     continue
+                size = entry.stat().st_size
             except OSError:
                 continue
 
-            files_to_index.append(file_path)
+            if size > MAX_INDEXABLE_FILE_SIZE:
+                continue
+
+            if sniff_binary and ext not in DOCUMENT_EXTENSIONS and is_binary_file(entry.path):
+                continue
+
+            file_path = Path(entry.path)
+            indexable_files.append(file_path)
+            file_sizes[file_path] = size
+
+        # Reverse so directories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+    return {
+        'indexable_files': indexable_files,
+        'file_sizes': file_sizes,
+        'structure': {
+            'directories': directories,
+            'file_counts_by_type': file_counts_by_type,
+            'total_files': total_files,
+            'languages_detected': list(languages_detected)
+        }
+    }
+
+
+class FileBuffer:
+    """
+    Raw bytes of a file, read once and decoded lazily.
+
+    The same buffer feeds the analysis context (text) and the Captain
+    upload (data), so each file only hits the disk once.
+    """
+
+    __slots__ = ('path', 'data', '_text')
+
+    def __init__(self, path: Path, data: bytes):
+        self.path = path
+        self.data = data
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        """Full contents decoded as UTF-8 (undecodable bytes dropped)."""
+        if self._text is None:
+            self._text = self.data.decode('utf-8', errors='ignore')
+        return self._text
+
+    def text_prefix(self, max_chars: int) -> str:
+        """First max_chars characters, decoding only as many bytes as needed (not cached)."""
+        if self._text is not None:
+            return self._text[:max_chars]
+        # UTF-8 uses at most 4 bytes per character
+        return self.data[:max_chars * 4].decode('utf-8', errors='ignore')[:max_chars]
+
+
+def _read_file_buffer(file_path: Path, sniff_binary: bool = False) -> Optional[FileBuffer]:
+    """Read a single file for iter_files_bulk, returning None on failure or for binary files."""
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning(f"Failed to read {file_path}: {e}")
+        return None
+    if sniff_binary and file_path.suffix.lower() not in DOCUMENT_EXTENSIONS and looks_binary(data):
+        return None
+    return FileBuffer(file_path, data)
+
+
+def iter_files_bulk(
+    file_paths: Iterable[Path],
+    max_workers: int = BULK_READ_WORKERS,
+    sniff_binary: bool = True
+) -> Iterator[FileBuffer]:
+    """
+    Read many files concurrently through a thread pool, yielding them in order.
+
+    File reads release the GIL, so a pool overlaps the per-file open/read
+    latency that dominates cold checkouts. Files are capped at
+    MAX_INDEXABLE_FILE_SIZE by scan_repository, so a single read() per file
+    is cheaper than setting up an mmap.
+
+    At most two reads per worker are in flight ahead of the consumer, so
+    only the buffers the caller keeps stay in memory, not the whole
+    repository.
+
+    Args:
+        file_paths: Files to read
+        max_workers: Thread pool size
+        sniff_binary: Skip text-extension files whose buffer starts with NULs
+            (see scan_repository)
+
+    Yields:
+        FileBuffer per readable file, in input order; unreadable files are skipped
+    """
+    file_paths = iter(file_paths)
+    window = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(pool.submit(_read_file_buffer, file_path, sniff_binary))
+            if len(pending) < window:
+                continue
+            buffer = pending.popleft().result()
+            if buffer is not None:
+                yield buffer
+        while pending:
+            buffer = pending.popleft().result()
+            if buffer is not None:
+                yield buffer
+
+
+def read_files_bulk(
+    file_paths: Iterable[Path],
+    max_workers: int = BULK_READ_WORKERS,
+    sniff_binary: bool = True
+) -> Dict[Path, FileBuffer]:
+    """
+    Read many files with iter_files_bulk() and keep all of them.
+
+    Returns:
+        Dict of {path: FileBuffer}; unreadable and binary files are omitted
+    """
+    return {buffer.path: buffer for buffer in iter_files_bulk(file_paths, max_workers, sniff_binary)}
 
-    return files_to_index
 
+def get_indexable_files(repo_dir: Path) -> List[Path]:
+    """
+    Get all files that should be indexed from the repository.
 
-def prepare_file_for_captain(file_path: Path, repo_root: Path) -> Dict[str, Any]:
+    Filters out:
+    - .git directory
+    - node_modules
+    - venv, __pycache__
+    - Files ignored by git
+    - Binary files
+    - Large files (>1MB)
+
+    Prefer scan_repository() when the structure stats are needed too.
+    """
+    return scan_repository(repo_dir)['indexable_files']
+
+
+def prepare_file_for_captain(
+    file_path: Path,
+    repo_root: Path,
+    size: Optional[int] = None
+) -> Dict[str, Any]:
     """
     Prepare a file for indexing into Captain.
 
+    Args:
+        file_path: Absolute path of the file
+        repo_root: Root of the checked-out repository
+        size: File size if already known (e.g. from scan_repository), avoids a stat call
+
     Returns dict with file info for indexing.
     """
     relative_path = file_path.relative_to(repo_root)
@@ -93,7 +497,7 @@ def prepare_file_for_captain(file_path: Path, repo_root: Path) -> Dict[str, Any]
         'full_path': str(file_path),
         'name': file_path.name,
         'extension': file_path.suffix,
-        'size': file_path.stat().st_size
+        'size': size if size is not None else file_path.stat().st_size
     }
 
 
@@ -127,48 +531,7 @@ def read_key_files(repo_dir: Path) -> Dict[str, str]:
 def analyze_repository_structure(repo_dir: Path) -> Dict[str, Any]:
     """
     Analyze the repository structure and return metadata.
-    """
-    structure = {
-        'directories': [],
-        'file_counts_by_type': {},
-        'total_files': 0,
-        'languages_detected': set()
-    }
-
-    ignore_dirs = {'.git', 'node_modules', 'venv', '__pycache__'}
-
-    language_extensions = {
-        '.py': 'Python',
-        '.js': 'JavaScript',
-        '.ts': 'TypeScript',
-        '.tsx': 'TypeScript',
-        '.jsx': 'JavaScript',
-        '.java': 'Java',
-        '.go': 'Go',
-        '.rs': 'Rust',
-        '.rb': 'Ruby',
-        '.php': 'PHP',
-        '.html': 'HTML',
-        '.css': 'CSS',
-        '.vue': 'Vue',
-        '.svelte': 'Svelte'
-    }
-
-    for root, dirs, files in os.walk(repo_dir):
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
-
-        rel_path = Path(root).relative_to(repo_dir)
-        if str(rel_path) != '.':
-            structure['directories'].append(str(rel_path))
 
-        for file in files:
-            structure['total_files'] += 1
-            ext = Path(file).suffix.lower()
-            structure['file_counts_by_type'][ext] = structure['file_counts_by_type'].get(ext, 0) + 1
-
-            if ext in language_extensions:
-                structure['languages_detected'].add(language_extensions[ext])
-
-    structure['languages_detected'] = list(structure['languages_detected'])
-
-    return structure
+    Prefer scan_repository() when the indexable file list is needed too.
+    """
+    return scan_repository(repo_dir)['structure']
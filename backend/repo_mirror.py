@@ -0,0 +1,366 @@
+"""Local git mirrors and the churn index built from their history.
+
+Each connected repository gets a blobless bare mirror under the cache
+directory. `git log --name-only` on the mirror yields per-file change counts
+and recency, which context assembly and proposal targeting use to favour
+actively developed files over dead code. The index is stored next to the
+mirror and only the commits since the last indexed head are read on refresh.
+"""
+
+import base64
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from deadlines import deadline_timeout
+from metrics import time_dependency
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_DIR = Path(os.getenv("NORTHSTAR_CACHE_DIR", "~/.cache/northstar")).expanduser()
+
+# Minimum seconds between fetches of the same mirror
+MIRROR_REFRESH_INTERVAL = int(os.getenv("NORTHSTAR_MIRROR_REFRESH_SECONDS", "300"))
+
+# Commits read when an index is built from scratch
+CHURN_MAX_COMMITS = 2000
+
+# A change this many days old counts half as much as one made today
+CHURN_HALF_LIFE_DAYS = 30
+
+# Commits touching more files than this (renames, formatting sweeps,
+# vendored drops) say little about where work is happening
+CHURN_MAX_FILES_PER_COMMIT = 100
+
+GIT_TIMEOUT = 300
+
+_COMMIT_MARKER = "\x1ecommit "
+
+_repo_locks: Dict[str, threading.Lock] = {}
+_repo_locks_guard = threading.Lock()
+
+
+def _repo_lock(repo_fullname: str) -> threading.Lock:
+    """Per-repository lock so concurrent requests don't fetch the same mirror twice."""
+    with _repo_locks_guard:
+        return _repo_locks.setdefault(repo_fullname, threading.Lock())
+
+
+def _auth_env() -> Dict[str, str]:
+    """
+    GIT_CONFIG_* variables sending GITHUB_TOKEN as an Authorization header to github.com.
+
+    The token travels in the environment rather than in the URL or arguments,
+    so it never shows up in the command line that CalledProcessError and
+    TimeoutExpired messages include. Entries already in the environment
+    (e.g. URL rewrites) are kept.
+    """
+    github_token = os.getenv("GITHUB_TOKEN")
+    if not github_token:
+        return {}
+    index = int(os.getenv("GIT_CONFIG_COUNT", "0"))
+    credentials = base64.b64encode(f"x-access-token:{github_token}".encode("utf-8")).decode("ascii")
+    return {
+        f"GIT_CONFIG_KEY_{index}": "http.https://github.com/.extraHeader",
+        f"GIT_CONFIG_VALUE_{index}": f"Authorization: Basic {credentials}",
+        "GIT_CONFIG_COUNT": str(index + 1),
+    }
+
+
+def _git(args: List[str], cwd: Optional[Path] = None, authenticated: bool = False) -> str:
+    """
+    Run a git command and return stdout (raises CalledProcessError on failure,
+    TimeoutExpired when it outlasts GIT_TIMEOUT or the request's deadline).
+
+    Args:
+        args: git arguments
+        cwd: Working directory
+        authenticated: Pass GITHUB_TOKEN to github.com (clone, fetch, blob reads)
+    """
+    env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+    if authenticated:
+        env.update(_auth_env())
+    result = subprocess.run(
+        ['git', *args],
+        cwd=cwd,
+        capture_output=True,
+        check=True,
+        timeout=deadline_timeout(GIT_TIMEOUT),
+        env=env
+    )
+    return result.stdout.decode('utf-8', errors='replace')
+
+
+def _remote_url(repo_fullname: str) -> str:
+    return f"https://github.com/{repo_fullname}.git"
+
+
+def mirror_path(repo_fullname: str) -> Path:
+    """Location of the bare mirror for a repository."""
+    return CACHE_DIR / "mirrors" / f"{repo_fullname.replace('/', '__')}.git"
+
+
+def ensure_mirror(repo_fullname: str, force_fetch: bool = False) -> Path:
+    """
+    Create or update the local mirror of a repository.
+
+    The mirror is cloned without blobs - history and trees are all the churn
+    index needs. Existing mirrors are fetched at most once per
+    MIRROR_REFRESH_INTERVAL unless force_fetch is set.
+
+    Args:
+        repo_fullname: Repository in format 'owner/repo'
+        force_fetch: Fetch even if the mirror was refreshed recently
+
+    Returns:
+        Path to the bare mirror
+    """
+    path = mirror_path(repo_fullname)
+    with _repo_lock(repo_fullname):
+        if not (path / "HEAD").exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            logger.info(f"Creating mirror of {repo_fullname} at {path}")
+            try:
+                with time_dependency("git", "mirror_clone"):
+                    _git(['clone', '--bare', '--filter=blob:none', '--quiet', _remote_url(repo_fullname), str(path)],
+                         authenticated=True)
+            except subprocess.TimeoutExpired:
+                # A killed clone leaves a partial mirror behind; start over next time
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            (path / "northstar_fetched").touch()
+            return path
+
+        stamp = path / "northstar_fetched"
+        age = time.time() - stamp.stat().st_mtime if stamp.exists() else float('inf')
+        if force_fetch or age >= MIRROR_REFRESH_INTERVAL:
+            with time_dependency("git", "mirror_fetch"):
+                _git(['fetch', '--prune', '--quiet', _remote_url(repo_fullname), '+refs/heads/*:refs/heads/*'],
+                     cwd=path, authenticated=True)
+            stamp.touch()
+    return path
+
+
+def _decay(age_seconds: float) -> float:
+    """Weight of a change made age_seconds ago."""
+    return math.pow(0.5, max(age_seconds, 0) / (CHURN_HALF_LIFE_DAYS * 86400))
+
+
+class ChurnIndex:
+    """
+    Per-file change frequency and recency for one branch of a repository.
+
+    Each file tracks its commit count, last change time and a recency-weighted
+    score (every commit contributes 1, halving every CHURN_HALF_LIFE_DAYS).
+    Scores are stored relative to `reference_time` so new commits can be
+    folded in without re-reading history.
+    """
+
+    def __init__(self, repo_fullname: str, branch: str):
+        self.repo_fullname = repo_fullname
+        self.branch = branch
+        self.head: Optional[str] = None
+        self.reference_time = 0.0
+        self.files: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def index_path(self) -> Path:
+        return mirror_path(self.repo_fullname) / f"northstar_churn_{self.branch.replace('/', '__')}.json"
+
+    def load(self) -> bool:
+        """Load a previously saved index. Returns False if there is none."""
+        try:
+            data = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            return False
+        self.head = data.get('head')
+        self.reference_time = data.get('reference_time', 0.0)
+        self.files = data.get('files', {})
+        return True
+
+    def save(self) -> None:
+        data = {'head': self.head, 'reference_time': self.reference_time, 'files': self.files}
+        tmp_path = self.index_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, self.index_path)
+
+    def _read_log(self, path: Path, revision_range: str, max_commits: Optional[int]) -> List[Dict[str, Any]]:
+        """Parse `git log --name-only` into [{'time': ts, 'files': [...]}], newest first."""
+        args = ['log', '--name-only', '--no-renames', '--no-merges', f'--format={_COMMIT_MARKER}%H %ct']
+        if max_commits:
+            args.append(f'--max-count={max_commits}')
+        args.append(revision_range)
+        output = _git(args, cwd=path)
+
+        commits = []
+        for chunk in output.split(_COMMIT_MARKER)[1:]:
+            lines = chunk.strip('\n').split('\n')
+            _, timestamp = lines[0].split()
+            files = [line for line in lines[1:] if line]
+            commits.append({'time': float(timestamp), 'files': files})
+        return commits
+
+    def _apply(self, commits: List[Dict[str, Any]], now: float) -> None:
+        """Fold commits into the per-file stats, rebasing scores to `now`."""
+        if self.reference_time:
+            rebase = _decay(now - self.reference_time)
+            for stats in self.files.values():
+                stats['score'] *= rebase
+        self.reference_time = now
+
+        for commit in commits:
+            if len(commit['files']) > CHURN_MAX_FILES_PER_COMMIT:
+                continue
+            weight = _decay(now - commit['time'])
+            for file_path in commit['files']:
+                stats = self.files.setdefault(file_path, {'commits': 0, 'last_changed': 0.0, 'score': 0.0})
+                stats['commits'] += 1
+                stats['last_changed'] = max(stats['last_changed'], commit['time'])
+                stats['score'] += weight
+
+    def refresh(self, path: Path) -> int:
+        """
+        Bring the index up to date with the mirror's branch head.
+
+        Only commits after the last indexed head are read; a rewritten branch
+        (force push) triggers a full rebuild.
+
+        Returns:
+            Number of commits folded in
+        """
+        head = _git(['rev-parse', f'refs/heads/{self.branch}'], cwd=path).strip()
+        if head == self.head:
+            return 0
+
+        incremental = False
+        if self.head:
+            try:
+                _git(['merge-base', '--is-ancestor', self.head, head], cwd=path)
+                incremental = True
+            except subprocess.CalledProcessError:
+                logger.info(f"{self.repo_fullname}@{self.branch} history was rewritten, rebuilding churn index")
+
+        if incremental:
+            commits = self._read_log(path, f'{self.head}..{head}', None)
+        else:
+            self.files = {}
+            self.reference_time = 0.0
+            commits = self._read_log(path, head, CHURN_MAX_COMMITS)
+
+        self._apply(commits, time.time())
+        self.head = head
+        self.save()
+        return len(commits)
+
+    def score(self, file_path: str, now: Optional[float] = None) -> float:
+        """Recency-weighted change score of a file (0 for unknown files)."""
+        stats = self.files.get(file_path)
+        if not stats:
+            return 0.0
+        return stats['score'] * _decay((now or time.time()) - self.reference_time)
+
+    def top_files(self, limit: int = 20, extensions: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        Most actively developed files that still exist at the indexed head.
+
+        Args:
+            limit: Number of files to return
+            extensions: Only include files with these extensions (e.g. {'.jsx'})
+
+        Returns:
+            [{'path', 'score', 'commits', 'last_changed'}, ...] highest score first
+        """
+        now = time.time()
+        ranked = []
+        for file_path, stats in self.files.items():
+            if extensions and os.path.splitext(file_path)[1].lower() not in extensions:
+                continue
+            ranked.append({
+                'path': file_path,
+                'score': round(self.score(file_path, now), 4),
+                'commits': stats['commits'],
+                'last_changed': stats['last_changed']
+            })
+        ranked.sort(key=lambda f: -f['score'])
+
+        existing = self._existing_files()
+        if existing is not None:
+            ranked = [f for f in ranked if f['path'] in existing]
+        return ranked[:limit]
+
+    def _existing_files(self) -> Optional[set]:
+        """Paths present in the indexed head's tree (None if unavailable)."""
+        if not self.head:
+            return None
+        try:
+            output = _git(['ls-tree', '-r', '--name-only', '-z', self.head], cwd=mirror_path(self.repo_fullname))
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return None
+        return set(filter(None, output.split('\0')))
+
+
+def get_churn_index(repo_fullname: str, branch: str = "main") -> ChurnIndex:
+    """
+    Load the churn index for a repository branch, refreshing the mirror and
+    folding in any new commits first.
+
+    Blocking (runs git); call it via asyncio.to_thread from async code.
+    """
+    path = ensure_mirror(repo_fullname)
+    index = ChurnIndex(repo_fullname, branch)
+    with _repo_lock(repo_fullname):
+        index.load()
+        added = index.refresh(path)
+    if added:
+        logger.info(f"Churn index for {repo_fullname}@{branch}: +{added} commits, {len(index.files)} files")
+    return index
+
+
+def head_commit(repo_fullname: str, branch: str = "main", fetch: bool = False) -> str:
+    """
+    Commit SHA of a branch in the mirror.
+
+    Args:
+        repo_fullname: Repository in format 'owner/repo'
+        branch: Branch name
+        fetch: Fetch first, even if the mirror was refreshed recently (use
+            before basing a commit on files read from the mirror)
+
+    Blocking (runs git); call it via asyncio.to_thread from async code.
+    """
+    path = ensure_mirror(repo_fullname, force_fetch=fetch)
+    return _git(['rev-parse', f'refs/heads/{branch}^{{commit}}'], cwd=path).strip()
+
+
+def list_files(repo_fullname: str, branch: str = "main") -> List[str]:
+    """
+    Paths in the branch head (or any revision), read from the mirror (refreshed if stale).
+
+    Blocking (runs git); call it via asyncio.to_thread from async code.
+    """
+    path = ensure_mirror(repo_fullname)
+    output = _git(['ls-tree', '-r', '--name-only', '-z', branch], cwd=path)
+    return list(filter(None, output.split('\0')))
+
+
+def read_file(repo_fullname: str, file_path: str, branch: str = "main") -> Optional[str]:
+    """
+    Contents of a file at the branch head (or any revision) of the mirror, or None if it doesn't exist.
+
+    The mirror is blobless, so git fetches the blob on first read, with the
+    same credentials as clone and fetch.
+    Blocking (runs git).
+    """
+    path = ensure_mirror(repo_fullname)
+    try:
+        return _git(['show', f"{branch}:{file_path}"], cwd=path, authenticated=True)
+    except subprocess.CalledProcessError:
+        return None
@@ -0,0 +1,195 @@
+"""Idempotent dispatch of Slack events.
+
+Slack redelivers an event (with an X-Slack-Retry-Num header) when it gets no
+2xx within 3 seconds, and a message that mentions the bot can arrive both as
+an app_mention and as a message event. Each delivery used to start its own
+agent run - a duplicate 25-step LLM run, or a duplicate PR.
+
+The webhook claims every delivery before dispatching it:
+
+    if not await asyncio.to_thread(slack_event_ids.claim, event_keys(body)):
+        return {"ok": True}    # seen before: acknowledge, do nothing
+
+A delivery is identified by its event_id, the message's client_msg_id and its
+channel + ts; it is a duplicate if any of them was claimed within the TTL.
+
+Two stores are available:
+- InProcessEventStore (default): bounded and expiring, enough for a single worker
+- SupabaseEventStore: the slack_events table (see SUPABASE_SCHEMA.md), shared
+  by every worker; if the table is unavailable it falls back to in-process
+
+Configuration:
+    NORTHSTAR_SLACK_DEDUP_BACKEND     - "memory" (default) or "supabase"
+    NORTHSTAR_SLACK_DEDUP_TTL_SECONDS - how long a delivery is remembered (default 3600)
+    NORTHSTAR_SLACK_DEDUP_MAX_EVENTS  - deliveries kept in process (default 10000)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional
+
+import db_operations
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BACKEND = os.getenv("NORTHSTAR_SLACK_DEDUP_BACKEND", "memory").lower()
+DEFAULT_TTL = float(os.getenv("NORTHSTAR_SLACK_DEDUP_TTL_SECONDS", "3600"))
+DEFAULT_MAX_EVENTS = int(os.getenv("NORTHSTAR_SLACK_DEDUP_MAX_EVENTS", "10000"))
+PRUNE_INTERVAL = 300  # seconds between deletes of expired rows in the shared store
+
+
+def event_keys(body: Dict[str, Any]) -> List[str]:
+    """
+    Idempotency keys of a Slack Events API delivery.
+
+    Args:
+        body: The event_callback payload
+
+    Returns:
+        Keys from the event_id, client_msg_id and channel + ts (whichever are present)
+    """
+    event = body.get("event") or {}
+    keys = []
+    if body.get("event_id"):
+        keys.append(f"event:{body['event_id']}")
+    if event.get("client_msg_id"):
+        keys.append(f"msg:{event['client_msg_id']}")
+    if event.get("channel") and event.get("ts"):
+        keys.append(f"ts:{event['channel']}:{event['ts']}")
+    return keys
+
+
+class InProcessEventStore:
+    """Claimed keys in a bounded dict with a TTL; the oldest claims are evicted first."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_events: int = DEFAULT_MAX_EVENTS):
+        """
+        Args:
+            ttl: Seconds a claimed key blocks duplicates
+            max_events: Keys kept at once (oldest claims evicted)
+        """
+        self.ttl = ttl
+        self.max_events = max_events
+        self._claimed: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.duplicates = 0
+
+    def claim(self, keys: List[str]) -> bool:
+        """
+        Claim a delivery.
+
+        Args:
+            keys: Idempotency keys from event_keys()
+
+        Returns:
+            True if none of the keys was claimed within the TTL (the caller should
+            do the work), False for a duplicate. A delivery without keys is always new.
+        """
+        now = time.time()
+        with self._lock:
+            while self._claimed:
+                oldest_key, claimed_at = next(iter(self._claimed.items()))
+                if now - claimed_at <= self.ttl:
+                    break
+                del self._claimed[oldest_key]
+
+            duplicate = any(key in self._claimed for key in keys)
+            for key in keys:
+                # Remember every key, so later variants of a duplicate are caught too.
+                # Keys are only ever appended, so the dict stays in claim order.
+                if key not in self._claimed:
+                    self._claimed[key] = now
+            while len(self._claimed) > self.max_events:
+                self._claimed.popitem(last=False)
+
+            if duplicate:
+                self.duplicates += 1
+            else:
+                self.claims += 1
+            return not duplicate
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "keys": len(self._claimed),
+                "max_events": self.max_events,
+                "ttl_seconds": self.ttl,
+                "claims": self.claims,
+                "duplicates": self.duplicates
+            }
+
+
+class SupabaseEventStore:
+    """
+    Claimed keys in the slack_events table, shared across workers.
+
+    The primary key makes the insert the claim: a batch containing a key that
+    already exists fails as a whole, so exactly one worker gets each delivery.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, fallback: Optional[InProcessEventStore] = None):
+        """
+        Args:
+            ttl: Seconds a claimed key blocks duplicates
+            fallback: Store used while Supabase is unavailable
+        """
+        self.ttl = ttl
+        self.fallback = fallback or InProcessEventStore(ttl)
+        self._last_prune = 0.0
+        self.claims = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def _prune(self, force: bool = False) -> None:
+        if not force and time.time() - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = time.time()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        db_operations.delete_slack_events_before(cutoff.isoformat())
+
+    def claim(self, keys: List[str]) -> bool:
+        """Claim a delivery (see InProcessEventStore.claim); falls back to in-process on errors."""
+        if not keys:
+            return True
+        try:
+            self._prune()
+            if not db_operations.claim_slack_event_keys(keys):
+                # The conflicting row may just be past the TTL and not pruned yet
+                self._prune(force=True)
+                if not db_operations.claim_slack_event_keys(keys):
+                    self.duplicates += 1
+                    return False
+            self.claims += 1
+            # Keep the fallback warm so an outage doesn't reopen recent deliveries
+            self.fallback.claim(keys)
+            return True
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared Slack event store unavailable, deduplicating in process: {e}")
+            return self.fallback.claim(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "supabase",
+            "ttl_seconds": self.ttl,
+            "claims": self.claims,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "fallback": self.fallback.stats()
+        }
+
+
+def create_event_store(backend: str = DEFAULT_BACKEND, ttl: float = DEFAULT_TTL):
+    """Event store for the configured backend ("memory" or "supabase")."""
+    if backend == "supabase":
+        return SupabaseEventStore(ttl)
+    if backend != "memory":
+        logger.error(f"Unknown NORTHSTAR_SLACK_DEDUP_BACKEND {backend!r}, using in-process deduplication")
+    return InProcessEventStore(ttl)
@@ -0,0 +1,274 @@
+"""Progressive Slack replies.
+
+Agent answers used to appear only once a whole run had finished - tens of
+seconds of silence for a multi-step proposal. With a bot token configured,
+the agent posts a placeholder as soon as a message arrives and edits it in
+place with chat.update: stage progress while tools run, tokens as a reply
+streams, the final answer at the end.
+
+Edits are throttled per message (Slack allows roughly one chat.update per
+second per channel) and coalesced: only the latest text is sent, so a fast
+token stream costs one API call per interval, not one per token.
+
+In-progress edits are truncated to one message. A final answer longer than
+that is split at line breaks: the placeholder shows the first part and the
+rest follows as additional messages.
+
+Configuration:
+    SLACK_BOT_TOKEN                  - bot token with chat:write (streaming is off without it)
+    NORTHSTAR_SLACK_STREAMING        - "false" to disable even with a token
+    NORTHSTAR_SLACK_UPDATE_INTERVAL  - minimum seconds between edits (default 1.5)
+    SLACK_API_URL                    - Web API base URL (default https://slack.com/api)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from deadlines import deadline_timeout
+from metrics import time_dependency
+
+logger = logging.getLogger(__name__)
+
+
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api")
+UPDATE_INTERVAL = float(os.getenv("NORTHSTAR_SLACK_UPDATE_INTERVAL", "1.5"))
+MAX_MESSAGE_CHARS = 3900  # Slack truncates long messages; keep edits readable
+REQUEST_TIMEOUT = 10
+
+# StreamingReply.finish() outcomes
+SHOWN = "shown"            # Slack shows the whole final text
+PARTIAL = "partial"        # the first parts are shown; StreamingReply.unsent holds the rest
+NOT_SHOWN = "not_shown"    # none of it is shown; post the text another way
+
+
+class SlackAPIError(Exception):
+    """Slack Web API call that returned ok=false or failed in transport."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SlackWebClient:
+    """Minimal Slack Web API client for the calls the streaming reply needs."""
+
+    def __init__(self, token: str):
+        self.token = token
+
+    def _call(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = requests.post(
+                f"{SLACK_API_URL}/{method}",
+                json=payload,
+                headers={"Authorization": f"Bearer {self.token}"},
+                timeout=deadline_timeout(REQUEST_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            raise SlackAPIError(f"{method} failed: {e}")
+
+        if response.status_code == 429:
+            raise SlackAPIError(f"{method} rate limited", retry_after=float(response.headers.get("Retry-After", 1)))
+        try:
+            data = response.json()
+        except ValueError:
+            raise SlackAPIError(f"{method} failed: HTTP {response.status_code}")
+        if not data.get("ok"):
+            raise SlackAPIError(f"{method} failed: {data.get('error', 'unknown_error')}")
+        return data
+
+    @time_dependency("slack", "post_message")
+    async def post_message(self, channel: str, text: str) -> Dict[str, Any]:
+        """Post a message; the response's `ts` identifies it for updates."""
+        return await asyncio.to_thread(self._call, "chat.postMessage", {"channel": channel, "text": text})
+
+    @time_dependency("slack", "update_message")
+    async def update_message(self, channel: str, ts: str, text: str) -> Dict[str, Any]:
+        """Replace the text of a message posted by the bot."""
+        return await asyncio.to_thread(self._call, "chat.update", {"channel": channel, "ts": ts, "text": text})
+
+
+def streaming_enabled() -> bool:
+    return bool(os.getenv("SLACK_BOT_TOKEN")) and os.getenv("NORTHSTAR_SLACK_STREAMING", "true").lower() != "false"
+
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= MAX_MESSAGE_CHARS else text[:MAX_MESSAGE_CHARS - 3] + "..."
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_CHARS) -> List[str]:
+    """
+    Split text into Slack-sized parts, at line breaks where possible.
+
+    A code block cut in two is closed at the end of one part and reopened at
+    the start of the next.
+    """
+    fence = "```"
+    limit = max(limit, 2 * len(fence) + 10)
+    parts: List[str] = []
+    reopen = False
+    while text:
+        prefix = fence + "\n" if reopen else ""
+        room = limit - len(prefix) - len(fence) - 1
+        if len(prefix) + len(text) <= limit:
+            parts.append(prefix + text)
+            break
+        cut = text.rfind("\n", 0, room)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, room)
+        if cut <= 0:
+            cut = room
+        part = prefix + text[:cut].rstrip()
+        text = text[cut:].lstrip("\n")
+        reopen = part.count(fence) % 2 == 1
+        parts.append(part + ("\n" + fence if reopen else ""))
+    return parts
+
+
+class StreamingReply:
+    """
+    A Slack message posted immediately and edited in place as the answer develops.
+
+    update()/status()/step() are synchronous and never raise, so they can be
+    used directly as LLM gateway callbacks (on_delta, on_step).
+
+    Example:
+        reply = StreamingReply.create(channel)
+        if reply:
+            reply.start("Thinking...")
+            reply.status("Reading the repository")
+            await llm.chat(..., on_delta=reply.update)
+            await reply.finish(text)
+    """
+
+    def __init__(self, client: SlackWebClient, channel: str, min_interval: float = UPDATE_INTERVAL):
+        self.client = client
+        self.channel = channel
+        self.min_interval = min_interval
+        self.ts: Optional[str] = None
+        self.updates = 0
+        self._label = ""
+        self._posting: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._pending: Optional[str] = None
+        self._shown: Optional[str] = None
+        self._next_update_at = 0.0
+        self._finished = False
+        self.unsent: List[str] = []
+
+    @classmethod
+    def create(cls, channel: str) -> Optional["StreamingReply"]:
+        """A reply for the channel, or None when streaming isn't configured."""
+        if not channel or not streaming_enabled():
+            return None
+        return cls(SlackWebClient(os.getenv("SLACK_BOT_TOKEN")), channel)
+
+    def start(self, placeholder: str) -> None:
+        """Post the placeholder in the background (callers don't wait for Slack)."""
+        self._shown = placeholder
+        self._posting = asyncio.create_task(self._post(placeholder))
+
+    async def _post(self, text: str) -> Optional[str]:
+        try:
+            data = await self.client.post_message(self.channel, text)
+            self.ts = data.get("ts")
+            self._next_update_at = time.monotonic() + self.min_interval
+        except SlackAPIError as e:
+            logger.warning(f"Could not post streaming placeholder to {self.channel}: {e}")
+        return self.ts
+
+    async def _posted(self) -> bool:
+        if self._posting is None:
+            return False
+        await self._posting
+        return self.ts is not None
+
+    def update(self, text: str) -> None:
+        """Show `text` (latest call wins; sent at most once per interval)."""
+        if self._finished or self._posting is None:
+            return
+        self._pending = _truncate(text)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    def status(self, label: str) -> None:
+        """Show a progress line, e.g. "Looking through the repository"."""
+        self._label = label
+        self.update(f"_{label}..._")
+
+    def step(self, number: int, tools: List[str]) -> None:
+        """LLMGateway.run on_step callback: current step and the tools being called."""
+        detail = f"step {number}" + (f": {', '.join(tools[:3])}" if tools else "")
+        self.update(f"_{self._label or 'Working'}... ({detail})_")
+
+    async def _flush(self) -> None:
+        if not await self._posted():
+            return
+        while self._pending is not None and not self._finished:
+            delay = self._next_update_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self._pending = self._pending, None
+            if text is None or text == self._shown:
+                continue
+            await self._send(text)
+
+    async def _send(self, text: str) -> bool:
+        try:
+            await self.client.update_message(self.channel, self.ts, text)
+            self._shown = text
+            self.updates += 1
+            self._next_update_at = time.monotonic() + self.min_interval
+            return True
+        except SlackAPIError as e:
+            logger.warning(f"chat.update failed for {self.channel}: {e}")
+            self._next_update_at = time.monotonic() + max(self.min_interval, e.retry_after or 0)
+            return False
+
+    async def finish(self, text: str) -> str:
+        """
+        Replace the placeholder with the final text, dropping any pending edit.
+
+        Text longer than one message is split (split_message): the placeholder
+        gets the first part and the others are posted after it.
+
+        Returns:
+            SHOWN; NOT_SHOWN if the placeholder was never posted or the edit
+            failed (callers then post the text another way); or PARTIAL if a
+            follow-up part could not be posted, with that part and the ones
+            after it in self.unsent (callers post only those)
+        """
+        self._finished = True
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        if not await self._posted():
+            return NOT_SHOWN
+        first, *rest = split_message(text) or [""]
+        if first != self._shown:
+            delay = self._next_update_at - time.monotonic()
+            if delay > 0:
+                # Respect the interval even for the last edit, or Slack may reject it
+                await asyncio.sleep(delay)
+            if not await self._send(first):
+                return NOT_SHOWN
+        for n, part in enumerate(rest):
+            if not await self._post_followup(part):
+                self.unsent = rest[n:]
+                return PARTIAL
+        return SHOWN
+
+    async def _post_followup(self, text: str) -> bool:
+        for attempt in range(2):
+            try:
+                await self.client.post_message(self.channel, text)
+                return True
+            except SlackAPIError as e:
+                logger.warning(f"Could not post the rest of the answer to {self.channel}: {e}")
+                if attempt or e.retry_after is None:
+                    return False
+                await asyncio.sleep(e.retry_after)
+        return False
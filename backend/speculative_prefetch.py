@@ -0,0 +1,103 @@
+"""Speculative prefetch of repository state.
+
+The agent's triage stage is a full LLM round trip, and until it returns no
+repository work starts. For messages that look like they are about code,
+run_autonomous_agent starts that work alongside triage instead:
+
+    prefetch = SpeculativePrefetch()
+    prefetch.start("mirror", get_churn_index, repo, branch)
+    request_type = await triage_request(...)
+    prefetch.discard(keep=PREFETCH_JOBS_BY_TYPE.get(request_type, ()))
+    churn = await prefetch.result("mirror")
+
+Blocking jobs run in worker threads so they never hold up the event loop
+(and therefore triage itself). Discarded jobs are cancelled. A job already
+running in a thread finishes in the background and its result is dropped.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from metrics import PREFETCH_JOBS
+from tracing import child_span, redact_secrets
+
+logger = logging.getLogger(__name__)
+
+
+# Words that suggest a message is about the repository rather than small talk
+_CODE_HINTS = re.compile(
+    r"\b(repo|repository|code|codebase|pr|pull request|commit|branch|file|files|function|component|"
+    r"bug|fix|feature|implement|refactor|change|update|add|remove|rename|button|page|style|css|"
+    r"experiment|propose|proposal|improve|improvement|test|deploy|api|endpoint)\b"
+    r"|\.(py|js|jsx|ts|tsx|css|html|go|rb|java|json|md)\b",
+    re.IGNORECASE
+)
+
+
+def mentions_code(message: str) -> bool:
+    """Cheap check run before triage: is the message plausibly about the code?"""
+    return bool(message and _CODE_HINTS.search(message))
+
+
+class SpeculativePrefetch:
+    """Named background jobs started before their results are known to be needed."""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, name: str, func: Callable, *args) -> None:
+        """
+        Start a job.
+
+        Args:
+            name: Job name, used by result() and discard()
+            func: Blocking function (run in a thread) or coroutine function
+            *args: Arguments for func
+        """
+        async def run():
+            with child_span(f"prefetch.{name}", speculative=True):
+                if asyncio.iscoroutinefunction(func):
+                    return await func(*args)
+                return await asyncio.to_thread(func, *args)
+
+        self._tasks[name] = asyncio.create_task(run())
+
+    def started(self, name: str) -> bool:
+        return name in self._tasks
+
+    async def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        """
+        Wait for a job and take its result.
+
+        Args:
+            name: Job name
+            timeout: Seconds to wait before giving up on the job
+
+        Returns:
+            The job's result, or None if it wasn't started, failed or timed out
+            (callers fall back to doing the work themselves)
+        """
+        task = self._tasks.pop(name, None)
+        if task is None:
+            return None
+        try:
+            value = await asyncio.wait_for(task, timeout) if timeout else await task
+        except Exception as e:
+            logger.warning(f"Prefetch {name} failed, falling back: {redact_secrets(str(e))}")
+            PREFETCH_JOBS.inc(job=name, outcome="failed")
+            return None
+        PREFETCH_JOBS.inc(job=name, outcome="used")
+        return value
+
+    def discard(self, keep: Iterable[str] = ()) -> None:
+        """Cancel every job not in `keep` (e.g. everything, for CASUAL_CHAT)."""
+        keep = set(keep)
+        for name in [name for name in self._tasks if name not in keep]:
+            task = self._tasks.pop(name)
+            task.cancel()
+            # Retrieve a failure so it isn't reported as never retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            PREFETCH_JOBS.inc(job=name, outcome="discarded")
+            logger.info(f"Discarded speculative prefetch: {name}")
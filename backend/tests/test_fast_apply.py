@@ -0,0 +1,60 @@
+"""Replace-versus-insert placement of snippet chunks in the local Fast Apply merge."""
+
+import pytest
+
+from northstar_mcp.fast_apply import MIN_LOCAL_CONFIDENCE, MergeAmbiguous, apply_locally
+
+PYTHON = "def f(x):\n    if x:\n        return 1\n    return 0\n"
+
+JS = """function greet(name) {
+  const message = `Hi ${name}`;
+  return message;
+}
+
+function bye() {
+  return "bye";
+}
+"""
+
+
+def test_edit_after_anchor_with_marker_is_ambiguous():
+    block = "def f(x):\n    if x:\n        return 1\n    raise ValueError(x)\n# ... existing code ...\n"
+    with pytest.raises(MergeAmbiguous):
+        apply_locally(PYTHON, block)
+
+
+def test_edit_after_anchor_at_end_of_block_replaces_rest_of_file():
+    block = "def f(x):\n    if x:\n        return 1\n    raise ValueError(x)\n"
+    result = apply_locally(PYTHON, block)
+    assert result.code == "def f(x):\n    if x:\n        return 1\n    raise ValueError(x)\n"
+    assert "return 0" not in result.code
+
+
+def test_new_lines_nested_before_block_end_are_inserted():
+    block = "    if x:\n        return 1\n        # unreachable\n# ... existing code ...\n"
+    result = apply_locally(PYTHON, block)
+    assert result.code == "def f(x):\n    if x:\n        return 1\n        # unreachable\n    return 0\n"
+    assert result.confidence >= MIN_LOCAL_CONFIDENCE
+
+
+def test_statement_inserted_before_closing_brace():
+    block = "// ... existing code ...\n  return message;\n  // greeted\n// ... existing code ...\n"
+    result = apply_locally(JS, block)
+    assert "  return message;\n  // greeted\n}\n\nfunction bye() {" in result.code
+    assert result.code.count("return message;") == 1
+    assert result.confidence >= MIN_LOCAL_CONFIDENCE
+
+
+def test_sibling_lines_after_anchor_are_ambiguous():
+    block = ("// ... existing code ...\n  const message = `Hi ${name}`;\n"
+             "  return message.trim();\n// ... existing code ...\n")
+    with pytest.raises(MergeAmbiguous):
+        apply_locally(JS, block)
+
+
+def test_chunk_between_anchors_replaces_region():
+    block = ("function greet(name) {\n  const message = `Hello ${name}`;\n  return message;\n}\n"
+             "// ... existing code ...\n")
+    result = apply_locally(JS, block)
+    assert "`Hello ${name}`" in result.code and "`Hi ${name}`" not in result.code
+    assert result.code.endswith('function bye() {\n  return "bye";\n}\n')
@@ -0,0 +1,311 @@
+"""Request tracing.
+
+A trace is a tree of timed spans sharing one trace ID. The current span lives
+in a contextvar, so nested `with span(...)` blocks - including ones inside
+asyncio tasks and asyncio.to_thread calls started from a traced block - attach
+to the right parent without passing IDs around.
+
+Finished spans go to an in-process collector (recent traces, served by
+/debug/traces/{trace_id}) and, if NORTHSTAR_TRACE_FILE is set, are appended to
+that file as JSON lines.
+
+Example:
+    with start_trace("slack.event", channel=channel):
+        asyncio.create_task(run_autonomous_agent(...))   # inherits the trace
+
+    @traced("agent.run")
+    async def run_autonomous_agent(...):
+        with span("context.fetch", repo=repo):
+            ...
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+TRACE_FILE = os.getenv("NORTHSTAR_TRACE_FILE")
+MAX_TRACES = int(os.getenv("NORTHSTAR_TRACE_BUFFER", "200"))
+MAX_SPANS_PER_TRACE = 2000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("northstar_span", default=None)
+
+
+# Environment variables whose values must never appear in span errors or logs
+SECRET_ENV_VARS = ("GITHUB_TOKEN", "OPENAI_API_KEY", "MORPH_API_KEY", "METORIAL_API_KEY", "SLACK_BOT_TOKEN")
+_URL_CREDENTIALS = re.compile(r"(https?://)[^/@\s]+@")
+
+
+def redact_secrets(text: str) -> str:
+    """Mask configured secrets and credentials embedded in URLs (e.g. in a failed git command)."""
+    text = _URL_CREDENTIALS.sub(r"\1***@", text)
+    for name in SECRET_ENV_VARS:
+        value = os.getenv(name)
+        if value and len(value) >= 8:
+            text = text.replace(value, "***")
+    return text
+
+
+def _new_id(n_bytes: int) -> str:
+    return secrets.token_hex(n_bytes)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes",
+                 "start_time", "_start", "duration", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {redact_secrets(str(error))[:300]}"
+        collector.record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class TraceCollector:
+    """Keeps the most recent traces in memory and optionally appends spans to a JSONL file."""
+
+    def __init__(self, max_traces: int = MAX_TRACES, trace_file: Optional[str] = TRACE_FILE):
+        self.max_traces = max_traces
+        self.trace_file = trace_file
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, finished: Span) -> None:
+        data = finished.to_dict()
+        with self._lock:
+            spans = self._traces.get(finished.trace_id)
+            if spans is None:
+                spans = self._traces[finished.trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append(data)
+            if self.trace_file:
+                try:
+                    with open(self.trace_file, "a") as f:
+                        f.write(json.dumps(data, default=str) + "\n")
+                except OSError as e:
+                    logger.warning(f"Could not write span to {self.trace_file}: {e}")
+
+    def get(self, trace_id: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            return list(spans) if spans is not None else None
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Summaries of the most recent traces, newest first."""
+        with self._lock:
+            items = list(self._traces.items())[-limit:]
+        summaries = []
+        for trace_id, spans in reversed(items):
+            roots = [s for s in spans if s["parent_id"] is None] or spans
+            root = min(roots, key=lambda s: s["start_time"])
+            summaries.append({
+                "trace_id": trace_id,
+                "root": root["name"],
+                "start_time": root["start_time"],
+                "duration_ms": _trace_duration_ms(spans),
+                "span_count": len(spans),
+                "errors": sum(1 for s in spans if s["status"] == "error")
+            })
+        return summaries
+
+
+collector = TraceCollector()
+
+
+class span:
+    """
+    Context manager / decorator recording a span under the current trace.
+
+    Starts a new trace if none is active. Exceptions mark the span as failed
+    and propagate unchanged.
+    """
+
+    new_trace = False
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> Span:
+        parent = None if self.new_trace else _current_span.get()
+        trace_id = parent.trace_id if parent else _new_id(16)
+        self._span = Span(self.name, trace_id, parent.span_id if parent else None, dict(self.attributes))
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self._span.finish(exc)
+        return False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with type(self)(self.name, **self.attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with type(self)(self.name, **self.attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+traced = span
+
+
+class start_trace(span):
+    """Like span, but always starts a new trace (e.g. per inbound webhook)."""
+
+    new_trace = True
+
+
+class child_span(span):
+    """
+    Like span, but only recorded inside an active trace.
+
+    Used by instrumentation on shared code paths (Supabase, LLM calls, ...)
+    so untraced requests don't flood the collector with one-span traces.
+    """
+
+    def __enter__(self) -> Optional[Span]:
+        if _current_span.get() is None:
+            self._span = None
+            return None
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return False
+        return super().__exit__(exc_type, exc, tb)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current_span.get()
+    return active.trace_id if active else None
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """Set an attribute on the current span (no-op outside a trace)."""
+    active = _current_span.get()
+    if active:
+        active.set_attribute(key, value)
+
+
+class TraceIdLogFilter(logging.Filter):
+    """Adds `trace_id` to log records so log lines can be correlated with traces."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        return True
+
+
+def _trace_duration_ms(spans: List[Dict[str, Any]]) -> float:
+    start = min(s["start_time"] for s in spans)
+    end = max(s["start_time"] + (s["duration_ms"] or 0) / 1000 for s in spans)
+    return round((end - start) * 1000, 2)
+
+
+def build_waterfall(trace_id: str, width: int = 40) -> Optional[Dict[str, Any]]:
+    """
+    Assemble a trace's spans into a parent/child ordered waterfall.
+
+    Args:
+        trace_id: Trace to render
+        width: Character width of the text bars
+
+    Returns:
+        Dict with per-span offsets/depths and a text rendering, or None if the
+        trace is unknown (or has aged out of the collector)
+    """
+    spans = collector.get(trace_id)
+    if not spans:
+        return None
+
+    trace_start = min(s["start_time"] for s in spans)
+    total_ms = _trace_duration_ms(spans) or 1.0
+    span_ids = {s["span_id"] for s in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for s in spans:
+        # Spans whose parent is still running (or was dropped) are shown at the top level
+        parent = s["parent_id"] if s["parent_id"] in span_ids else None
+        children.setdefault(parent, []).append(s)
+
+    ordered = []
+
+    def visit(parent_id: Optional[str], depth: int) -> None:
+        for s in sorted(children.get(parent_id, []), key=lambda s: s["start_time"]):
+            offset_ms = round((s["start_time"] - trace_start) * 1000, 2)
+            ordered.append({**s, "depth": depth, "offset_ms": offset_ms})
+            visit(s["span_id"], depth + 1)
+
+    visit(None, 0)
+
+    lines = []
+    for s in ordered:
+        bar_start = int(s["offset_ms"] / total_ms * width)
+        bar_len = max(1, int((s["duration_ms"] or 0) / total_ms * width))
+        bar = " " * bar_start + "#" * min(bar_len, width - bar_start)
+        marker = " !" if s["status"] == "error" else ""
+        label = "  " * s["depth"] + s["name"]
+        lines.append(f"{bar:<{width}} | {s['offset_ms']:>9.1f}ms {s['duration_ms'] or 0:>9.1f}ms  {label}{marker}")
+
+    return {
+        "trace_id": trace_id,
+        "duration_ms": total_ms,
+        "span_count": len(spans),
+        "spans": ordered,
+        "waterfall": lines
+    }